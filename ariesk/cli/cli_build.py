@@ -4,6 +4,7 @@ from json import dumps
 
 from ariesk.ram import (
     StatisticalRam,
+    RotatingRamifier,
 )
 
 from .cli_build_contig import build_contig_cli
@@ -62,3 +63,13 @@ def calculate_pca_rotation_fasta(kmer_len, dropout, num_kmers, outfile, fasta_li
     }
     click.echo(f'Built rotation with {stat_ram.num_kmers_added:,} k-mers.', err=True)
     outfile.write(dumps(out))
+
+
+@build_cli.command('convert-rotation')
+@click.option('-o', '--outfile', default='rotation.npy', type=click.Path())
+@click.argument('rotation', type=click.Path())
+def convert_rotation(outfile, rotation):
+    """Convert a JSON rotation to the memory mappable .npy format."""
+    ramifier = RotatingRamifier.from_file(1, rotation)
+    ramifier.to_file(outfile)
+    click.echo(f'Wrote rotation for k={ramifier.k} to {outfile}.', err=True)
@@ -19,7 +19,7 @@ from ariesk.dbs.contig_db import ContigDB
 from ariesk.dbs.pre_contig_db import PreContigDB
 
 from ariesk.pre_db import PreDB
-from ariesk.utils.parallel_build import coordinate_parallel_build
+from ariesk.utils.parallel_build import coordinate_parallel_contig_build
 from ariesk.utils.kmers import py_needle, py_needle_2
 from Bio import SeqIO
 
@@ -33,23 +33,44 @@ def build_contig_cli():
 @click.option('-r', '--radius', default=0.01, type=float)
 @click.option('-d', '--dimension', default=8)
 @click.option('-t', '--threads', default=1)
+@click.option('-w', '--minimizer-window', default=0, help='Store only (w, k) minimizers, 0 to store every k-mer.')
+@click.option('--store-seed-indices/--no-store-seed-indices', default=False,
+              help='Store a seed index per contig instead of building it when first used.')
 @click.option('-o', '--outfile', default='ariesk_contig_cover_db.sqlite', type=click.Path())
 @click.argument('rotation', type=click.Path())
 @click.argument('fasta_list', type=click.File('r'))
-def build_contig_cover_fasta(radius, dimension, threads, outfile, rotation, fasta_list):
+def build_contig_cover_fasta(radius, dimension, threads, minimizer_window, store_seed_indices,
+                             outfile, rotation, fasta_list):
     environ['OPENBLAS_NUM_THREADS'] = f'{threads}'  # numpy uses one of these two libraries
     environ['MKL_NUM_THREADS'] = f'{threads}'
     fasta_list = [line.strip() for line in fasta_list]
-    ramifier = RotatingRamifier.from_file(dimension, rotation)
-    grid = ContigDB(
-        sqlite3.connect(outfile), ramifier=ramifier, box_side_len=radius
-    )
     click.echo(f'Adding {len(fasta_list)} fastas.', err=True)
     start = time()
-    with click.progressbar(fasta_list) as fastas:
-        for fasta_filename in fastas:
-            n_added = grid.fast_add_kmers_from_fasta(fasta_filename)
-    grid.close()
+    if threads > 1:
+        def logger(num, total):
+            click.echo(f'Finished {num + 1} shards of {total}', err=True)
+            if num + 1 == total:
+                click.echo('Merging...', err=True)
+
+        n_added = coordinate_parallel_contig_build(
+            outfile, fasta_list, rotation, threads, radius, dimension,
+            minimizer_window=minimizer_window, store_seed_indices=store_seed_indices,
+            logger=logger
+        )
+    else:
+        ramifier = RotatingRamifier.from_file(dimension, rotation)
+        grid = ContigDB(
+            sqlite3.connect(outfile), ramifier=ramifier, box_side_len=radius,
+            minimizer_window=minimizer_window, store_seed_indices=store_seed_indices
+        )
+        grid.start_bulk_load()
+        n_added = 0
+        with click.progressbar(fasta_list) as fastas:
+            for fasta_filename in fastas:
+                n_added += grid.fast_add_kmers_from_fasta(fasta_filename)
+        grid.end_bulk_load()
+        grid.save_search_tree()
+        grid.close()
     add_time = time() - start
     click.echo(
         f'Added {n_added:,} kmers to {outfile} in {add_time:.5}s. ',
@@ -70,13 +91,13 @@ def build_contig_from_pre(radius, threads, outfile, pre_list):
     start = time()
     predb = PreContigDB.load_from_filepath(pre_list[0])
     grid = ContigDB.from_predb(outfile, predb, radius)
-    grid._drop_indices()
+    grid.start_bulk_load()
     with click.progressbar(pre_list) as pres:
         for i, predb_filename in enumerate(pres):
             if i > 0:
                 grid.add_from_predb(PreContigDB.load_from_filepath(predb_filename))
-    grid.commit()
-    grid._build_indices()
+    grid.end_bulk_load()
+    grid.save_search_tree()
     grid.close()
     add_time = time() - start
     click.echo(
@@ -182,7 +203,7 @@ def build_precontig_cover_fasta(dimension, threads, outfile, rotation, fasta_lis
     environ['OPENBLAS_NUM_THREADS'] = f'{threads}'  # numpy uses one of these two libraries
     environ['MKL_NUM_THREADS'] = f'{threads}'
     fasta_list = [line.strip() for line in fasta_list]
-    ramifier = RotatingRamifier.from_file(dimension, rotation)
+    ramifier = RotatingRamifier.from_file(dimension, rotation, threads=threads)
     grid = PreContigDB(
         sqlite3.connect(outfile), ramifier=ramifier
     )
@@ -213,6 +234,7 @@ def merge_contig_dbs(contig_dbs):
                 rebuild_indices=False
             )
     main_db._build_indices()
+    main_db.save_search_tree()
     main_db.close()
     add_time = time() - start
     click.echo(
@@ -38,12 +38,13 @@ def build_kmer_cli():
 def build_grid_cover(radius, dimension, threads, num_kmers, start_offset, outfile, preload, rotation, kmer_table):
     environ['OPENBLAS_NUM_THREADS'] = f'{threads}'  # numpy uses one of these two libraries
     environ['MKL_NUM_THREADS'] = f'{threads}'
-    ramifier = RotatingRamifier.from_file(dimension, rotation)
+    ramifier = RotatingRamifier.from_file(dimension, rotation, threads=threads)
     grid = GridCoverBuilder.from_filepath(outfile, ramifier, radius)
     start = time()
     n_added = grid.fast_add_kmers_from_file(kmer_table, num_to_add=num_kmers)
     grid.commit()
     n_centers = grid.db.centroids().shape[0]
+    grid.db.save_search_tree()
     grid.close()
     add_time = time() - start
     click.echo(f'Added {n_added:,} kmers to {outfile} in {add_time:.5}s. {n_centers:,} clusters.', err=True)
@@ -59,7 +60,7 @@ def build_grid_cover_fasta(dimension, threads, outfile, rotation, fasta_list):
     environ['OPENBLAS_NUM_THREADS'] = f'{threads}'  # numpy uses one of these two libraries
     environ['MKL_NUM_THREADS'] = f'{threads}'
     fasta_list = [line.strip() for line in fasta_list]
-    ramifier = RotatingRamifier.from_file(dimension, rotation)
+    ramifier = RotatingRamifier.from_file(dimension, rotation, threads=threads)
     predb = PreDB.load_from_filepath(outfile, ramifier=ramifier)
     start = time()
     with click.progressbar(fasta_list) as fastas:
@@ -84,13 +85,14 @@ def build_grid_cover_fasta(radius, dimension, threads, outfile, rotation, fasta_
     environ['OPENBLAS_NUM_THREADS'] = f'{threads}'  # numpy uses one of these two libraries
     environ['MKL_NUM_THREADS'] = f'{threads}'
     fasta_list = [line.strip() for line in fasta_list]
-    ramifier = RotatingRamifier.from_file(dimension, rotation)
+    ramifier = RotatingRamifier.from_file(dimension, rotation, threads=threads)
     grid = GridCoverBuilder.from_filepath(outfile, ramifier, radius)
     start = time()
     with click.progressbar(fasta_list) as fastas:
         for fasta_filename in fastas:
             n_added = grid.fast_add_kmers_from_fasta(fasta_filename)
     n_centers = grid.db.centroids().shape[0]
+    grid.db.save_search_tree()
     grid.close()
     add_time = time() - start
     click.echo(
@@ -116,6 +118,20 @@ def build_grid_cover(grid_db):
     click.echo(f'Built {n_centers} bloom filters in {add_time:.5}s.', err=True)
 
 
+@build_kmer_cli.command('finalize')
+@click.argument('grid_db', type=click.Path())
+def finalize_grid_cover(grid_db):
+    """Pack each cluster into one record so searches never build blooms or subclusters."""
+    db = GridCoverDB.load_from_filepath(grid_db)
+    start = time()
+    n_centers = db.centroids().shape[0]
+    with click.progressbar(length=n_centers) as bar:
+        db.finalize(logger=lambda n, total: bar.update(n - bar.pos))
+    db.close()
+    add_time = time() - start
+    click.echo(f'Finalized {n_centers} clusters in {add_time:.5}s.', err=True)
+
+
 @build_kmer_cli.command('grid-parallel')
 @click.option('-r', '--radius', default=0.02, type=float)
 @click.option('-d', '--dimension', default=8)
@@ -133,16 +149,16 @@ def build_grid_cover(radius, dimension, threads, chunk_size, num_kmers,
         if num + 1 == total:
             click.echo('Merging...', err=True)
 
-    environ['OPENBLAS_NUM_THREADS'] = '2'  # numpy uses one of these two libraries
-    environ['MKL_NUM_THREADS'] = '2'
+    environ['OPENBLAS_NUM_THREADS'] = '1'  # numpy uses one of these two libraries
+    environ['MKL_NUM_THREADS'] = '1'
     start = time()
-    coordinate_parallel_build(
+    n_added = coordinate_parallel_build(
         outfile, kmer_table, rotation,
-        (3 * threads) // 4, start_offset, num_kmers, radius, dimension,
+        threads, start_offset, num_kmers, radius, dimension,
         chunk_size=chunk_size, logger=logger
     )
     elapsed = time() - start
-    click.echo(f'Built grid cover in {elapsed:.5}s.', err=True)
+    click.echo(f'Added {n_added:,} kmers to {outfile} in {elapsed:.5}s.', err=True)
 
 
 @build_kmer_cli.command('grid-merge')
@@ -155,7 +171,10 @@ def merge_grid_cover(final_db, other_dbs):
     final_db = GridCoverDB.load_from_filepath(final_db)
     for other_db_filename in other_dbs:
         other_db = GridCoverDB.load_from_filepath(other_db_filename)
-        final_db.load_other(other_db)
+        final_db.load_other(other_db, rebuild_indices=False)
+    final_db._build_indices()
+    final_db.save_search_tree()
+    final_db.close()
 
 
 @build_kmer_cli.command('grid-from-pre')
@@ -180,6 +199,7 @@ def build_grid_cover_fasta(radius, dimension, threads, outfile, predb_list):
             n_added = grid.add_kmers_from_predb(predb, logger=logger)
     grid.db._build_indices()  # indices are disabled by `GCB.build_from_predb`
     n_centers = grid.db.centroids().shape[0]
+    grid.db.save_search_tree()
     grid.close()
     add_time = time() - start
     click.echo(
@@ -14,6 +14,8 @@ from ariesk.ram import (
 from skbio.alignment import StripedSmithWaterman
 from Bio import SeqIO
 
+MEGABYTE = 1024 * 1024
+
 
 class TimingLogger:
 
@@ -100,17 +102,21 @@ def search_contig(verbose, radius, seq_identity, kmer_fraction, outfile, contig_
 @click.option('-i', '--seq-identity', default=50.0)
 @click.option('-f', '--kmer-fraction', default=0.5)
 @click.option('-m', '--min-hit-length', default=20)
+@click.option('-c', '--cache-mb', default=1024, help='Memory budget for cached contigs, 0 for no limit.')
+@click.option('-t', '--threads', default=1, help='Number of worker processes to search with.')
 @click.option('-o', '--outfile', default='-', type=click.File('w'))
 @click.argument('contig_db', type=click.Path())
 @click.argument('fasta', type=click.Path())
-def search_contig(verbose, num_repeats, radius, seq_identity, kmer_fraction, min_hit_length, outfile, contig_db, fasta):
+def search_contig(verbose, num_repeats, radius, seq_identity, kmer_fraction, min_hit_length, cache_mb, threads, outfile, contig_db, fasta):
     logger = None
     if verbose:
         logger = TimingLogger(lambda el: click.echo(el, err=True)).log
-    searcher = ContigSearcher.from_filepath(contig_db, logger=logger)
+    searcher = ContigSearcher.from_filepath(contig_db, logger=logger, cache_bytes=cache_mb * MEGABYTE)
     for _ in range(num_repeats):
         start = time()
-        all_hits = searcher.search_contigs_from_fasta(fasta, radius, kmer_fraction, seq_identity)
+        all_hits = searcher.search_contigs_from_fasta(
+            fasta, radius, kmer_fraction, seq_identity, threads=threads
+        )
         elapsed = time() - start
         click.echo(f'Search complete in {elapsed:.5}s', err=True)
     for query_contig, hits in all_hits.items():
@@ -185,12 +191,16 @@ def search_file(port, radius, inner_radius, inner_metric, search_mode, outfile,
 @search_cli.command('run-server')
 @click.option('-v/-q', '--verbose/--quiet', default=False)
 @click.option('-p', '--port', default=5432)
+@click.option('-t', '--threads', default=1)
+@click.option('-c', '--cache-mb', default=1024, help='Memory budget for cached clusters, 0 for no limit.')
 @click.argument('grid_cover', type=click.Path())
-def run_search_server(verbose, port, grid_cover):
+def run_search_server(verbose, port, threads, cache_mb, grid_cover):
     logger = None
     if verbose:
         logger = lambda el: click.echo(el, err=True)
-    server = SearchServer.from_filepath(port, grid_cover, logger=logger)
+    server = SearchServer.from_filepath(
+        port, grid_cover, threads=threads, cache_bytes=cache_mb * MEGABYTE, logger=logger
+    )
     click.echo(f'Starting server on port {port}', err=True)
     server.main_loop()
 
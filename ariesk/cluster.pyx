@@ -4,15 +4,28 @@
 
 import numpy as np
 cimport numpy as npc
+cimport cython
 
 from ariesk.utils.bloom_filter cimport BloomGrid, fnva
 from ariesk.utils.kmers cimport (
     encode_kmer,
     decode_kmer,
-    bounded_needle_fast,
+    myers_workspace,
+    myers_prepare,
+    myers_dist,
+    pack_kmers,
+    unpack_kmers,
 )
 
 COARSEN = 10
+BUNDLE_HEADER_LEN = 13  # int64 fields at the start of a bundle, see `Cluster.to_bundle`
+INNER_CLUSTER_TYPES = ['linear', 'spherical']
+
+
+def _padded(arr):
+    """Return the bytes of arr padded to a multiple of 8 so the next array stays aligned."""
+    cdef bytes raw = np.ascontiguousarray(arr).tobytes()
+    return raw + bytes(-len(raw) % 8)
 
 
 cdef class Cluster:
@@ -20,6 +33,7 @@ cdef class Cluster:
     def __cinit__(self, centroid_id, seqs, sub_k):
         self.centroid_id = centroid_id
         self.seqs = seqs
+        self.packed_seqs = None
         self.n_seqs = self.seqs.shape[0]
         self.k = seqs.shape[1]
         self.sub_k = sub_k
@@ -38,81 +52,159 @@ cdef class Cluster:
         for i in range(self.seqs.shape[0]):
             self.bloom_grid.add(self.seqs[i, :])
 
+    cpdef bytes to_bundle(self):
+        """Return the seqs, bloom grid and subclusters of this cluster as one record.
+
+        The record is a header of BUNDLE_HEADER_LEN int64s followed by
+        each array, 8 byte aligned. Seqs are packed 2 bits per base unless
+        they contain an N. Bloom grid and subclusters must be built.
+        """
+        seqs = np.asarray(self.seqs)
+        cdef bint packed = seqs.shape[0] > 0 and seqs.max() <= 3
+        if packed:
+            seqs = np.asarray(pack_kmers(seqs))
+        cdef BloomGrid bg = self.bloom_grid
+        header = np.array([
+            self.n_seqs, self.k, packed,
+            bg.col_k, bg.row_k, bg.grid_width, bg.grid_height,
+            bg.bitarray.shape[0], bg.row_hashes.shape[0], bg.col_hashes.shape[0],
+            len(self.inner_centers), self.inner_radius,
+            INNER_CLUSTER_TYPES.index(self.inner_cluster_type),
+        ], dtype=np.int64)
+        return b''.join([
+            header.tobytes(),
+            _padded(seqs),
+            _padded(bg.bitarray),
+            _padded(bg.bitgrid),
+            _padded(bg.row_hashes),
+            _padded(bg.col_hashes),
+            _padded(np.array(self.inner_centers, dtype=np.int64)),
+            _padded(np.asarray(self.inner_assignments, dtype=np.int32)),
+        ])
+
+    @classmethod
+    def from_bundle(cls, int centroid_id, bundle):
+        """Return the Cluster stored by `to_bundle`."""
+        buf = bytearray(bundle)  # one copy so the arrays below are writable
+        cdef list header = np.frombuffer(buf, dtype=np.int64, count=BUNDLE_HEADER_LEN).tolist()
+        (
+            n_seqs, k, packed, col_k, row_k, grid_width, grid_height,
+            n_bitarray, n_row_hashes, n_col_hashes, n_inner_centers, inner_radius, inner_type,
+        ) = header
+        offset = 8 * BUNDLE_HEADER_LEN
+
+        def take(dtype, shape):
+            nonlocal offset
+            count = int(np.prod(shape))
+            arr = np.frombuffer(buf, dtype=dtype, count=count, offset=offset).reshape(shape)
+            offset += count * arr.itemsize
+            offset += -offset % 8
+            return arr
+
+        packed_seqs = None
+        if packed:
+            packed_seqs = take(np.uint8, (n_seqs, (k + 3) // 4))
+            seqs = np.asarray(unpack_kmers(packed_seqs, k))
+        else:
+            seqs = take(np.uint8, (n_seqs, k))
+        bitarray = take(np.uint8, (n_bitarray,))
+        bitgrid = take(np.uint8, (grid_height, grid_width))
+        row_hashes = take(np.uint64, (n_row_hashes, row_k))
+        col_hashes = take(np.uint64, (n_col_hashes, col_k))
+        cdef Cluster cluster = cls(centroid_id, seqs, col_k)
+        cluster.packed_seqs = packed_seqs  # kept for `hamming_packed`, None if a seq has an N
+        cluster.bloom_grid = BloomGrid(col_k, row_k, grid_width, grid_height, row_hashes, col_hashes)
+        cluster.bloom_grid.bitarray = bitarray
+        cluster.bloom_grid.bitgrid = bitgrid
+        cluster.inner_centers = take(np.int64, (n_inner_centers,)).tolist()
+        cluster.set_inner_assignments(take(np.int32, (n_seqs,)))
+        cluster.inner_radius = inner_radius
+        cluster.inner_cluster_type = INNER_CLUSTER_TYPES[inner_type]
+        return cluster
+
+    cpdef long nbytes(self):
+        """Return the approximate memory used by the arrays of this cluster."""
+        cdef long n = np.asarray(self.seqs).nbytes
+        if self.packed_seqs is not None:
+            n += np.asarray(self.packed_seqs).nbytes
+        if self.inner_assignments is not None:
+            n += np.asarray(self.inner_assignments).nbytes
+            n += np.asarray(self.inner_offsets).nbytes
+            n += np.asarray(self.inner_members).nbytes
+        if self.bloom_grid is not None:
+            n += np.asarray(self.bloom_grid.bitarray).nbytes
+            n += np.asarray(self.bloom_grid.bitgrid).nbytes
+            n += np.asarray(self.bloom_grid.row_hashes).nbytes
+            n += np.asarray(self.bloom_grid.col_hashes).nbytes
+        return n
+
     cpdef build_subclusters(self, int radius):
         if self.n_seqs <= COARSEN:
             self.build_linear_subclusters()
         else:
             self.build_spherical_subclusters(radius)
 
+    cpdef set_inner_assignments(self, npc.int32_t[:] assignments):
+        """Set the subcluster of each seq and index the members of each subcluster.
+
+        assignments[i] is the position in inner_centers of the center seq i
+        belongs to, or -1 if it belongs to none (centers belong to none).
+        Members of center c are inner_members[inner_offsets[c]:inner_offsets[c + 1]].
+        """
+        self.inner_assignments = assignments
+        assigned = np.asarray(assignments)
+        members = np.flatnonzero(assigned >= 0)
+        self.inner_members = members[np.argsort(assigned[members], kind='stable')].astype(np.int64)
+        self.inner_offsets = np.concatenate([
+            [0], np.cumsum(np.bincount(assigned[members], minlength=len(self.inner_centers)))
+        ]).astype(np.int64)
+
     cdef build_linear_subclusters(self):
-        self.inner_clusters = np.zeros((self.n_seqs, self.n_seqs), dtype=np.uint64)
-        self.inner_centers = []
+        self.inner_centers = list(range(self.n_seqs))
         self.inner_radius = 0
         self.inner_cluster_type = 'linear'
-        cdef int seq_i
-        for seq_i in range(self.n_seqs):
-            self.inner_centers.append(seq_i)
+        self.set_inner_assignments(np.full((self.n_seqs,), -1, dtype=np.int32))
 
     cdef build_spherical_subclusters(self, int radius):
         cdef list centers = []
-        cdef npc.uint64_t[:, :] clusters = np.zeros((self.n_seqs, self.n_seqs), dtype=np.uint64)
-        cdef double[:, :] score = 1000 * np.ones((self.k + 1, self.k + 1))
-        cdef int seq_i, center_i
-        cdef double dist
+        cdef npc.int32_t[:] assignments = np.full((self.n_seqs,), -1, dtype=np.int32)
+        cdef npc.uint64_t[:] work = myers_workspace(self.k)
+        cdef int seq_i, c
         for seq_i in range(self.n_seqs):
             added = False
-            for center_i in centers:
-                dist = bounded_needle_fast(
-                    self.seqs[seq_i], self.seqs[center_i], radius, False, score
-                )
-                if dist <= radius:
-                    clusters[center_i, seq_i] = 1
+            myers_prepare(self.seqs[seq_i], work)
+            for c in range(len(centers)):
+                if myers_dist(work, self.k, self.seqs[centers[c]], radius) <= radius:
+                    assignments[seq_i] = c
                     added = True
                     break
             if not added:
                 centers.append(seq_i)
         self.inner_radius = radius
         self.inner_centers = centers
-        self.inner_clusters = clusters
+        self.set_inner_assignments(assignments)
         self.inner_cluster_type = 'spherical'
 
     def py_search_cluster(self, str seq, int bound):
-        cdef double[:, :] score = 1000 * np.ones((self.k + 1, self.k + 1))
-        return np.array(self.search_cluster(encode_kmer(seq), bound, score))
+        return np.array(self.search_cluster(encode_kmer(seq), bound))
+
+    cdef double[:] search_cluster(self, npc.uint8_t[:] seq, int bound):
+        """Return the distance from seq to each member, 1000 where it exceeds bound.
 
-    cdef double[:] search_cluster(self, npc.uint8_t[:] seq, int bound, double[:, :] score):
-        cdef int n_seqs = len(self.seqs)
+        Runs without the GIL so clusters can be searched from several threads.
+        """
         cdef double[:] dists = 1000 * np.ones((self.n_seqs,))
-        for center_i in self.inner_centers:
-            dist = bounded_needle_fast(
-                seq, self.seqs[center_i], bound - self.inner_radius, False, score
+        cdef npc.int64_t[:] centers = np.array(self.inner_centers, dtype=np.int64)
+        cdef npc.uint8_t[:, :] seqs = self.seqs
+        cdef npc.int64_t[:] offsets = self.inner_offsets
+        cdef npc.int64_t[:] members = self.inner_members
+        cdef npc.uint64_t[:] work = myers_workspace(seq.shape[0])
+        with nogil:
+            search_seqs(
+                seq, seqs, centers, offsets, members, self.inner_radius, bound, work, dists
             )
-            if dist <= (bound - self.inner_radius):
-                dists[center_i] = dist
-                for i in range(self.n_seqs):
-                    if self.inner_clusters[center_i, i] > 0:
-                        dists[i] = dist
-            elif dist <= bound:
-                dists[center_i] = dist
-                for i in range(self.n_seqs):
-                    if self.inner_clusters[center_i, i] > 0:
-                        dist = bounded_needle_fast(
-                            seq, self.seqs[i], bound, False, score
-                        )
-                        if dist >= bound:
-                            dists[i] = dist
-            elif dist <= (bound + self.inner_radius):
-                for i in range(self.n_seqs):
-                    if self.inner_clusters[center_i, i] > 0:
-                        dist = bounded_needle_fast(
-                            seq, self.seqs[i], bound, False, score
-                        )
-                        if dist >= bound:
-                            dists[i] = dist
         return dists
 
-
-
     def py_test_membership(self, str seq, int allowed_misses):
         return self.test_membership(encode_kmer(seq), allowed_misses)
 
@@ -170,3 +262,36 @@ cdef class Cluster:
         np_seqs = np.array([encode_kmer(seq) for seq in seqs])
         out = cls(centroid_id, np_seqs, sub_k, **kwargs)
         return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void search_seqs(npc.uint8_t[:] seq, npc.uint8_t[:, :] seqs, npc.int64_t[:] centers,
+                      npc.int64_t[:] offsets, npc.int64_t[:] members, int inner_radius, int bound,
+                      npc.uint64_t[:] work, double[:] dists) noexcept nogil:
+    """Fill dists for `Cluster.search_cluster`, aligning to inner centers first."""
+    cdef int c, center_i
+    cdef npc.int64_t m, i
+    cdef double dist
+    cdef int k = seq.shape[0]
+    myers_prepare(seq, work)
+    for c in range(centers.shape[0]):
+        center_i = centers[c]
+        dist = myers_dist(work, k, seqs[center_i], bound + inner_radius)
+        if dist <= (bound - inner_radius):
+            dists[center_i] = dist
+            for m in range(offsets[c], offsets[c + 1]):
+                dists[members[m]] = dist
+        elif dist <= bound:
+            dists[center_i] = dist
+            for m in range(offsets[c], offsets[c + 1]):
+                i = members[m]
+                dist = myers_dist(work, k, seqs[i], bound)
+                if dist >= bound:
+                    dists[i] = dist
+        elif dist <= (bound + inner_radius):
+            for m in range(offsets[c], offsets[c + 1]):
+                i = members[m]
+                dist = myers_dist(work, k, seqs[i], bound)
+                if dist >= bound:
+                    dists[i] = dist
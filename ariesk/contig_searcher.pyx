@@ -4,23 +4,50 @@
 
 cimport numpy as npc
 import numpy as np
+import sqlite3
+from multiprocessing import get_context
 from libc.stdio cimport *
 from posix.stdio cimport * # FILE, fopen, fclose
 from libc.stdlib cimport malloc, free
 from ariesk.ckdtree cimport cKDTree
 from ariesk.ssw cimport StripedSmithWaterman
 from ariesk.dbs.contig_db cimport ContigDB
+from ariesk.utils.lru_cache import DEFAULT_CACHE_BYTES
 from ariesk.utils.kmers cimport (
     needle_dist,
     hamming_dist,
     encode_kmer,
     decode_kmer,
-    encode_seq_from_buffer,
 )
+from ariesk.utils.seq_reader import SeqReader
 from ariesk.seed_align cimport seed_and_extend, get_query_kmers
 
 cdef npc.uint8_t K_LEN = 7
 cdef npc.uint8_t K_GAP = 3
+SEARCH_CHUNK_SIZE = 16  # query records sent to a worker at once
+
+_worker_searcher = None  # set in each worker process by `_init_search_worker`
+
+
+def _init_search_worker(searcher, str db_filepath):
+    """Keep the searcher inherited from the parent, with a connection of this process's own."""
+    global _worker_searcher
+    searcher.db.conn = sqlite3.connect(db_filepath, cached_statements=10 * 1000)
+    _worker_searcher = searcher
+
+
+def _hits_as_arrays(hits):
+    """Return search hits with their qseq and tseq views as ndarrays."""
+    return [
+        (contig_name, align_score, qstart, qend, tstart, tend, np.asarray(qseq), np.asarray(tseq))
+        for contig_name, align_score, qstart, qend, tstart, tend, qseq, tseq in hits
+    ]
+
+
+def _search_record(args):
+    name, seq, coarse_radius, kmer_fraction, identity = args
+    cdef ContigSearcher searcher = _worker_searcher
+    return name, _hits_as_arrays(searcher.search(seq, coarse_radius, kmer_fraction, identity))
 
 
 cdef void add_range_to_range_list(int range_start, int range_end, list range_list, int slosh):
@@ -92,22 +119,10 @@ cdef class ContigSearcher:
             self.logger = logger
             self.logger('Loading searcher...')
         self.db = contig_db
-        self.db.c_get_centroids()
-        self.centroid_rfts = np.ndarray(
-            (self.db.cached_centroids.shape[0], self.db.cached_centroids.shape[1])
-        )
-        if self.logging:
-            self.logger(f'Preprocessing centers')
-        for i in range(self.db.cached_centroids.shape[0]):
-            for j in range(self.db.ramifier.d):
-                self.centroid_rfts[i, j] = self.db.cached_centroids[i, j]
-                self.centroid_rfts[i, j] *= self.db.box_side_len
-                self.centroid_rfts[i, j] += (self.db.box_side_len / 2)
+        self.tree = self.db.c_get_search_tree()
+        self.centroid_rfts = self.tree.data
         if self.logging:
-            self.logger(f'Building search tree...')
-        self.tree = cKDTree(self.centroid_rfts, logger=logger)
-        if self.logging:
-            self.logger(f'Built search tree.')
+            self.logger(f'Loaded search tree.')
         self.radius = (self.db.ramifier.d ** (0.5)) * self.db.box_side_len
         
         
@@ -125,8 +140,7 @@ cdef class ContigSearcher:
     cdef list search(self, npc.uint8_t[:] query, double coarse_radius, double kmer_fraction, double identity_thresh):
         if self.logging:
             self.logger(f'Starting query. Coarse radius {coarse_radius}, k-mer fraction {kmer_fraction}')
-        cdef npc.uint32_t n_kmers = (query.shape[0] - self.db.ramifier.k + 1) // (self.db.ramifier.k // 2)
-        cdef dict centroids_to_query_ranges = self.coarse_search(n_kmers, query, coarse_radius)
+        cdef dict centroids_to_query_ranges = self.coarse_search(query, coarse_radius)
         if self.logging:
             self.logger(f'Coarse search complete. {len(centroids_to_query_ranges)} candidates.')
         cdef dict merged_coarse_hits = self.merge_coarse_hits(centroids_to_query_ranges)
@@ -135,8 +149,9 @@ cdef class ContigSearcher:
         cdef str contig_key
         cdef npc.uint64_t[:, :] matched_intervals
         cdef list out = []
+        cdef dict aligners = {}
         for contig_key, matched_intervals in merged_coarse_hits.items():
-            out += self.fine_search(query, contig_key, matched_intervals, identity_thresh)
+            out += self.fine_search(query, contig_key, matched_intervals, identity_thresh, aligners)
         if self.logging:
             self.logger(f'Fine search complete. {len(out)} passed.')
         return out
@@ -179,7 +194,13 @@ cdef class ContigSearcher:
             matched_pos_by_contig[contig_key] = matched_pos
         return matched_pos_by_contig
 
-    cdef list fine_search(self, npc.uint8_t[:] query, str contig_name, npc.uint64_t[:, :] matched_pos, double perc_id_thresh):
+    cdef list fine_search(self, npc.uint8_t[:] query, str contig_name, npc.uint64_t[:, :] matched_pos,
+                          double perc_id_thresh, dict aligners):
+        """Align matched intervals, reusing one SSW profile per query window.
+
+        `aligners` maps (qstart, qend) to a StripedSmithWaterman and is
+        shared across every contig searched for the same query.
+        """
         cdef int interval_i
         cdef list out = []
         cdef npc.uint8_t[:] qseq, tseq
@@ -187,12 +208,13 @@ cdef class ContigSearcher:
         cdef int slop = self.db.ramifier.k
         cdef StripedSmithWaterman aligner
         cdef double align_score
+        cdef dict targets_by_window = {}
+        cdef list windows = []
         for interval_i in range(matched_pos.shape[0]):
             qstart = 0
             if slop < matched_pos[interval_i, 0]:
                 qstart = matched_pos[interval_i, 0] - slop
             qend = min(query.shape[0], matched_pos[interval_i, 1] + slop)
-            qseq = query[qstart:qend]
             tstart = 0
             if matched_pos[interval_i, 2] > slop:
                 tstart = matched_pos[interval_i, 2] - slop
@@ -200,39 +222,49 @@ cdef class ContigSearcher:
             if (qend - qstart) < self.db.ramifier.k or (tend - tstart) < self.db.ramifier.k:
                 continue
             tseq = self.db.get_seq(contig_name, tstart, tend)
-            aligner = StripedSmithWaterman(qseq)
-            align_score = aligner.align(tseq)
+            window = (qstart, qend)
+            if window not in targets_by_window:
+                targets_by_window[window] = []
+            windows.append((window, len(targets_by_window[window]), tstart, tend, tseq))
+            targets_by_window[window].append(tseq)
+
+        cdef dict scores_by_window = {}
+        for window, tseqs in targets_by_window.items():
+            aligner = aligners.get(window)
+            if aligner is None:
+                aligner = StripedSmithWaterman(query[window[0]:window[1]])
+                aligners[window] = aligner
+            scores_by_window[window] = aligner.align_many(tseqs)
+
+        for window, target_i, tstart, tend, tseq in windows:
+            qstart, qend = window
+            align_score = scores_by_window[window][target_i]
             align_score /= 2 * (qend - qstart)
             align_score *= 100
-            #align_score = needle_dist(qseq, tseq, True)
             if align_score >= perc_id_thresh:
+                qseq = query[qstart:qend]
                 out.append((contig_name, align_score, qstart, qend, tstart, tend, qseq, tseq))
         return out
 
-    cdef double[:, :] _query_kmers(self, int n_kmers, npc.uint8_t[:] query, int kmer_gap):
-        cdef double[:] rft
-        cdef double[:, :] rfts = np.ndarray(
-            (n_kmers, self.db.ramifier.d)
-        )
-        cdef int i, j, k_start, k_end
-        for i in range(n_kmers):
-            k_start = i * kmer_gap
-            k_end = k_start + self.db.ramifier.k
-            rft = self.db.ramifier.c_ramify(query[k_start:k_end])
-            for j in range(self.db.ramifier.d):
-                rfts[i, j] = rft[j]
-        return rfts
-
-    cdef dict coarse_search(self, int n_kmers, npc.uint8_t[:] query, double coarse_radius):
-        cdef int kmer_gap = self.db.ramifier.k // 2
-        cdef double[:, :] rfts = self._query_kmers(n_kmers, query, kmer_gap)
+    cdef npc.int64_t[:] _query_kmer_starts(self, npc.uint8_t[:] query):
+        """Return the starts of query k-mers to embed, sampled the way the db was built.
+
+        Every (k // 2)-th k-mer unless the db was built with a minimizer window.
+        """
+        return self.db.kmer_starts(query, self.db.ramifier.k // 2)
+
+    cdef dict coarse_search(self, npc.uint8_t[:] query, double coarse_radius):
+        cdef npc.int64_t[:] starts = self._query_kmer_starts(query)
+        if starts.shape[0] == 0:
+            return {}
+        cdef double[:, :] rfts = self.db.ramifier.c_ramify_starts(query, starts)
         cdef cKDTree query_tree = cKDTree(rfts)
         cdef list centroid_hits
         cdef dict centroids_to_query_ranges = {}
         cdef int kmer_i = 0
         cdef int kmer_start, kmer_end, hit
         for centroid_hits in query_tree.query_ball_tree(self.tree, coarse_radius + self.radius):
-            kmer_start = kmer_i * kmer_gap
+            kmer_start = starts[kmer_i]
             kmer_end = kmer_start + self.db.ramifier.k
             for hit in centroid_hits:
                 if hit in centroids_to_query_ranges:
@@ -244,36 +276,36 @@ cdef class ContigSearcher:
             kmer_i += 1
         return centroids_to_query_ranges
 
-    def search_contigs_from_fasta(self, str filename, double coarse_radius, double kmer_fraction, double identity):
-        cdef FILE * cfile = fopen(filename.encode("UTF-8"), "rb")
-        if cfile == NULL:
-            raise FileNotFoundError(2, "No such file or directory: '%s'" % filename)
-
-        cdef int n_added = 0
-        cdef char * line = NULL
-        cdef char * header = NULL
-        cdef size_t l = 0
-        cdef ssize_t read
-        cdef size_t n_kmers_in_line, i
-        cdef npc.uint8_t[:] seq
+    def search_contigs_from_fasta(self, str filename, double coarse_radius, double kmer_fraction,
+                                  double identity, int threads=1):
+        """Return a dict of query name to hits for each record of a fasta or fastq file, in file order.
+
+        With threads > 1 records are searched by a pool of forked worker
+        processes which share the loaded db and search tree. Dbs that are
+        not stored in a file are always searched in this process.
+        """
         cdef dict out = {}
-        while True:
-            getline(&header, &l, cfile)
-            read = getdelim(&line, &l, b'>', cfile)
-            if read == -1: break
-            seq = encode_seq_from_buffer(line, l)
-            out[str(header).strip()[2:-3].strip()] = self.search(seq, coarse_radius, kmer_fraction, identity)
-            n_added += 1
-            header = NULL
-            line = NULL  # I don't understand why this line is necessary but
-                         # without it the program throws a strange error: 
-                         # `pointer being realloacted was not allocated`
-        fclose(cfile)
+        db_filepath = self.db.conn.execute('PRAGMA database_list').fetchone()[2]
+        if threads <= 1 or not db_filepath:
+            for name, seq in SeqReader(filename):
+                out[name] = _hits_as_arrays(
+                    self.search(np.array(seq), coarse_radius, kmer_fraction, identity)
+                )
+            return out
+        tasks = (
+            (name, np.array(seq), coarse_radius, kmer_fraction, identity)
+            for name, seq in SeqReader(filename)
+        )
+        with get_context('fork').Pool(
+            threads, initializer=_init_search_worker, initargs=(self, db_filepath)
+        ) as pool:
+            for name, hits in pool.imap(_search_record, tasks, chunksize=SEARCH_CHUNK_SIZE):
+                out[name] = hits
         return out
 
     @classmethod
-    def from_filepath(cls, filepath, logger=None):
+    def from_filepath(cls, filepath, logger=None, cache_bytes=DEFAULT_CACHE_BYTES):
         return cls(
-            ContigDB.load_from_filepath(filepath, logger=logger),
+            ContigDB.load_from_filepath(filepath, logger=logger, cache_bytes=cache_bytes),
             logger=logger
         )
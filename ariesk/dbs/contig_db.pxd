@@ -10,20 +10,29 @@ from ariesk.dbs.core_db cimport CoreDB
 cdef class ContigDB(CoreDB):
     cdef public int seq_block_len
     cdef public int current_seq_coord
+    cdef public int minimizer_window
+    cdef public bint store_seed_indices
     cdef public set genomes_added
     cdef public int coord_buffer_filled
     cdef public list coord_buffer
-    cdef public dict contig_cache
-    cdef public dict seq_cache
-    cdef public dict centroid_id_cache
-    cdef public dict contig_kmer_cache
+    cdef public list seq_buffer
+    cdef public list seed_buffer
+    cdef public bint bulk_loading
+    cdef public int saved_synchronous
+    cdef public str saved_journal_mode
 
     cpdef _build_tables(self)
     cpdef _build_indices(self)
     cpdef _drop_indices(self)
+    cpdef start_bulk_load(self)
+    cpdef end_bulk_load(self)
+    cdef _clear_buffer(self)
     cpdef list get_contigs(self, int centroid_id)
     cdef add_contig_seq(self,
                         str contig_name, int centroid_id,
                         int start_coord, int end_coord)
     cdef add_contig(self, str contig_name, npc.uint8_t[:] contig, int gap=?)
-    cdef npc.uint8_t[:] get_seq(self, str contig_name, int start_coord, int end_coord)
\ No newline at end of file
+    cdef npc.int64_t[:] kmer_starts(self, npc.uint8_t[:] seq, int gap)
+    cdef npc.uint8_t[:] get_seq(self, str contig_name, int start_coord, int end_coord)
+    cdef const npc.uint32_t[:] get_seed_index(self, str contig_name)
+    cdef npc.uint64_t[:, :] seed_extend(self, npc.uint8_t[:] query, str contig_name)
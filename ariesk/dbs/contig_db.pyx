@@ -11,29 +11,48 @@ from libc.stdlib cimport malloc, free
 from math import ceil
 from libc.math cimport floor
 
-from ariesk.utils.kmers cimport encode_kmer, decode_kmer, encode_seq_from_buffer
+from ariesk.utils.kmers cimport encode_kmer, decode_kmer, minimizer_starts
+from ariesk.utils.seq_reader cimport SeqReader
 from ariesk.dbs.core_db cimport CoreDB
-from ariesk.seed_align cimport get_target_kmers
+from ariesk.utils.lru_cache import DEFAULT_CACHE_BYTES
+from ariesk.seed_align cimport get_target_kmers, get_query_kmers, seed_and_extend
+from ariesk.seed_align import (
+    SEED_WORD_SIZE,
+    SEED_WORD_GAP,
+    seed_index_to_blob,
+    seed_index_from_blob,
+)
 
 
 SEQ_BLOCK_LEN = 10 * 1000
 CONTIG_GAP = 2
 GENOME_GAP = 20
 BUFFER_SIZE = 10 * 1000
+SEQ_BUFFER_SIZE = 100  # whole contigs, kept small since each may be megabases
+RAMIFY_BLOCK_SIZE = 10 * 1000  # k-mers ramified at once, bounds memory on large genomes
+CONTIG_ROW_BYTES = 200  # rough size of a cached (contig_name, start, end) tuple, excluding the name
+CONTIG_END = 2 ** 31 - 1  # end coord past the end of any contig, for `get_seq`
 
 
+def recode_contig_blobs(seq_rows, CoreDB source, CoreDB dest):
+    """Yield nucl_seqs rows of source with seqs stored the way dest stores them."""
+    for contig_name, seq in seq_rows:
+        yield contig_name, dest.encode_contig_blob(source.decode_contig_blob(seq))
+
 
 cdef class ContigDB(CoreDB):
 
-    def __cinit__(self, conn, ramifier=None, box_side_len=None, logger=None):
+    def __cinit__(self, conn, ramifier=None, box_side_len=None, logger=None,
+                  cache_bytes=DEFAULT_CACHE_BYTES, minimizer_window=0, store_seed_indices=False):
         super().__init__(conn, ramifier=ramifier, box_side_len=box_side_len)
         self.seq_block_len = SEQ_BLOCK_LEN
         self.current_seq_coord = 0
         self.genomes_added = set()
-        self.contig_cache = {}
-        self.seq_cache = {}
-        self.contig_kmer_cache = {}
-        self.centroid_id_cache = {}
+        self.coord_buffer = [None] * BUFFER_SIZE
+        self.coord_buffer_filled = 0
+        self.seq_buffer = []
+        self.seed_buffer = []
+        self.bulk_loading = False
         self._build_tables()
         self._build_indices()
         try:
@@ -47,6 +66,24 @@ cdef class ContigDB(CoreDB):
                     ('seq_block_len', str(self.seq_block_len)),
                 ]
             )
+        try:
+            val = self.conn.execute('SELECT value FROM basics WHERE name=?', ('minimizer_window',))
+            self.minimizer_window = int(list(val)[0][0])
+        except IndexError:  # new dbs take the argument, older dbs stored every k-mer
+            self.minimizer_window = minimizer_window if ramifier is not None else 0
+            self.conn.execute(
+                'INSERT INTO basics VALUES (?,?)',
+                ('minimizer_window', str(self.minimizer_window))
+            )
+        try:
+            val = self.conn.execute('SELECT value FROM basics WHERE name=?', ('store_seed_indices',))
+            self.store_seed_indices = int(list(val)[0][0])
+        except IndexError:  # seed indices are otherwise built from contig seqs when first used
+            self.store_seed_indices = store_seed_indices
+            self.conn.execute(
+                'INSERT INTO basics VALUES (?,?)',
+                ('store_seed_indices', str(int(self.store_seed_indices)))
+            )
         if self.logging:
             logger('Loaded Contig Database.')
 
@@ -67,18 +104,50 @@ cdef class ContigDB(CoreDB):
             seq BLOB
             )'''
         )
+        self.conn.execute(
+            '''CREATE TABLE IF NOT EXISTS seed_indices (
+            contig_name text,
+            seed_index BLOB
+            )'''
+        )
 
     cpdef _build_indices(self):
         if self.logging:
             self.logger('Building SQL indices...')
         self.conn.execute('CREATE INDEX IF NOT EXISTS IX_contigs_centroid ON contigs(centroid_id)')
         self.conn.execute('CREATE INDEX IF NOT EXISTS IX_nucl_seqs_genome ON nucl_seqs(contig_name)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS IX_seed_indices_contig ON seed_indices(contig_name)')
 
     cpdef _drop_indices(self):
         self.conn.execute('DROP INDEX IF EXISTS IX_contigs_centroid')
         self.conn.execute('DROP INDEX IF EXISTS IX_nucl_seqs_genome')
+        self.conn.execute('DROP INDEX IF EXISTS IX_seed_indices_contig')
+
+    cpdef start_bulk_load(self):
+        """Speed up a large build at the cost of durability until `end_bulk_load`.
+
+        Drops indices and turns off syncing and the on-disk journal. Each
+        flushed batch of inserts is committed as one transaction.
+        """
+        self.commit()
+        self.bulk_loading = True
+        self._drop_indices()
+        self.saved_synchronous = self.conn.execute('PRAGMA synchronous').fetchone()[0]
+        self.saved_journal_mode = self.conn.execute('PRAGMA journal_mode').fetchone()[0]
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('PRAGMA journal_mode=MEMORY')
+
+    cpdef end_bulk_load(self):
+        """Flush, rebuild indices and restore the pragmas set before `start_bulk_load`."""
+        self.commit()
+        self.bulk_loading = False
+        self.conn.execute(f'PRAGMA synchronous={self.saved_synchronous}')
+        self.conn.execute(f'PRAGMA journal_mode={self.saved_journal_mode}')
+        self._build_indices()
+        self.conn.commit()
 
     def get_all_contigs(self):
+        self._clear_buffer()
         cdef list out = []
         for vals in self.conn.execute('SELECT * FROM contigs'):
             contig_name, centroid_id, start_coord, end_coord = vals
@@ -86,8 +155,9 @@ cdef class ContigDB(CoreDB):
         return out
 
     cpdef list get_contigs(self, int centroid_id):
-        if centroid_id in self.contig_cache:
-            return self.contig_cache[centroid_id]
+        cached = self.cache.get(('contigs', centroid_id))
+        if cached is not None:
+            return cached
         cmd = '''
             SELECT contig_name, start_coord, end_coord
             FROM contigs
@@ -95,9 +165,11 @@ cdef class ContigDB(CoreDB):
         '''
         cursor = self.conn.execute(cmd, (centroid_id,))
         cdef list out = []
+        cdef long nbytes = 0
         for contig_name, start_coord, end_coord in cursor:
             out.append((contig_name, start_coord, end_coord))
-        self.contig_cache[centroid_id] = out
+            nbytes += CONTIG_ROW_BYTES + len(contig_name)
+        self.cache.put(('contigs', centroid_id), out, nbytes)
         return out
 
     def py_get_seq(self, str contig_name, int start_coord, int end_coord):
@@ -106,8 +178,9 @@ cdef class ContigDB(CoreDB):
     cdef npc.uint8_t[:] get_seq(self, str contig_name, int start_coord, int end_coord):
         cdef npc.uint8_t[:] contig
         cdef const npc.uint8_t[:] seq_blob
-        if contig_name in self.seq_cache:
-            contig = self.seq_cache[contig_name]
+        cached = self.cache.get(('seq', contig_name))
+        if cached is not None:
+            contig = cached
         else:
             cmd = '''
                 SELECT seq
@@ -115,128 +188,200 @@ cdef class ContigDB(CoreDB):
                 WHERE contig_name=?
             '''
             seq_blob = self.conn.execute(cmd, (contig_name,)).fetchone()[0]
-            contig = np.copy(np.frombuffer(seq_blob, dtype=np.uint8))
-            self.seq_cache[contig_name] = contig
+            contig = self.decode_contig_blob(seq_blob)
+            self.cache.put(('seq', contig_name), contig, contig.shape[0])
         return contig[max(start_coord, 0):min(end_coord, contig.shape[0])]
 
+    cdef const npc.uint32_t[:] get_seed_index(self, str contig_name):
+        """Return the seed index of a contig, built from its seq if none was stored."""
+        cdef const npc.uint32_t[:] seed_index
+        cached = self.cache.get(('seed_index', contig_name))
+        if cached is not None:
+            return cached
+        cmd = '''
+            SELECT seed_index
+            FROM seed_indices
+            WHERE contig_name=?
+        '''
+        row = self.conn.execute(cmd, (contig_name,)).fetchone()
+        if row is not None:
+            seed_index = seed_index_from_blob(row[0])
+        else:  # dbs built before seed indices were stored
+            seed_index = get_target_kmers(self.get_seq(contig_name, 0, CONTIG_END), SEED_WORD_SIZE)
+        self.cache.put(('seed_index', contig_name), seed_index, 4 * seed_index.shape[0])
+        return seed_index
+
+    def py_seed_extend(self, str query, str contig_name):
+        return np.array(self.seed_extend(encode_kmer(query), contig_name))
+
+    cdef npc.uint64_t[:, :] seed_extend(self, npc.uint8_t[:] query, str contig_name):
+        """Return [qstart, qend, tstart, tend] intervals of query matching a contig."""
+        return seed_and_extend(
+            query, self.get_seq(contig_name, 0, CONTIG_END),
+            get_query_kmers(query, SEED_WORD_SIZE, SEED_WORD_GAP),
+            self.get_seed_index(contig_name),
+            SEED_WORD_SIZE
+        )
+
     cdef add_contig_seq(self,
                         str contig_name, int centroid_id,
                         int start_coord, int end_coord):
-        self.conn.execute(
-            'INSERT INTO contigs VALUES (?,?,?,?)',
-            (
-                contig_name, centroid_id,
-                start_coord, end_coord,
-            )
+        self.coord_buffer[self.coord_buffer_filled] = (
+            contig_name, centroid_id, start_coord, end_coord
         )
+        self.coord_buffer_filled += 1
+        if self.coord_buffer_filled == BUFFER_SIZE:
+            self._clear_buffer()
+
+    cdef _clear_buffer(self):
+        CoreDB._clear_buffer(self)
+        if self.coord_buffer_filled > 0:
+            self.conn.executemany(
+                'INSERT INTO contigs VALUES (?,?,?,?)',
+                self.coord_buffer[:self.coord_buffer_filled]
+            )
+            self.coord_buffer_filled = 0
+        if self.seq_buffer:
+            self.conn.executemany('INSERT INTO nucl_seqs VALUES (?,?)', self.seq_buffer)
+            self.seq_buffer = []
+        if self.seed_buffer:
+            self.conn.executemany('INSERT INTO seed_indices VALUES (?,?)', self.seed_buffer)
+            self.seed_buffer = []
+        if self.bulk_loading:
+            self.conn.commit()
 
     def py_add_contig(self, str contig_name, str contig, int gap=1):
         self.add_contig(contig_name, encode_kmer(contig), gap=gap)
 
     cdef add_contig(self, str contig_name, npc.uint8_t[:] contig, int gap=1):
-        self.conn.execute(
-            'INSERT INTO nucl_seqs VALUES (?,?)',
-            (
-                contig_name,
-                np.array(contig, dtype=np.uint8).tobytes(),
-            )
-        )
-        cdef int i
+        self.seq_buffer.append((contig_name, self.encode_contig_blob(contig)))
+        if self.store_seed_indices:
+            self.seed_buffer.append((
+                contig_name, seed_index_to_blob(get_target_kmers(contig, SEED_WORD_SIZE))
+            ))
+        if len(self.seq_buffer) == SEQ_BUFFER_SIZE:
+            self._clear_buffer()
+        cdef int i, block_start, block_end, j
         cdef int section_end = 0
         cdef int section_start = 0
         cdef int current_centroid_id = -1
-        for i in range(0, contig.shape[0] - self.ramifier.k + 1, gap):
-            kmer = contig[i:i + self.ramifier.k]
-            centroid = np.floor(self.ramifier.c_ramify(kmer) / self.box_side_len, casting='safe')
-            centroid_id = self.add_centroid(centroid)
-            if current_centroid_id < 0:
-                current_centroid_id = centroid_id
-            if centroid_id != current_centroid_id:
-                self.add_contig_seq(
-                    contig_name, current_centroid_id,
-                    section_start, section_end
+        cdef npc.int64_t[:] starts = self.kmer_starts(contig, gap)
+        cdef double[:, :] centroids
+        for block_start in range(0, starts.shape[0], RAMIFY_BLOCK_SIZE):
+            block_end = min(block_start + RAMIFY_BLOCK_SIZE, starts.shape[0])
+            centroids = np.floor(np.asarray(self.ramifier.c_ramify_starts(
+                contig[starts[block_start]:starts[block_end - 1] + self.ramifier.k],
+                np.asarray(starts[block_start:block_end]) - starts[block_start]
+            )) / self.box_side_len)
+            for j in range(block_end - block_start):
+                i = starts[block_start + j]
+                centroid_id = self.add_centroid(centroids[j, :])
+                if current_centroid_id < 0:
+                    current_centroid_id = centroid_id
+                if centroid_id != current_centroid_id:
+                    self.add_contig_seq(
+                        contig_name, current_centroid_id,
+                        section_start, section_end
 
-                )
-                section_start = i
-                current_centroid_id = centroid_id
-            section_end = i + self.ramifier.k
+                    )
+                    section_start = i
+                    current_centroid_id = centroid_id
+                section_end = i + self.ramifier.k
         if section_end > section_start:
             self.add_contig_seq(
                 contig_name, current_centroid_id,
                 section_start, section_end
             )
 
+    cdef npc.int64_t[:] kmer_starts(self, npc.uint8_t[:] seq, int gap):
+        """Return the starts of the k-mers of seq this db stores or searches.
+
+        Every gap-th k-mer, or the (minimizer_window, k) minimizers if the
+        db was built with a minimizer window, in which case gap is ignored.
+        """
+        if self.minimizer_window > 0:
+            return minimizer_starts(seq, self.ramifier.k, self.minimizer_window)
+        return np.arange(0, max(seq.shape[0] - self.ramifier.k + 1, 0), gap, dtype=np.int64)
+
+    def py_kmer_starts(self, str seq, int gap=1):
+        return np.asarray(self.kmer_starts(encode_kmer(seq), gap))
+
     def commit(self):
         self._clear_buffer()
         self.conn.commit()
 
-    def load_other(self, other, rebuild_indices=True):
-        cdef dict other_centroid_remap = {}
-        for cid, centroid_blob in other.conn.execute('SELECT * FROM centroids'):
-            if centroid_blob in self.centroid_cache:
-                other_centroid_remap[cid] = self.centroid_cache[centroid_blob]
-            else:
-                other_centroid_remap[cid] = len(self.centroid_cache)
+    def load_other(self, ContigDB other, rebuild_indices=True):
+        if other.minimizer_window != self.minimizer_window:
+            raise ValueError(
+                f'Cannot merge a db with minimizer window {other.minimizer_window} '
+                f'into one with minimizer window {self.minimizer_window}'
+            )
+        other.commit()
+        cdef list other_centroid_remap = np.asarray(
+            self.add_centroids(other.c_get_centroids())
+        ).tolist()
         self._drop_indices()
-        self.conn.executemany(
-            'INSERT INTO centroids VALUES (?,?)',
-            (
-                (other_centroid_remap[cid], centroid_blob)
-                for cid, centroid_blob in other.conn.execute('SELECT * FROM centroids')
+        self.commit()
+        other_filepath = other.conn.execute('PRAGMA database_list').fetchone()[2]
+        if other_filepath and other.packed_seqs == self.packed_seqs:
+            self.conn.execute('ATTACH DATABASE ? AS other_db', (other_filepath,))
+            self.conn.execute(
+                'CREATE TEMP TABLE centroid_remap (old_id INTEGER PRIMARY KEY, new_id int)'
             )
-        )
-        self.conn.executemany(
-            'INSERT INTO contigs VALUES (?,?,?,?)',
-            (
-                (contig_name, other_centroid_remap[cid], start_coord, end_coord)
-                for contig_name, cid, start_coord, end_coord
-                in other.conn.execute('SELECT * FROM contigs')
+            self.conn.executemany(
+                'INSERT INTO centroid_remap VALUES (?,?)', enumerate(other_centroid_remap)
             )
-        )
-        self.conn.executemany(
-            'INSERT INTO nucl_seqs VALUES (?,?)',
-            (
-                (contig_name, contig)
-                for contig_name, contig
-                in other.conn.execute('SELECT * FROM nucl_seqs')
+            self.conn.execute(
+                '''INSERT INTO contigs
+                SELECT other_contigs.contig_name, centroid_remap.new_id,
+                    other_contigs.start_coord, other_contigs.end_coord
+                FROM other_db.contigs AS other_contigs
+                JOIN centroid_remap ON other_contigs.centroid_id = centroid_remap.old_id'''
             )
-        )
-        self.commit()
+            self.conn.execute('INSERT INTO nucl_seqs SELECT * FROM other_db.nucl_seqs')
+            if self.store_seed_indices:
+                self.conn.execute('INSERT INTO seed_indices SELECT * FROM other_db.seed_indices')
+            self.conn.execute('DROP TABLE centroid_remap')
+            self.conn.commit()
+            self.conn.execute('DETACH DATABASE other_db')
+        else:  # in memory dbs can not be attached, differently encoded seqs are recoded
+            self.conn.executemany(
+                'INSERT INTO contigs VALUES (?,?,?,?)',
+                (
+                    (contig_name, other_centroid_remap[cid], start_coord, end_coord)
+                    for contig_name, cid, start_coord, end_coord
+                    in other.conn.execute('SELECT * FROM contigs')
+                )
+            )
+            seq_rows = other.conn.execute('SELECT * FROM nucl_seqs')
+            if other.packed_seqs != self.packed_seqs:
+                seq_rows = recode_contig_blobs(seq_rows, other, self)
+            self.conn.executemany('INSERT INTO nucl_seqs VALUES (?,?)', seq_rows)
+            if self.store_seed_indices:
+                self.conn.executemany(
+                    'INSERT INTO seed_indices VALUES (?,?)',
+                    other.conn.execute('SELECT * FROM seed_indices')
+                )
+            self.commit()
         if rebuild_indices:
             self._build_indices()
 
     @classmethod
-    def load_from_filepath(cls, filepath, logger=None):
+    def load_from_filepath(cls, filepath, logger=None, cache_bytes=DEFAULT_CACHE_BYTES):
         """Return a GridCoverDB."""
         if logger is not None:
             logger('Connecting to SQL database...')
         connection = sqlite3.connect(filepath, cached_statements=10 * 1000)
         if logger is not None:
             logger('Loading resources from database...')
-        return ContigDB(connection, logger=logger)
+        return ContigDB(connection, logger=logger, cache_bytes=cache_bytes)
 
     def fast_add_kmers_from_fasta(self, str filename):
-        cdef FILE * cfile = fopen(filename.encode("UTF-8"), "rb")
-        if cfile == NULL:
-            raise FileNotFoundError(2, "No such file or directory: '%s'" % filename)
-
+        """Add each record of a fasta or fastq file, gzipped or not, as a contig."""
+        cdef SeqReader reader = SeqReader(filename)
         cdef int n_added = 0
-        cdef char * line = NULL
-        cdef char * header = NULL
-        cdef size_t l = 0
-        cdef ssize_t read
-        cdef size_t n_kmers_in_line, i
-        cdef npc.uint8_t[:] seq
-        while True:
-            getline(&header, &l, cfile)
-            read = getdelim(&line, &l, b'>', cfile)
-            if read == -1: break
-            seq = encode_seq_from_buffer(line, l)
-            self.add_contig(filename.strip() + '___' + str(header).strip()[2:-3].strip(), seq)
+        while reader.next_record():
+            self.add_contig(filename.strip() + '___' + reader.name, reader.record())
             n_added += 1
-            header = NULL
-            line = NULL  # I don't understand why this line is necessary but
-                         # without it the program throws a strange error: 
-                         # `pointer being realloacted was not allocated`
-        fclose(cfile)
+        reader.close()
         return n_added
@@ -2,29 +2,49 @@ import numpy as np
 cimport numpy as npc
 
 from ariesk.ram cimport RotatingRamifier
+from ariesk.ckdtree cimport cKDTree
+from ariesk.utils.cell_table cimport CellTable
+from ariesk.utils.lru_cache cimport LRUCache
+
+
+cdef bint has_table(conn, str name)
+cdef bint load_seq_encoding(conn, bint new_db, list seq_tables)
 
 
 cdef class CoreDB:
     cdef public float box_side_len
     cdef public object conn
     cdef public RotatingRamifier ramifier
-    cdef public dict centroid_cache
-    cdef public list centroid_insert_buffer
+    cdef CellTable _centroid_cache
     cdef public list kmer_insert_buffer
     cdef public int centroid_buffer_filled
     cdef public int kmer_buffer_filled
     cdef public object logger
     cdef public bint logging
-    cdef public double[:, :] cached_centroids
+    cdef public const double[:, :] cached_centroids
     cdef public bint centroids_loaded
+    cdef public LRUCache cache
+    cdef public bint packed_seqs
 
     cpdef _build_core_tables(self)
-    cdef double[:, :] c_get_centroids(self)
+    cdef const double[:, :] c_get_centroids(self)
+    cdef npc.ndarray _stored_centroids(self)
+    cdef CellTable _get_centroid_cache(self)
+    cdef _flush_centroids(self)
+    cdef bint _has_table(self, str name)
+    cpdef bytes encode_kmer_blob(self, const npc.uint8_t[:] binary_kmer)
+    cpdef npc.uint8_t[:] decode_kmer_blob(self, const npc.uint8_t[:] blob)
+    cpdef bytes encode_contig_blob(self, const npc.uint8_t[:] contig)
+    cpdef npc.uint8_t[:] decode_contig_blob(self, const npc.uint8_t[:] blob)
+    cdef cKDTree c_get_search_tree(self)
+    cdef cKDTree build_search_tree(self)
+    cdef cKDTree load_search_tree(self)
     cdef save_ramifier(self)
     cdef RotatingRamifier load_ramifier(self)
     cpdef get_kmers(self)
     cdef npc.uint8_t[:, :] get_encoded_kmers(self)
-    cdef int add_centroid(self, double[:] centroid)
+    cdef int add_centroid(self, const double[:] centroid) except -1
+    cdef npc.int32_t[:] add_centroids(self, const double[:, :] centroids)
     cdef add_point_to_cluster(
         self,
         double[:] centroid,
@@ -5,19 +5,61 @@
 import sqlite3
 import numpy as np
 cimport numpy as npc
-from ariesk.utils.kmers cimport encode_kmer, decode_kmer
+from ariesk.utils.kmers cimport (
+    encode_kmer,
+    decode_kmer,
+    encode_kmer_blob,
+    decode_kmer_blob,
+    encode_contig_blob,
+    decode_contig_blob,
+)
 from ariesk.ram cimport RotatingRamifier
+from ariesk.ram import pack_array, unpack_array
+from ariesk.ckdtree cimport cKDTree
+from ariesk.utils.cell_table cimport CellTable
+from ariesk.utils.lru_cache cimport LRUCache
+from ariesk.utils.lru_cache import DEFAULT_CACHE_BYTES
 
 BUFFER_SIZE = 10 * 1000
+CENTROID_BLOCK_SIZE = 10 * 1000  # centroids per row of centroid_blocks
+PACKED_ENCODING = 'packed'  # value of `seq_encoding` in basics, older dbs have none
 
 
 cdef simple_list(sql_cursor):
     return [el[0] for el in sql_cursor]
 
 
+cdef bint has_table(conn, str name):
+    return conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name=?", (name,)
+    ).fetchone() is not None
+
+
+cdef bint load_seq_encoding(conn, bint new_db, list seq_tables):
+    """Return True if seqs in the db of conn are packed by `pack_seq`.
+
+    Seqs are packed in dbs built since packing was added, older dbs
+    store one byte per base and are read and extended as they are. A new
+    db is marked packed unless one of seq_tables already holds a seq.
+    """
+    encoding = conn.execute(
+        'SELECT value FROM basics WHERE name=?', ('seq_encoding',)
+    ).fetchone()
+    if encoding is not None:
+        return encoding[0] == PACKED_ENCODING
+    if not new_db:
+        return False
+    for table in seq_tables:
+        if has_table(conn, table) and conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone():
+            return False
+    conn.execute('INSERT INTO basics VALUES (?,?)', ('seq_encoding', PACKED_ENCODING))
+    return True
+
+
 cdef class CoreDB:
 
-    def __cinit__(self, conn, ramifier=None, box_side_len=None, logger=None):
+    def __cinit__(self, conn, ramifier=None, box_side_len=None, logger=None,
+                  cache_bytes=DEFAULT_CACHE_BYTES, **kwargs):  # kwargs of subclasses
         self.logging = False
         if logger is not None:
             self.logging = True
@@ -25,14 +67,12 @@ cdef class CoreDB:
             self.logger('Loading core database...')
         self.conn = conn
         self.centroids_loaded = False
-        self.centroid_insert_buffer = [None] * BUFFER_SIZE
         self.centroid_buffer_filled = 0
         self.kmer_insert_buffer = [None] * BUFFER_SIZE
         self.kmer_buffer_filled = 0
 
-        self.centroid_cache = {}
-        cdef bytes centroid_key
-        cdef int i
+        self._centroid_cache = None
+        self.cache = LRUCache(cache_bytes)  # clusters, contigs, etc. read back during search
 
         self._build_core_tables()
         if ramifier is None:
@@ -42,10 +82,6 @@ cdef class CoreDB:
             self.box_side_len = float(self.conn.execute(
                 'SELECT value FROM basics WHERE name=?', ('box_side_len',)
             ).fetchone()[0])
-            self.c_get_centroids()
-            for i in range(self.cached_centroids.shape[0]):
-                centroid_key = np.array(self.cached_centroids[i, :], dtype=float).tobytes()
-                self.centroid_cache[centroid_key] = i
         else:
             if box_side_len is None:
                 box_side_len = 1
@@ -56,56 +92,174 @@ cdef class CoreDB:
             )
             self.ramifier = ramifier
             self.save_ramifier()
+        self.packed_seqs = load_seq_encoding(
+            self.conn, ramifier is not None, ['seqs', 'nucl_seqs', 'contigs']
+        )
         if self.logging:
             logger('Loaded Core Database.')
 
+    cpdef bytes encode_kmer_blob(self, const npc.uint8_t[:] binary_kmer):
+        """Return the blob a k-mer is stored as."""
+        return encode_kmer_blob(binary_kmer, self.packed_seqs)
+
+    cpdef npc.uint8_t[:] decode_kmer_blob(self, const npc.uint8_t[:] blob):
+        """Return the k-mer stored as blob."""
+        return decode_kmer_blob(blob, self.ramifier.k, self.packed_seqs)
+
+    cpdef bytes encode_contig_blob(self, const npc.uint8_t[:] contig):
+        """Return the blob a seq of any length is stored as."""
+        return encode_contig_blob(contig, self.packed_seqs)
+
+    cpdef npc.uint8_t[:] decode_contig_blob(self, const npc.uint8_t[:] blob):
+        """Return the seq stored as blob."""
+        return decode_contig_blob(blob, self.packed_seqs)
+
     cpdef _build_core_tables(self):
         if self.logging:
             self.logger('Building core SQL tables...')
         self.conn.execute('CREATE TABLE IF NOT EXISTS basics (name text, value text)')
-        self.conn.execute('CREATE TABLE IF NOT EXISTS centroids (centroid_id int, vals BLOB)')
         self.conn.execute('CREATE TABLE IF NOT EXISTS seqs (centroid_id int, seq BLOB, annotation text)')
 
     cpdef get_kmers(self):
         cdef list out = []
-        cdef const npc.uint8_t [:] binary_kmer
-        for cid, binary_kmer, annotation in self.conn.execute('SELECT * FROM seqs'):
-            binary_kmer = np.frombuffer(binary_kmer, dtype=np.uint8)
-            kmer = decode_kmer(binary_kmer)
-            out.append((cid, kmer))
+        for cid, blob, annotation in self.conn.execute('SELECT * FROM seqs'):
+            out.append((cid, decode_kmer(self.decode_kmer_blob(blob))))
         return out
 
     cdef npc.uint8_t [:, :] get_encoded_kmers(self):
         cdef int i, j
         cdef list kmers = simple_list(self.conn.execute('SELECT seq FROM seqs'))
         cdef npc.uint8_t [:, :] binary_kmers = np.ndarray((len(kmers), self.ramifier.k), dtype=np.uint8)
-        cdef const npc.uint8_t [:] binary_kmer
         for i, kmer in enumerate(kmers):
-            binary_kmer = np.frombuffer(kmer, dtype=np.uint8)
-            for j in range(self.ramifier.k):
-                binary_kmers[i, j] = binary_kmer[j]
+            binary_kmers[i, :] = self.decode_kmer_blob(kmer)
         return binary_kmers
 
-    cdef double[:, :] c_get_centroids(self):
+    cdef const double[:, :] c_get_centroids(self):
         """Return a memoryview on cetnroids in this db.
 
-        Called just once on database load.
+        Row i is the centroid with id i.
         """
         if self.centroids_loaded:
             return self.cached_centroids
         if self.logging:
             self.logger('Loading centroids from database...')
-        n_centroids = int(list(self.conn.execute('SELECT COUNT(*) FROM centroids'))[0][0])
-        cdef int i, j
-        self.cached_centroids = np.ndarray((n_centroids, self.ramifier.d))
-        cdef const double[:] centroid
-        for i, centroid_str in self.conn.execute('SELECT * FROM centroids'):
-            centroid = np.frombuffer(centroid_str, dtype=float, count=self.ramifier.d)
-            for j in range(self.ramifier.d):
-                self.cached_centroids[i, j] = centroid[j]
+        self.cached_centroids = self._stored_centroids()
         self.centroids_loaded = True
         return self.cached_centroids
 
+    cdef npc.ndarray _stored_centroids(self):
+        """Return a read only (n_centroids, d) array of the committed centroids.
+
+        Centroids are stored as consecutive rows of a float array split
+        into blocks of CENTROID_BLOCK_SIZE. Older databases have one row
+        per centroid in the `centroids` table, these are read the same way.
+        Each block is copied once, straight into an array sized up front.
+        """
+        if self._has_table('centroid_blocks'):
+            table, order = 'centroid_blocks', 'block_id'
+        elif self._has_table('centroids'):
+            table, order = 'centroids', 'centroid_id'
+        else:
+            table = None
+        cdef long n_vals = 0
+        if table is not None:
+            n_vals = self.conn.execute(
+                f'SELECT coalesce(sum(length(vals)), 0) FROM {table}'
+            ).fetchone()[0] // 8
+        cdef npc.ndarray vals = np.empty((n_vals,), dtype=float)
+        cdef long offset = 0
+        if table is not None:
+            for (block,) in self.conn.execute(f'SELECT vals FROM {table} ORDER BY {order}'):
+                block_vals = np.frombuffer(block, dtype=float)
+                vals[offset:offset + block_vals.shape[0]] = block_vals
+                offset += block_vals.shape[0]
+        vals.flags.writeable = False
+        return vals.reshape(-1, self.ramifier.d)
+
+    @property
+    def centroid_cache(self):
+        return self._get_centroid_cache()
+
+    cdef CellTable _get_centroid_cache(self):
+        """Return a table from grid cells to centroid ids.
+
+        Only needed to add centroids so it is built on first use, not on load.
+        """
+        if self._centroid_cache is None:
+            self._centroid_cache = CellTable.from_centroids(self._stored_centroids())
+        return self._centroid_cache
+
+    cdef bint _has_table(self, str name):
+        return has_table(self.conn, name)
+
+    cdef cKDTree c_get_search_tree(self):
+        """Return a KD-tree over the centers of the grid cells in this db.
+
+        Uses the tree stored by `save_search_tree` if it is still current.
+        """
+        cdef cKDTree tree = self.load_search_tree()
+        if tree is None:
+            tree = self.build_search_tree()
+        return tree
+
+    cdef cKDTree build_search_tree(self):
+        centers = np.asarray(self.c_get_centroids()) * self.box_side_len
+        centers += self.box_side_len / 2
+        if self.logging:
+            self.logger('Building search tree...')
+            return cKDTree(centers, logger=self.logger)
+        return cKDTree(centers)
+
+    cdef cKDTree load_search_tree(self):
+        """Return the stored search tree or None if it is missing or stale."""
+        try:
+            stored = dict(self.conn.execute('SELECT name, value FROM search_tree'))
+        except sqlite3.OperationalError:  # db was built before trees were stored
+            return None
+        cdef int n = self.c_get_centroids().shape[0]
+        if stored.get('n_centroids') != n or stored.get('box_side_len') != self.box_side_len:
+            return None
+        if self.logging:
+            self.logger('Loading stored search tree...')
+        cdef int m = self.ramifier.d
+        cdef cKDTree tree = cKDTree.__new__(cKDTree)
+        tree.__setstate__((
+            np.frombuffer(stored['nodes'], dtype='S1'),  # the dtype `__getstate__` uses
+            np.frombuffer(stored['data'], dtype=float).reshape(n, m).copy(),
+            n, m, stored['leafsize'],
+            np.frombuffer(stored['maxes'], dtype=float),
+            np.frombuffer(stored['mins'], dtype=float),
+            np.frombuffer(stored['indices'], dtype=np.intp),
+            None, None,
+        ))
+        return tree
+
+    def save_search_tree(self):
+        """Store a KD-tree over the centroids so searchers need not build one.
+
+        The tree is rebuilt on load if centroids are added after this is called.
+        """
+        self.commit()
+        self.centroids_loaded = False
+        cdef cKDTree tree = self.build_search_tree()
+        nodes, data, n, m, leafsize, maxes, mins, indices, _, _ = tree.__getstate__()
+        self.conn.execute('CREATE TABLE IF NOT EXISTS search_tree (name text, value BLOB)')
+        self.conn.execute('DELETE FROM search_tree')
+        self.conn.executemany(
+            'INSERT INTO search_tree VALUES (?,?)',
+            [
+                ('n_centroids', n),
+                ('box_side_len', float(self.box_side_len)),
+                ('leafsize', leafsize),
+                ('nodes', nodes.tobytes()),
+                ('data', np.asarray(data).tobytes()),
+                ('maxes', maxes.tobytes()),
+                ('mins', mins.tobytes()),
+                ('indices', np.asarray(indices, dtype=np.intp).tobytes()),
+            ]
+        )
+        self.conn.commit()
+
     def close(self):
         """Close the DB and flush data to disk."""
         self.commit()
@@ -126,7 +280,7 @@ cdef class CoreDB:
         """
         cdef int centroid_id = self.add_centroid(centroid)
         self.kmer_insert_buffer[self.kmer_buffer_filled] = (
-            centroid_id, np.array(binary_kmer, dtype=np.uint8).tobytes(), annotation
+            centroid_id, self.encode_kmer_blob(binary_kmer), annotation
         )
         self.kmer_buffer_filled += 1
         if self.kmer_buffer_filled >= BUFFER_SIZE:
@@ -134,16 +288,7 @@ cdef class CoreDB:
 
     cdef _clear_buffer(self):
         if self.centroid_buffer_filled > 0:
-            if self.centroid_buffer_filled == BUFFER_SIZE:
-                self.conn.executemany(
-                    'INSERT INTO centroids VALUES (?,?)',
-                    self.centroid_insert_buffer
-                )
-            else:
-                self.conn.executemany(
-                    'INSERT INTO centroids VALUES (?,?)',
-                    self.centroid_insert_buffer[:self.centroid_buffer_filled]
-                )
+            self._flush_centroids()
         if self.kmer_buffer_filled > 0:
             if self.kmer_buffer_filled == BUFFER_SIZE:
                 self.conn.executemany(
@@ -158,32 +303,67 @@ cdef class CoreDB:
         self.centroid_buffer_filled = 0
         self.kmer_buffer_filled = 0
 
-    cdef int add_centroid(self, double[:] centroid):
-        cdef int centroid_id
-        cdef bytes centroid_key = np.array(centroid, dtype=float).tobytes()
-        if centroid_key in self.centroid_cache:
-            centroid_id = self.centroid_cache[centroid_key]
-        else:
-            self.centroid_cache[centroid_key] = len(self.centroid_cache)
-            centroid_id = self.centroid_cache[centroid_key]
-            self.centroid_insert_buffer[self.centroid_buffer_filled] = (
-                centroid_id, centroid_key
+    cdef _flush_centroids(self):
+        """Append buffered centroids to the last, possibly partial, block."""
+        cdef int block_bytes = CENTROID_BLOCK_SIZE * self.ramifier.d * sizeof(double)
+        cdef CellTable centroid_cache = self._get_centroid_cache()
+        cdef bytes new_vals = np.asarray(centroid_cache.cells[
+            centroid_cache.n_cells - self.centroid_buffer_filled:centroid_cache.n_cells
+        ], dtype=float).tobytes()
+        if self._has_table('centroid_blocks'):
+            last_block = self.conn.execute(
+                'SELECT block_id, vals FROM centroid_blocks ORDER BY block_id DESC LIMIT 1'
+            ).fetchone()
+            block_id, vals = (0, b'') if last_block is None else last_block
+            if len(vals) == block_bytes:
+                block_id, vals = block_id + 1, b''
+        else:  # move centroids stored one per row by older versions into blocks
+            block_id, vals = 0, self._stored_centroids().tobytes()
+            self.conn.execute(
+                'CREATE TABLE centroid_blocks (block_id int PRIMARY KEY, vals BLOB)'
             )
+            if self._has_table('centroids'):
+                self.conn.execute('DELETE FROM centroids')
+        vals += new_vals
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO centroid_blocks VALUES (?,?)',
+            [
+                (block_id + i, vals[start:start + block_bytes])
+                for i, start in enumerate(range(0, len(vals), block_bytes))
+            ]
+        )
+        self.centroids_loaded = False
+
+    cdef int add_centroid(self, const double[:] centroid) except -1:
+        """Return the id of an integer grid cell, adding it if it is new."""
+        cdef CellTable centroid_cache = self._get_centroid_cache()
+        cdef int n_cells = centroid_cache.n_cells
+        cdef int centroid_id = centroid_cache.add(centroid)
+        if centroid_cache.n_cells > n_cells:
             self.centroid_buffer_filled += 1
-        if self.centroid_buffer_filled == BUFFER_SIZE:
-            self._clear_buffer()
+            if self.centroid_buffer_filled == BUFFER_SIZE:
+                self._clear_buffer()
         return centroid_id
 
+    cdef npc.int32_t[:] add_centroids(self, const double[:, :] centroids):
+        """Return the id of each row of centroids, adding new ones. Used to merge dbs."""
+        cdef CellTable centroid_cache = self._get_centroid_cache()
+        cdef int n_cells = centroid_cache.n_cells
+        cdef npc.int32_t[:] centroid_ids = centroid_cache.add_many(centroids)
+        self.centroid_buffer_filled += centroid_cache.n_cells - n_cells
+        if self.centroid_buffer_filled >= BUFFER_SIZE:
+            self._clear_buffer()
+        return centroid_ids
+
     cdef save_ramifier(self):
-        stringify = lambda M: ','.join([str(el) for el in M])
         self.conn.executemany(
             'INSERT INTO basics VALUES (?,?)',
             [
                 ('k', str(self.ramifier.k)),
                 ('d', str(self.ramifier.d)),
-                ('center', stringify(self.ramifier.center)),
-                ('scale', stringify(self.ramifier.scale)),
-                ('rotation', stringify(np.array(self.ramifier.rotation).flatten())),
+                ('center', pack_array(self.ramifier.center)),
+                ('scale', pack_array(self.ramifier.scale)),
+                ('rotation', pack_array(self.ramifier.rotation)),
             ]
         )
 
@@ -193,15 +373,11 @@ cdef class CoreDB:
             val = self.conn.execute('SELECT value FROM basics WHERE name=?', (key,))
             return val.fetchone()[0]
 
-        def numpify(key):
-            val = get_basic(key)
-            return np.array([float(el) for el in val.split(',')])
-
         k = int(get_basic('k'))
         d = int(get_basic('d'))
-        center = numpify('center')
-        scale = numpify('scale')
-        rotation = numpify('rotation')
+        center = unpack_array(get_basic('center'))
+        scale = unpack_array(get_basic('scale'))
+        rotation = unpack_array(get_basic('rotation'))
         rotation = np.reshape(rotation, (4 * k, 4 * k))
 
         return RotatingRamifier(k, d, rotation, center, scale)
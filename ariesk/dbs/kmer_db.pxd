@@ -8,13 +8,11 @@ cimport numpy as npc
 
 
 cdef class GridCoverDB(CoreDB):
-    # A too simple dict based cache
-    # for initial testing only as this will grow without bounds
-    cdef public dict cluster_cache
     cdef public npc.uint64_t[:, :] hash_functions
     cdef public int sub_k
     cdef public int n_hashes
     cdef public int array_size
+    cdef public bint finalized
 
     cpdef _build_tables(self)
     cpdef _build_indices(self)
@@ -26,6 +24,11 @@ cdef class GridCoverDB(CoreDB):
     cdef npc.uint8_t[:, :] get_cluster_members(self, int centroid_id)
     cdef Cluster get_cluster(self, int centroid_id)
 
+    cdef Cluster retrieve_cluster_bundle(self, int centroid_id)
+    cpdef finalize(self, logger=*)
+    cdef _drop_bundles(self)
+    cdef _clear_buffer(self)
+
     cdef store_inner_clusters(self, Cluster cluster)
     cdef retrieve_inner_clusters(self, Cluster cluster)
 
@@ -33,4 +36,4 @@ cdef class GridCoverDB(CoreDB):
     cpdef build_and_store_bloom_grid(self, int centroid_id)
     cpdef BloomGrid retrieve_bloom_grid(self, int centroid_id)
 
-    cpdef load_other(self, GridCoverDB other)
+    cpdef load_other(self, GridCoverDB other, rebuild_indices=*)
@@ -16,20 +16,33 @@ from ariesk.utils.kmers cimport encode_kmer, decode_kmer
 from ariesk.ram cimport RotatingRamifier
 from ariesk.cluster cimport Cluster
 from ariesk.dbs.core_db cimport CoreDB
+from ariesk.utils.lru_cache import DEFAULT_CACHE_BYTES
 
 BUFFER_SIZE = 10 * 1000
+MMAP_SIZE = 2 ** 40  # sqlite caps this at its own compile time maximum
 
 cdef simple_list(sql_cursor):
     return [el[0] for el in sql_cursor]
 
 
+def remap_centroid_ids(seq_rows, list centroid_id_remap):
+    for centroid_id, seq, annotation in seq_rows:
+        yield centroid_id_remap[centroid_id], seq, annotation
+
+
+def recode_kmer_blobs(seq_rows, CoreDB source, CoreDB dest):
+    """Yield seq_rows of source with k-mers stored the way dest stores them."""
+    for centroid_id, seq, annotation in seq_rows:
+        yield centroid_id, dest.encode_kmer_blob(source.decode_kmer_blob(seq)), annotation
+
+
 cdef class GridCoverDB(CoreDB):
 
-    def __cinit__(self, conn, ramifier=None, box_side_len=None):
+    def __cinit__(self, conn, ramifier=None, box_side_len=None, cache_bytes=DEFAULT_CACHE_BYTES):
         super().__init__(conn, ramifier=ramifier, box_side_len=box_side_len)
         self._build_tables()
         self._build_indices()
-        self.cluster_cache = {}
+        self.finalized = self._has_table('cluster_bundles')
 
         self.sub_k = 7
         self.n_hashes = 8
@@ -73,18 +86,31 @@ cdef class GridCoverDB(CoreDB):
         cdef int i, j
         cdef list kmers = simple_list(self.conn.execute('SELECT seq FROM seqs WHERE centroid_id=?', (centroid_id,)))
         cdef npc.uint8_t [:, :] binary_kmers = np.ndarray((len(kmers), self.ramifier.k), dtype=np.uint8)
-        cdef const npc.uint8_t [:] binary_kmer
         for i, kmer in enumerate(kmers):
-            binary_kmer = np.frombuffer(kmer, dtype=np.uint8)
-            for j in range(self.ramifier.k):
-                binary_kmers[i, j] = binary_kmer[j]
+            binary_kmers[i, :] = self.decode_kmer_blob(kmer)
         return binary_kmers
 
+    def pin_cluster(self, int centroid_id):
+        """Load a cluster and keep it cached regardless of the cache budget."""
+        self.cache.pin(('cluster', centroid_id))
+        self.get_cluster(centroid_id)
+
     cdef Cluster get_cluster(self, int centroid_id):
-        if centroid_id in self.cluster_cache:
-            return self.cluster_cache[centroid_id]
+        """Return a cluster, from its bundle if the db is finalized.
+
+        Otherwise its bloom grid and subclusters are built and stored
+        the first time it is used.
+        """
+        cached = self.cache.get(('cluster', centroid_id))
+        if cached is not None:
+            return cached
+        cdef Cluster cluster
+        if self.finalized:
+            cluster = self.retrieve_cluster_bundle(centroid_id)
+            self.cache.put(('cluster', centroid_id), cluster, cluster.nbytes())
+            return cluster
         cdef npc.uint8_t[:, :] seqs = self.get_cluster_members(centroid_id)
-        cdef Cluster cluster = Cluster(centroid_id, seqs, self.sub_k)
+        cluster = Cluster(centroid_id, seqs, self.sub_k)
         try:
             cluster.bloom_grid = self.retrieve_bloom_grid(centroid_id)
         except IndexError:
@@ -95,16 +121,64 @@ cdef class GridCoverDB(CoreDB):
         except IndexError:
             cluster.build_subclusters(self.ramifier.k // 5)
             self.store_inner_clusters(cluster)
-        self.cluster_cache[centroid_id] = cluster
+        self.cache.put(('cluster', centroid_id), cluster, cluster.nbytes())
         return cluster
 
+    cdef Cluster retrieve_cluster_bundle(self, int centroid_id):
+        row = self.conn.execute(
+            'SELECT bundle FROM cluster_bundles WHERE centroid_id=?', (centroid_id,)
+        ).fetchone()
+        if row is None:
+            raise IndexError(f'No bundle for cluster {centroid_id}')
+        return Cluster.from_bundle(centroid_id, row[0])
+
+    cpdef finalize(self, logger=None):
+        """Pack every cluster into one record of the `cluster_bundles` table.
+
+        Bloom grids and subclusters are built here, once, so searches on a
+        finalized db only ever read a cluster. Adding k-mers drops the bundles.
+        """
+        self.commit()
+        self.conn.execute('DROP TABLE IF EXISTS cluster_bundles')
+        self.conn.execute(
+            'CREATE TABLE cluster_bundles (centroid_id INTEGER PRIMARY KEY, bundle BLOB)'
+        )
+        cdef int n_centroids = self.c_get_centroids().shape[0]
+        cdef int centroid_id
+        cdef Cluster cluster
+        cdef list bundles = []
+        for centroid_id in range(n_centroids):
+            cluster = Cluster(centroid_id, self.get_cluster_members(centroid_id), self.sub_k)
+            cluster.build_bloom_grid(self.array_size, self.hash_functions)
+            cluster.build_subclusters(self.ramifier.k // 5)
+            bundles.append((centroid_id, cluster.to_bundle()))
+            if len(bundles) == BUFFER_SIZE or centroid_id == n_centroids - 1:
+                self.conn.executemany('INSERT INTO cluster_bundles VALUES (?,?)', bundles)
+                bundles = []
+                if logger:
+                    logger(centroid_id + 1, n_centroids)
+        self.conn.commit()
+        self.cache.clear()
+        self.finalized = True
+
+    cdef _drop_bundles(self):
+        if self.finalized:
+            self.conn.execute('DROP TABLE IF EXISTS cluster_bundles')
+            self.cache.clear()
+            self.finalized = False
+
+    cdef _clear_buffer(self):
+        if self.kmer_buffer_filled > 0:
+            self._drop_bundles()
+        CoreDB._clear_buffer(self)
+
     cdef store_inner_clusters(self, Cluster cluster):
         self.conn.execute(
             'INSERT INTO inner_clusters VALUES (?,?,?)',
             (
                 cluster.centroid_id,
                 ','.join([str(el) for el in cluster.inner_centers]),
-                np.array(cluster.inner_clusters, dtype=np.uint64).tobytes(),
+                np.asarray(cluster.inner_assignments, dtype=np.int32).tobytes(),
             )
         )
 
@@ -112,14 +186,17 @@ cdef class GridCoverDB(CoreDB):
         packed = list(self.conn.execute(
             'SELECT * FROM inner_clusters WHERE centroid_id=?', (cluster.centroid_id,)
         ))[0]
-        cdef list centers = [int(el) for el in packed[1].split(',')]
-        cdef const npc.uint8_t[:] raw_ic_members = packed[2]
-        cdef const npc.uint64_t[:, :] ic_members = np.reshape(
-            np.frombuffer(raw_ic_members, dtype=np.uint64),
-            (cluster.n_seqs, cluster.n_seqs)
-        )
+        cdef list centers = [int(el) for el in packed[1].split(',') if el]
         cluster.inner_centers = centers
-        cluster.inner_clusters = np.copy(ic_members)
+        if len(packed[2]) == 4 * cluster.n_seqs:
+            cluster.set_inner_assignments(np.frombuffer(packed[2], dtype=np.int32).copy())
+            return
+        # older dbs store a dense (n_seqs, n_seqs) membership matrix, row i for seq i as a center
+        dense = np.frombuffer(packed[2], dtype=np.uint64).reshape(cluster.n_seqs, cluster.n_seqs)
+        assignments = np.full((cluster.n_seqs,), -1, dtype=np.int32)
+        for c, center_i in enumerate(centers):
+            assignments[np.flatnonzero(dense[center_i])] = c
+        cluster.set_inner_assignments(assignments)
 
     cdef store_bloom_grid(self, Cluster cluster):
         self.conn.execute(
@@ -171,12 +248,8 @@ cdef class GridCoverDB(CoreDB):
         cdef BloomGrid bg = BloomGrid(
             col_k, row_k, grid_width, grid_height, np.copy(row_hashes), np.copy(col_hashes)
         )
-        cdef int i, j
-        for i in range(bg.bitarray.shape[0]):
-            bg.bitarray[i] = bitarray[i]
-        for i in range(bg.bitgrid.shape[0]):
-            for j in range(bg.bitgrid.shape[1]):
-                bg.bitgrid[i, j] = bitgrid[i, j]
+        bg.bitarray = np.copy(bitarray)
+        bg.bitgrid = np.copy(bitgrid)
         return bg
 
     def commit(self):
@@ -184,28 +257,49 @@ cdef class GridCoverDB(CoreDB):
         self._clear_buffer()
         self.conn.commit()
 
-    cpdef load_other(self, GridCoverDB other):
-        """Add contents of other db to this db."""
-        my_centroid_strs = {
-            centroid_str: cid
-            for cid, centroid_str in self.conn.execute('SELECT * FROM centroids')
-        }
-        centroid_id_remap = {}
-        for other_id, other_centroid_str in other.conn.execute('SELECT * FROM centroids'):
-            if other_centroid_str in my_centroid_strs:
-                centroid_id_remap[other_id] = my_centroid_strs[other_centroid_str]
-            else:
-                new_id = len(my_centroid_strs)
-                centroid_id_remap[other_id] = new_id
-                self.conn.execute(
-                    'INSERT INTO centroids VALUES (?,?)',
-                    (new_id, other_centroid_str)
-                )
-
-        for other_id, kmer, annotation in other.conn.execute('SELECT * FROM seqs'):
-            new_id = centroid_id_remap[other_id]
-            self.conn.execute('INSERT INTO seqs VALUES (?,?,?)', (new_id, kmer, annotation))
+    cpdef load_other(self, GridCoverDB other, rebuild_indices=True):
+        """Add contents of other db to this db.
+
+        If other is stored in a file, with seqs encoded the same way as this
+        db, it is attached and its k-mers are copied, with remapped centroid
+        ids, in one query.
+        """
+        other.commit()
+        cdef list centroid_id_remap = np.asarray(
+            self.add_centroids(other.c_get_centroids())
+        ).tolist()
+        self._drop_bundles()
+        self._drop_indices()
         self.commit()
+        other_filepath = other.conn.execute('PRAGMA database_list').fetchone()[2]
+        if other_filepath and other.packed_seqs == self.packed_seqs:
+            self.conn.execute('ATTACH DATABASE ? AS other_db', (other_filepath,))
+            self.conn.execute(
+                'CREATE TEMP TABLE centroid_remap (old_id INTEGER PRIMARY KEY, new_id int)'
+            )
+            self.conn.executemany(
+                'INSERT INTO centroid_remap VALUES (?,?)', enumerate(centroid_id_remap)
+            )
+            self.conn.execute(
+                '''INSERT INTO seqs
+                SELECT centroid_remap.new_id, other_seqs.seq, other_seqs.annotation
+                FROM other_db.seqs AS other_seqs
+                JOIN centroid_remap ON other_seqs.centroid_id = centroid_remap.old_id'''
+            )
+            self.conn.execute('DROP TABLE centroid_remap')
+            self.conn.commit()
+            self.conn.execute('DETACH DATABASE other_db')
+        else:  # in memory dbs can not be attached, differently encoded seqs are recoded
+            seq_rows = other.conn.execute('SELECT * FROM seqs')
+            if other.packed_seqs != self.packed_seqs:
+                seq_rows = recode_kmer_blobs(seq_rows, other, self)
+            self.conn.executemany(
+                'INSERT INTO seqs VALUES (?,?,?)',
+                remap_centroid_ids(seq_rows, centroid_id_remap)
+            )
+            self.commit()
+        if rebuild_indices:
+            self._build_indices()
 
     cdef npc.uint64_t[:, :] load_hash_functions(self):
         val = list(self.conn.execute(
@@ -234,7 +328,8 @@ cdef class GridCoverDB(CoreDB):
         self.conn.commit()
 
     @classmethod
-    def load_from_filepath(cls, filepath):
+    def load_from_filepath(cls, filepath, cache_bytes=DEFAULT_CACHE_BYTES):
         """Return a GridCoverDB."""
         connection = sqlite3.connect(filepath, cached_statements=10 * 1000)
-        return GridCoverDB(connection)
+        connection.execute(f'PRAGMA mmap_size={MMAP_SIZE}')  # bundles are read straight from the page map
+        return GridCoverDB(connection, cache_bytes=cache_bytes)
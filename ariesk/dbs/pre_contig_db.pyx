@@ -10,13 +10,15 @@ from posix.stdio cimport * # FILE, fopen, fclose
 from libc.stdlib cimport malloc, free
 from math import ceil
 
-from ariesk.utils.kmers cimport encode_kmer, decode_kmer, encode_seq_from_buffer
+from ariesk.utils.kmers cimport encode_kmer, decode_kmer
+from ariesk.utils.seq_reader cimport SeqReader
 from ariesk.dbs.core_db cimport CoreDB
 from ariesk.seed_align cimport get_target_kmers
 
 
 SEQ_BLOCK_LEN = 10 * 1000
 BUFFER_SIZE = 10 * 1000
+RAMIFY_BLOCK_SIZE = 10 * 1000  # k-mers ramified at once, bounds memory on large genomes
 
 
 cdef class PreContigDB(CoreDB):
@@ -47,10 +49,8 @@ cdef class PreContigDB(CoreDB):
 
     def get_all_contigs(self):
         cdef list out = []
-        cdef const npc.uint8_t[:] contig
         for contig_id, seq, genome_name, contig_name, contig_start in self.conn.execute('SELECT * FROM contigs'):
-            seq = np.frombuffer(seq, dtype=np.uint8)
-            kmer = decode_kmer(seq)
+            kmer = decode_kmer(self.decode_contig_blob(seq))
             out.append((contig_id, kmer, genome_name, contig_name, contig_start))
         return out
 
@@ -82,7 +82,7 @@ cdef class PreContigDB(CoreDB):
             'INSERT INTO contigs VALUES (?,?,?,?,?)',
             (
                 self.contig_counter,
-                np.array(contig_section, dtype=np.uint8).tobytes(),
+                self.encode_contig_blob(contig_section),
                 genome_name,
                 contig_name,
                 contig_start,
@@ -103,19 +103,23 @@ cdef class PreContigDB(CoreDB):
         self.add_contig(genome_name, contig_name, encode_kmer(contig), gap=gap)
 
     cdef add_contig(self, str genome_name, str contig_name, npc.uint8_t[:] contig, int gap=1):
-        cdef npc.uint8_t[:] kmer
-        cdef double[:] rft
-        cdef int i
+        cdef double[:, :] rfts
+        cdef int i, j, block_start, block_end
         cdef int contig_id = -1
-        for i in range(0, contig.shape[0] - self.ramifier.k + 1, gap):
-            if i % self.seq_block_len == 0:
-                contig_id = self.add_contig_seq(
-                    genome_name, contig_name, i,
-                    contig[i:min(i + self.seq_block_len, contig.shape[0])]
-                )
-            kmer = contig[i:i + self.ramifier.k]
-            rft = self.ramifier.c_ramify(kmer)
-            self.add_rft_to_contig(rft, contig_id)
+        cdef int n_kmers = (contig.shape[0] - self.ramifier.k) // gap + 1
+        for block_start in range(0, max(n_kmers, 0), RAMIFY_BLOCK_SIZE):
+            block_end = min(block_start + RAMIFY_BLOCK_SIZE, n_kmers)
+            rfts = self.ramifier.c_ramify_windows(
+                contig[block_start * gap:(block_end - 1) * gap + self.ramifier.k], gap=gap
+            )
+            for j in range(block_end - block_start):
+                i = (block_start + j) * gap
+                if i % self.seq_block_len == 0:
+                    contig_id = self.add_contig_seq(
+                        genome_name, contig_name, i,
+                        contig[i:min(i + self.seq_block_len, contig.shape[0])]
+                    )
+                self.add_rft_to_contig(rfts[j, :], contig_id)
 
     cdef _clear_rft_buffer(self):
         if self.coord_buffer_filled > 0:
@@ -143,27 +147,11 @@ cdef class PreContigDB(CoreDB):
         return PreContigDB(connection)
 
     def fast_add_kmers_from_fasta(self, str filename):
-        cdef FILE * cfile = fopen(filename.encode("UTF-8"), "rb")
-        if cfile == NULL:
-            raise FileNotFoundError(2, "No such file or directory: '%s'" % filename)
-
+        """Add each record of a fasta or fastq file, gzipped or not, as a contig."""
+        cdef SeqReader reader = SeqReader(filename)
         cdef int n_added = 0
-        cdef char * line = NULL
-        cdef char * header = NULL
-        cdef size_t l = 0
-        cdef ssize_t read
-        cdef size_t n_kmers_in_line, i
-        cdef npc.uint8_t[:] seq
-        while True:
-            getline(&header, &l, cfile)
-            read = getdelim(&line, &l, b'>', cfile)
-            if read == -1: break
-            seq = encode_seq_from_buffer(line, l)
-            self.add_contig(filename, str(header).strip()[1:], seq)
+        while reader.next_record():
+            self.add_contig(filename, reader.name, reader.record())
             n_added += 1
-            header = NULL
-            line = NULL  # I don't understand why this line is necessary but
-                         # without it the program throws a strange error: 
-                         # `pointer being realloacted was not allocated`
-        fclose(cfile)
+        reader.close()
         return n_added
@@ -14,7 +14,7 @@ from ariesk.ckdtree cimport cKDTree
 
 from ariesk.ram cimport StatisticalRam, RotatingRamifier
 
-from ariesk.utils.kmers cimport encode_kmer, needle_dist, decode_kmer
+from ariesk.utils.kmers cimport encode_kmer, needle_fast, nw_workspace, decode_kmer
 
 cdef class DistMatrixBuilder:
     cdef public npc.uint8_t[:, :] kmers
@@ -25,7 +25,6 @@ cdef class DistMatrixBuilder:
         self.kmers = np.ndarray((len(kmers), k), dtype=np.uint8)
         self.rfts = np.ndarray((len(kmers), d))
         cdef int i, j
-        cdef double[:] rft
         cdef npc.uint8_t[:] kmer
 
         for i in range(self.kmers.shape[0]):
@@ -34,26 +33,22 @@ cdef class DistMatrixBuilder:
                 self.kmers[i, j] = kmer[j]
 
         cdef StatisticalRam stat_ram = StatisticalRam(k, self.kmers.shape[0])
-        for i in range(self.kmers.shape[0]):
-            stat_ram.c_add_kmer(self.kmers[i,:])
+        stat_ram.c_add_kmers(self.kmers)
         cdef RotatingRamifier ramifier = RotatingRamifier(
             k, d, stat_ram.get_rotation(), stat_ram.get_centers(), stat_ram.get_scales()
         )
-
-        for i in range(self.kmers.shape[0]):
-            rft = ramifier.c_ramify(self.kmers[i, :])
-            for j in range(d):
-                self.rfts[i, j] = rft[j]
+        self.rfts = ramifier.c_ramify_batch(self.kmers)
         self.tree = cKDTree(self.rfts)
 
     def build(self, double radius):
         cdef list results = []
         cdef double dist
         cdef int i = 0
+        cdef npc.int32_t[:] work = nw_workspace(self.kmers.shape[1])
         for hit_list in self.tree.query_ball_tree(self.tree, radius):
             for hit in hit_list:
                 if i < hit:
-                    dist = needle_dist(self.kmers[i,:], self.kmers[hit, :], False)
+                    dist = needle_fast(self.kmers[i,:], self.kmers[hit, :], False, work)
                     results.append((
                         decode_kmer(self.kmers[i, :]),
                         decode_kmer(self.kmers[hit, :]),
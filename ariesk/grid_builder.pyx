@@ -10,7 +10,12 @@ from libc.stdio cimport *
 from posix.stdio cimport * # FILE, fopen, fclose
 from libc.stdlib cimport malloc, free
 
-from ariesk.utils.kmers cimport encode_kmer, encode_kmer_from_buffer
+from ariesk.utils.kmers cimport (
+    encode_kmer,
+    encode_kmer_from_buffer,
+    count_leading_bases,
+)
+from ariesk.utils.seq_reader cimport SeqReader
 from ariesk.ram cimport RotatingRamifier
 from ariesk.dbs.kmer_db cimport GridCoverDB
 from ariesk.pre_db import PreDB
@@ -49,6 +54,20 @@ cdef class GridCoverBuilder:
         self.db.add_point_to_cluster(centroid_rft, binary_kmer)
         self.num_kmers_added += 1
 
+    cdef int c_add_kmers_from_seq(self, npc.uint8_t [:] seq, int n_kmers):
+        """Add the first n_kmers k-mers of seq. Return the number added."""
+        if n_kmers <= 0:
+            return 0
+        cdef int i
+        cdef double[:, :] centroid_rfts = np.floor(
+            np.asarray(self.ramifier.c_ramify_windows(seq[:n_kmers + self.ramifier.k - 1]))
+            / self.db.box_side_len
+        )
+        for i in range(n_kmers):
+            self.db.add_point_to_cluster(centroid_rfts[i, :], seq[i:i + self.ramifier.k])
+        self.num_kmers_added += n_kmers
+        return n_kmers
+
     def commit(self):
         self.db.commit()
 
@@ -73,71 +92,64 @@ cdef class GridCoverBuilder:
 
     @cython.boundscheck(False)
     @cython.wraparound(False)
-    def fast_add_kmers_from_file(self, str filename, num_to_add=0):
+    def fast_add_kmers_from_file(self, str filename, num_to_add=0, long start_byte=0, long end_byte=0):
+        """Add k-mers from the lines of a table, one k-mer per line.
+
+        If given, only lines that begin in [start_byte, end_byte) are read
+        so a file can be split between workers without overlap.
+        """
         cdef FILE * cfile = fopen(filename.encode("UTF-8"), "rb")
         if cfile == NULL:
             raise FileNotFoundError(2, "No such file or directory: '%s'" % filename)
 
         cdef n_added = 0
         cdef char * line = NULL
+        cdef char * cursor
         cdef size_t l = 0
         cdef ssize_t read
         cdef size_t n_kmers_in_line, i
         cdef npc.uint8_t[:] kmer
+        if start_byte > 0:  # skip the end of the line that begins before start_byte
+            fseek(cfile, start_byte - 1, SEEK_SET)
+            getline(&line, &l, cfile)
         while (num_to_add <= 0) or (n_added < num_to_add):
+            if (end_byte > 0) and (ftell(cfile) >= end_byte):
+                break
             read = getline(&line, &l, cfile)
             if read == -1: break
             if line[0] != b'>':
-                n_kmers_in_line = l - self.ramifier.k + 1
+                n_kmers_in_line = max(read - self.ramifier.k + 1, 0)
+                cursor = line  # advance a copy, getline must get back the pointer it allocated
                 i = 0
                 while (i < n_kmers_in_line) and ((num_to_add <= 0) or (n_added < num_to_add)):
-                    kmer = encode_kmer_from_buffer(line, self.ramifier.k)
+                    kmer = encode_kmer_from_buffer(cursor, self.ramifier.k)
                     if (num_to_add > 0) and (n_added >= num_to_add):
                         break
                     if kmer[self.ramifier.k - 1] > 3:
                         break
                     self.c_add_kmer(kmer)
                     n_added += 1
-                    line += 1
+                    cursor += 1
                     i += 1
-            line = NULL  # I don't understand why this line is necessary but
-                         # without it the program throws a strange error: 
-                         # `pointer being realloacted was not allocated`
+        free(line)
         fclose(cfile)
         return n_added
 
     @cython.boundscheck(False)
     @cython.wraparound(False)
     def fast_add_kmers_from_fasta(self, str filename, num_to_add=0):
-        cdef FILE * cfile = fopen(filename.encode("UTF-8"), "rb")
-        if cfile == NULL:
-            raise FileNotFoundError(2, "No such file or directory: '%s'" % filename)
-
+        """Add the k-mers of each record of a fasta or fastq file, gzipped or not."""
+        cdef SeqReader reader = SeqReader(filename)
         cdef int n_added = 0
-        cdef char * line = NULL
-        cdef size_t l = 0
-        cdef ssize_t read
-        cdef size_t n_kmers_in_line, i
-        cdef npc.uint8_t[:] kmer
-        while (num_to_add <= 0) or (n_added < num_to_add):
-            getline(&line, &l, cfile)  # header
-            read = getdelim(&line, &l, b'>', cfile)  # read
-            if read == -1: break
-            while (num_to_add <= 0) or (n_added < num_to_add):
-                if line[0] == b'\n':
-                    line += 1
-                kmer = encode_kmer_from_buffer(line, self.ramifier.k)
-                if (num_to_add > 0) and (n_added >= num_to_add):
-                    break
-                if kmer[self.ramifier.k - 1] > 3:
-                    break
-                self.c_add_kmer(kmer)
-                n_added += 1
-                line += 1
-            line = NULL  # I don't understand why this line is necessary but
-                         # without it the program throws a strange error: 
-                         # `pointer being realloacted was not allocated`
-        fclose(cfile)
+        cdef int n_kmers
+        cdef npc.uint8_t[:] seq
+        while ((num_to_add <= 0) or (n_added < num_to_add)) and reader.next_record():
+            seq = reader.record()
+            n_kmers = count_leading_bases(seq) - self.ramifier.k + 1  # stop at the first 'N'
+            if num_to_add > 0:
+                n_kmers = min(n_kmers, num_to_add - n_added)
+            n_added += self.c_add_kmers_from_seq(seq, n_kmers)
+        reader.close()
         return n_added
 
     @classmethod
@@ -157,15 +169,12 @@ cdef class GridCoverBuilder:
         cdef const npc.uint8_t[:] seq_blob
         cdef double[:] centroid_rft
         cdef const double[:] rft
-        cdef const npc.uint8_t[:] kmer
-        cdef npc.uint8_t[:] kmer2 = np.ndarray((self.ramifier.k,), np.uint8)
+        cdef npc.uint8_t[:] kmer
         for rft_blob, seq_blob in predb.conn.execute('SELECT * FROM kmers'):
             rft = np.frombuffer(rft_blob, dtype=float, count=self.ramifier.d)
-            kmer = np.frombuffer(seq_blob, dtype=np.uint8)
-            for i in range(kmer.shape[0]):
-                kmer2[i] = kmer[i]
+            kmer = predb.decode_kmer_blob(seq_blob)
             centroid_rft = np.floor(np.array(rft) / self.db.box_side_len)
-            self.db.add_point_to_cluster(centroid_rft, kmer2)
+            self.db.add_point_to_cluster(centroid_rft, kmer)
             self.num_kmers_added += 1
             if logger and (self.num_kmers_added % log_interval == 0):
                 logger(self.num_kmers_added)
@@ -4,21 +4,28 @@
 
 import numpy as np
 cimport numpy as npc
-from scipy.spatial import cKDTree
+
+from concurrent.futures import ThreadPoolExecutor
 
 from libc.math cimport ceil
 from ariesk.ram cimport RotatingRamifier
+from ariesk.ckdtree cimport cKDTree
 from ariesk.dbs.kmer_db cimport GridCoverDB
 from ariesk.cluster cimport Cluster
+from ariesk.utils.lru_cache import DEFAULT_CACHE_BYTES
 from ariesk.utils.bloom_filter cimport fnva, fast_modulo
 from ariesk.utils.kmers cimport (
     encode_kmer,
     decode_kmer,
     needle_fast,
-    bounded_needle_fast,
     hamming_dist,
+    hamming_packed,
+    pack_kmers,
+    count_leading_bases,
 )
 
+BATCH_SIZE = 10 * 1000
+
 
 cdef class GridCoverSearcher:
     cdef public GridCoverDB db
@@ -31,19 +38,19 @@ cdef class GridCoverSearcher:
     cdef public int n_hashes
     cdef public int array_size
     cdef public npc.uint64_t[:, :] hash_functions
+    cdef public int threads
+    cdef public object pool
 
-    cdef public object tree
+    cdef public cKDTree tree
 
-    def __cinit__(self, grid_cover_db):
+    def __cinit__(self, grid_cover_db, threads=1):
         self.db = grid_cover_db
+        self.threads = threads
+        self.pool = None
         self.radius = (self.db.ramifier.d ** (0.5)) * self.db.box_side_len
         self.ramifier = self.db.ramifier
-        self.centroid_rfts = self.db.c_get_centroids()
-        for i in range(len(self.centroid_rfts)):
-            for j in range(self.db.ramifier.d):
-                self.centroid_rfts[i, j] *= self.db.box_side_len
-                self.centroid_rfts[i, j] += (self.db.box_side_len / 2)
-        self.tree = cKDTree(self.centroid_rfts)
+        self.tree = self.db.c_get_search_tree()
+        self.centroid_rfts = self.tree.data
         self.logging = False
         self.sub_k = self.db.sub_k
         self.n_hashes = self.db.n_hashes
@@ -76,29 +83,73 @@ cdef class GridCoverSearcher:
             out.append(decode_kmer(hits[i, :]))
         return out
 
+    def py_search_batch(self, list kmers, double search_radius, max_filter_misses=None,
+        double inner_radius=0.2, double eps=1.01, inner_metric='needle'):
+        """Return a list of the hits for each of kmers, see `py_search`."""
+        if max_filter_misses is None:
+            max_filter_misses = int(ceil(inner_radius * self.ramifier.k))
+        cdef list results = self.search_batch(
+            self._encode_batch(kmers),
+            search_radius,
+            max_filter_misses,
+            inner_radius=inner_radius,
+            eps=eps,
+            inner_metric=inner_metric
+        )
+        return [[decode_kmer(hit) for hit in hits] for hits in results]
+
     def file_search(self,
                     str filepath, str out_filepath, double search_radius, max_filter_misses=None,
-                    double inner_radius=0.2, double eps=1.01, inner_metric='needle'):
+                    double inner_radius=0.2, double eps=1.01, inner_metric='needle',
+                    int batch_size=BATCH_SIZE):
         if max_filter_misses is None:
             max_filter_misses = int(ceil(inner_radius * self.ramifier.k))
-        cdef str kmer
-        cdef npc.uint8_t[:, :] results
-        cdef int i
+        cdef list kmers = []
         with open(filepath) as f, open(out_filepath, 'w') as o:
             for line in f:
-                kmer = line.strip().split(',')[0].split('\t')[0]
-                results = self.search(
-                    encode_kmer(kmer), search_radius,
-                    max_filter_misses,
-                    inner_radius=inner_radius, inner_metric=inner_metric, eps=eps
+                kmers.append(line.strip().split(',')[0].split('\t')[0])
+                if len(kmers) == batch_size:
+                    self._file_search_batch(
+                        kmers, o, search_radius, max_filter_misses, inner_radius, eps, inner_metric
+                    )
+                    kmers = []
+            if kmers:
+                self._file_search_batch(
+                    kmers, o, search_radius, max_filter_misses, inner_radius, eps, inner_metric
                 )
-                for i in range(results.shape[0]):
-                    result = decode_kmer(results[i, :])
-                    o.write(f'{kmer} {result}\n')
+
+    def _file_search_batch(self, list kmers, o, double search_radius, int max_filter_misses,
+                           double inner_radius, double eps, inner_metric):
+        cdef list results = self.search_batch(
+            self._encode_batch(kmers), search_radius,
+            max_filter_misses,
+            inner_radius=inner_radius, inner_metric=inner_metric, eps=eps
+        )
+        cdef npc.uint8_t[:, :] hits
+        cdef int i
+        for kmer, hits in zip(kmers, results):
+            for i in range(hits.shape[0]):
+                result = decode_kmer(hits[i, :])
+                o.write(f'{kmer} {result}\n')
+
+    cdef npc.uint8_t[:, :] _encode_batch(self, list kmers):
+        cdef npc.uint8_t[:, :] binary_kmers = np.ndarray((len(kmers), self.ramifier.k), dtype=np.uint8)
+        cdef int i
+        for i, kmer in enumerate(kmers):
+            binary_kmers[i, :] = encode_kmer(kmer)
+        return binary_kmers
 
     @classmethod
-    def from_filepath(cls, filepath):
-        return cls(GridCoverDB.load_from_filepath(filepath))
+    def from_filepath(cls, filepath, threads=1, cache_bytes=DEFAULT_CACHE_BYTES):
+        return cls(
+            GridCoverDB.load_from_filepath(filepath, cache_bytes=cache_bytes),
+            threads=threads
+        )
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
 
     cdef list _coarse_search(
         self,
@@ -108,8 +159,8 @@ cdef class GridCoverSearcher:
     ):
         """Return a list of the cluster indices which are within <radius> of the query."""
         cdef double coarse_search_radius = search_radius + (eps * self.radius)
-        cdef double[:] rft = self.ramifier.c_ramify(binary_kmer)
-        cdef list centroid_hits = self.tree.query_ball_point(rft, coarse_search_radius)
+        cdef cKDTree query_tree = cKDTree(self.ramifier.c_ramify(binary_kmer)[None, :])
+        cdef list centroid_hits = query_tree.query_ball_tree(self.tree, coarse_search_radius)[0]
         return centroid_hits
 
     cdef npc.uint8_t[:] _filter_search(
@@ -150,22 +201,37 @@ cdef class GridCoverSearcher:
         double inner_radius=0.2,
         inner_metric='needle'
     ):
-        """Search a single cluster and return all members within inner_radius."""
+        """Search a single cluster and return all members within inner_radius.
+
+        The alignments run without the GIL so this may be called from
+        several threads at once, see `_fine_search_many`.
+        """
         cdef npc.uint8_t[:, :] out = np.ndarray(
             (cluster.seqs.shape[0], self.ramifier.k),
             dtype=np.uint8
         )
-        cdef double[:, :] score = 1000 * np.ones((self.ramifier.k + 1, self.ramifier.k + 1))
         cdef int i, j
         cdef int added = 0
         cdef npc.uint8_t bound = <npc.uint8_t> ceil(inner_radius * query_kmer.shape[0])
         cdef double[:] dists 
         if inner_metric == 'needle':
-            dists = cluster.search_cluster(query_kmer, bound, score)
+            dists = cluster.search_cluster(query_kmer, bound)
+        cdef npc.uint8_t[:, :] packed_query
+        cdef bint packed = (  # bundles only pack clusters without N
+            inner_metric == 'hamming' and cluster.packed_seqs is not None
+            and count_leading_bases(query_kmer) == query_kmer.shape[0]
+        )
+        if packed:
+            packed_query = pack_kmers(query_kmer[None, :])
         cdef double inner = 100 * self.ramifier.k  # big value that will be larger than inner rad
         for i in range(cluster.seqs.shape[0]):
             if inner_metric == 'needle':  # and cluster.test_seq(i, row_hits):
                 inner = dists[i]
+            elif packed:
+                inner = hamming_packed(
+                    packed_query[0], cluster.packed_seqs[i, :], packed_query.shape[1]
+                )
+                inner /= query_kmer.shape[0]
             elif inner_metric == 'hamming':
                 inner = hamming_dist(query_kmer, cluster.seqs[i, :], True)
             if inner_metric == 'none' or inner <= inner_radius:
@@ -175,6 +241,38 @@ cdef class GridCoverSearcher:
         out = out[0:added, :]
         return out
 
+    def _fine_search_task(self, args):
+        query_kmer, cluster, row_hits, inner_radius, inner_metric = args
+        return np.asarray(self._fine_search(
+            query_kmer, cluster, row_hits, inner_radius=inner_radius, inner_metric=inner_metric
+        ))
+
+    cdef list _run_fine_search_tasks(self, list tasks):
+        """Return the result of `_fine_search_task` for each task, in order."""
+        if self.threads > 1 and len(tasks) > 1:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(self.threads)
+            return list(self.pool.map(self._fine_search_task, tasks))
+        return [self._fine_search_task(task) for task in tasks]
+
+    cdef npc.uint8_t[:, :] _fine_search_many(
+        self,
+        npc.uint8_t[:] query_kmer,
+        list clusters,
+        list row_hits,
+        double inner_radius=0.2,
+        inner_metric='needle'
+    ):
+        """Fine search each cluster, on `threads` threads, and concatenate the results."""
+        cdef list tasks = [
+            (query_kmer, cluster, cluster_row_hits, inner_radius, inner_metric)
+            for cluster, cluster_row_hits in zip(clusters, row_hits)
+        ]
+        cdef list results = self._run_fine_search_tasks(tasks)
+        if not results:
+            return np.ndarray((0, self.ramifier.k), dtype=np.uint8)
+        return np.concatenate(results)
+
     cdef npc.uint32_t[:, :] compute_hashes_for_seq(self, npc.uint8_t[:] seq):
         cdef npc.uint32_t[:, :] hash_vals = np.ndarray(
             (seq.shape[0] - self.sub_k + 1, self.n_hashes), dtype=np.uint32
@@ -217,23 +315,89 @@ cdef class GridCoverSearcher:
         )
 
         # Fine search
-        cdef npc.uint8_t[:, :] out = np.ndarray((0, self.ramifier.k), dtype=np.uint8)
+        cdef list clusters = []
+        cdef list cluster_row_hits = []
         i = -1
         cdef npc.uint8_t[:] row_hits
+        cdef Cluster cluster
         for center in centers:
             i += 1
             if filtered_centers[i] == 1:
                 cluster = self.db.get_cluster(center)
                 row_hits = cluster.test_row_membership(hash_vals, max_filter_misses)
                 if inner_metric == 'none' or max(row_hits) > 0:
-                    searched = self._fine_search(
-                        binary_kmer,
-                        cluster,
-                        row_hits,
-                        inner_radius=inner_radius,
-                        inner_metric=inner_metric
-                    )
-                    out = np.append(out, searched, axis=0)
+                    clusters.append(cluster)
+                    cluster_row_hits.append(row_hits)
+        cdef npc.uint8_t[:, :] out = self._fine_search_many(
+            binary_kmer,
+            clusters,
+            cluster_row_hits,
+            inner_radius=inner_radius,
+            inner_metric=inner_metric
+        )
         if self.logging:
             self.logger(f'Fine search complete. {out.shape[0]} candidates passed.')
         return out
+
+    cdef list search_batch(
+        self,
+        npc.uint8_t[:, :] binary_kmers,
+        double search_radius,
+        int max_filter_misses,
+        double inner_radius=0.2,
+        double eps=1.01,
+        inner_metric='needle'
+    ):
+        """Search each row of binary_kmers. Return a list of (n_hits, k) arrays, one per row.
+
+        All queries are ramified together and matched against the centroids
+        in one tree traversal. Queries are then grouped by candidate cluster
+        so each cluster is fetched and filtered once per batch.
+        """
+        if self.logging:
+            self.logger(f'Starting batch search of {binary_kmers.shape[0]} queries.')
+        cdef double coarse_search_radius = search_radius + (eps * self.radius)
+        cdef cKDTree query_tree = cKDTree(np.asarray(self.ramifier.c_ramify_batch(binary_kmers)))
+        cdef dict queries_by_center = {}
+        cdef int i
+        cdef list centroid_hits
+        for i, centroid_hits in enumerate(query_tree.query_ball_tree(self.tree, coarse_search_radius)):
+            for center in centroid_hits:
+                if center in queries_by_center:
+                    queries_by_center[center].append(i)
+                else:
+                    queries_by_center[center] = [i]
+        if self.logging:
+            self.logger(f'Coarse search complete. {len(queries_by_center)} clusters.')
+
+        cdef list hash_vals = [
+            self.compute_hashes_for_seq(binary_kmers[i, :]) for i in range(binary_kmers.shape[0])
+        ]
+        cdef list tasks = []
+        cdef list task_query_ids = []
+        cdef Cluster cluster
+        cdef npc.uint8_t[:] row_hits
+        cdef list query_ids
+        for center, query_ids in queries_by_center.items():
+            cluster = self.db.get_cluster(center)
+            for i in query_ids:
+                if not (
+                    inner_metric == 'none' or
+                    cluster.seqs.shape[0] <= 0 or
+                    cluster.test_membership_hvals(hash_vals[i], max_filter_misses)
+                ):
+                    continue
+                row_hits = cluster.test_row_membership(hash_vals[i], max_filter_misses)
+                if inner_metric == 'none' or max(row_hits) > 0:
+                    tasks.append((binary_kmers[i, :], cluster, row_hits, inner_radius, inner_metric))
+                    task_query_ids.append(i)
+        cdef list hits = [[] for _ in range(binary_kmers.shape[0])]
+        for i, searched in zip(task_query_ids, self._run_fine_search_tasks(tasks)):
+            hits[i].append(searched)
+        cdef list out = [
+            np.concatenate(el) if el else np.ndarray((0, self.ramifier.k), dtype=np.uint8)
+            for el in hits
+        ]
+        if self.logging:
+            self.logger(f'Fine search complete. {sum([len(el) for el in out])} candidates passed.')
+        return out
@@ -6,7 +6,8 @@ cimport numpy as npc
 
 from ariesk.dbs.kmer_db cimport GridCoverDB
 from ariesk.utils.kmers cimport (
-    needle_dist,
+    needle_fast,
+    nw_workspace,
     hamming_dist,
     encode_kmer,
     decode_kmer,
@@ -24,9 +25,10 @@ cdef class LinearSearcher:
         cdef npc.uint8_t [:] encoded_query = encode_kmer(query)
         cdef int i
         cdef npc.uint8_t [:, :] encoded_kmers = self.db.get_encoded_kmers()
+        cdef npc.int32_t[:] work = nw_workspace(max(encoded_query.shape[0], encoded_kmers.shape[1]))
         for i in range(encoded_kmers.shape[0]):
             if metric == 'needle':
-                dist = needle_dist(encoded_query, encoded_kmers[i, :], False)
+                dist = needle_fast(encoded_query, encoded_kmers[i, :], False, work)
             elif metric == 'hamming':
                 dist = hamming_dist(encoded_query, encoded_kmers[i, :], False)
             out.append((decode_kmer(encoded_kmers[i, :]), dist))
@@ -15,10 +15,14 @@ cdef class PreDB:
     cdef public RotatingRamifier ramifier
     cdef public list kmer_insert_buffer
     cdef public int kmer_buffer_filled
+    cdef public bint packed_seqs
 
     cdef _build_tables(self)
     cdef c_add_kmer(self, npc.uint8_t [:] binary_kmer)
+    cdef int c_add_kmers_from_seq(self, npc.uint8_t [:] seq, int n_kmers)
     cdef add_point(self, double[:] rft, npc.uint8_t [::] binary_kmer)
     cdef _clear_buffer(self)
+    cpdef bytes encode_kmer_blob(self, const npc.uint8_t[:] binary_kmer)
+    cpdef npc.uint8_t[:] decode_kmer_blob(self, const npc.uint8_t[:] blob)
     cdef save_ramifier(self)
     cdef RotatingRamifier load_ramifier(self)
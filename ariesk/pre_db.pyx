@@ -12,8 +12,17 @@ from libc.stdio cimport *
 from posix.stdio cimport * # FILE, fopen, fclose
 from libc.stdlib cimport malloc, free
 
-from ariesk.utils.kmers cimport encode_kmer, encode_kmer_from_buffer
+from ariesk.utils.kmers cimport (
+    encode_kmer,
+    encode_kmer_from_buffer,
+    encode_kmer_blob,
+    decode_kmer_blob,
+    count_leading_bases,
+)
+from ariesk.dbs.core_db cimport load_seq_encoding
+from ariesk.utils.seq_reader cimport SeqReader
 from ariesk.ram cimport RotatingRamifier
+from ariesk.ram import pack_array, unpack_array
 from ariesk.cluster cimport Cluster
 
 BUFFER_SIZE = 10 * 1000
@@ -36,6 +45,15 @@ cdef class PreDB:
         else:
             self.ramifier = ramifier
             self.save_ramifier()
+        self.packed_seqs = load_seq_encoding(self.conn, ramifier is not None, ['kmers'])
+
+    cpdef bytes encode_kmer_blob(self, const npc.uint8_t[:] binary_kmer):
+        """Return the blob a k-mer is stored as."""
+        return encode_kmer_blob(binary_kmer, self.packed_seqs)
+
+    cpdef npc.uint8_t[:] decode_kmer_blob(self, const npc.uint8_t[:] blob):
+        """Return the k-mer stored as blob."""
+        return decode_kmer_blob(blob, self.ramifier.k, self.packed_seqs)
 
     cdef _build_tables(self):
         self.conn.execute('CREATE TABLE IF NOT EXISTS basics (name text, value text)')
@@ -49,6 +67,18 @@ cdef class PreDB:
         cdef double[:] rft = self.ramifier.c_ramify(binary_kmer)
         self.add_point(rft, binary_kmer)
 
+    cdef int c_add_kmers_from_seq(self, npc.uint8_t [:] seq, int n_kmers):
+        """Add the first n_kmers k-mers of seq. Return the number added."""
+        if n_kmers <= 0:
+            return 0
+        cdef int i
+        cdef double[:, :] rfts = self.ramifier.c_ramify_windows(
+            seq[:n_kmers + self.ramifier.k - 1]
+        )
+        for i in range(n_kmers):
+            self.add_point(rfts[i, :], seq[i:i + self.ramifier.k])
+        return n_kmers
+
     def py_add_point(self, npc.ndarray rft, str kmer):
         cdef npc.uint8_t [:] binary_kmer = encode_kmer(kmer)
         self.add_point(rft, binary_kmer)
@@ -56,7 +86,7 @@ cdef class PreDB:
     cdef add_point(self, double[:] rft, npc.uint8_t [::] binary_kmer):
         self.kmer_insert_buffer[self.kmer_buffer_filled] = (
             np.array(rft, dtype=float).tobytes(),
-            np.array(binary_kmer, dtype=np.uint8).tobytes()
+            self.encode_kmer_blob(binary_kmer)
         )
         self.kmer_buffer_filled += 1
         if self.kmer_buffer_filled >= BUFFER_SIZE:
@@ -89,15 +119,14 @@ cdef class PreDB:
         self.conn.commit()
 
     cdef save_ramifier(self):
-        stringify = lambda M: ','.join([str(el) for el in M])
         self.conn.executemany(
             'INSERT INTO basics VALUES (?,?)',
             [
                 ('k', str(self.ramifier.k)),
                 ('d', str(self.ramifier.d)),
-                ('center', stringify(self.ramifier.center)),
-                ('scale', stringify(self.ramifier.scale)),
-                ('rotation', stringify(np.array(self.ramifier.rotation).flatten())),
+                ('center', pack_array(self.ramifier.center)),
+                ('scale', pack_array(self.ramifier.scale)),
+                ('rotation', pack_array(self.ramifier.rotation)),
             ]
         )
 
@@ -107,15 +136,11 @@ cdef class PreDB:
             val = self.conn.execute('SELECT value FROM basics WHERE name=?', (key,))
             return val.fetchone()[0]
 
-        def numpify(key):
-            val = get_basic(key)
-            return np.array([float(el) for el in val.split(',')])
-
         k = int(get_basic('k'))
         d = int(get_basic('d'))
-        center = numpify('center')
-        scale = numpify('scale')
-        rotation = numpify('rotation')
+        center = unpack_array(get_basic('center'))
+        scale = unpack_array(get_basic('scale'))
+        rotation = unpack_array(get_basic('rotation'))
         rotation = np.reshape(rotation, (4 * k, 4 * k))
 
         return RotatingRamifier(k, d, rotation, center, scale)
@@ -123,35 +148,18 @@ cdef class PreDB:
     @cython.boundscheck(False)
     @cython.wraparound(False)
     def fast_add_kmers_from_fasta(self, str filename, num_to_add=0):
-        cdef FILE * cfile = fopen(filename.encode("UTF-8"), "rb")
-        if cfile == NULL:
-            raise FileNotFoundError(2, "No such file or directory: '%s'" % filename)
-
+        """Add the k-mers of each record of a fasta or fastq file, gzipped or not."""
+        cdef SeqReader reader = SeqReader(filename)
         cdef int n_added = 0
-        cdef char * line = NULL
-        cdef size_t l = 0
-        cdef ssize_t read
-        cdef size_t n_kmers_in_line, i
-        cdef npc.uint8_t[:] kmer
-        while (num_to_add <= 0) or (n_added < num_to_add):
-            getline(&line, &l, cfile)  # header
-            read = getdelim(&line, &l, b'>', cfile)  # read
-            if read == -1: break
-            while (num_to_add <= 0) or (n_added < num_to_add):
-                if line[0] == b'\n':
-                    line += 1
-                kmer = encode_kmer_from_buffer(line, self.ramifier.k)
-                if (num_to_add > 0) and (n_added >= num_to_add):
-                    break
-                if kmer[self.ramifier.k - 1] > 3:
-                    break
-                self.c_add_kmer(kmer)
-                n_added += 1
-                line += 1
-            line = NULL  # I don't understand why this line is necessary but
-                         # without it the program throws a strange error: 
-                         # `pointer being realloacted was not allocated`
-        fclose(cfile)
+        cdef int n_kmers
+        cdef npc.uint8_t[:] seq
+        while ((num_to_add <= 0) or (n_added < num_to_add)) and reader.next_record():
+            seq = reader.record()
+            n_kmers = count_leading_bases(seq) - self.ramifier.k + 1  # stop at the first 'N'
+            if num_to_add > 0:
+                n_kmers = min(n_kmers, num_to_add - n_added)
+            n_added += self.c_add_kmers_from_seq(seq, n_kmers)
+        reader.close()
         return n_added
 
     @classmethod
@@ -11,18 +11,32 @@ cdef class Ramifier:
     cdef public bint use_rc
 
     cdef npc.ndarray c_ramify(self, npc.uint8_t [::] binary_kmer)
+    cdef double[:, :] c_ramify_windows(self, npc.uint8_t [:] seq, int gap=?)
+    cdef double[:, :] c_ramify_starts(self, npc.uint8_t [:] seq, npc.int64_t [:] starts)
+    cdef double[:, :] c_ramify_batch(self, npc.uint8_t [:, :] binary_kmers)
+    cdef npc.ndarray _transform(self, npc.ndarray kmer_matrices)
 
 
 cdef class RotatingRamifier:
     """Project k-mers into RFT space with PCA."""
     cdef public Ramifier ramifier
     cdef public long k, d
+    cdef public int threads
     cdef public bint use_scale
-    cdef public double [:, :] rotation
-    cdef public double [:, :] d_rotation
-    cdef public double [:] center, scale
+    cdef public const double [:, :] rotation
+    cdef public const double [:, :] d_rotation
+    cdef public const double [:] center, scale
+    cdef public bint use_rc
+    cdef public double [:, :] projection
+    cdef public double [:] offset
+    cdef public double [:, :, :] fused
 
     cdef npc.ndarray c_ramify(self, npc.uint8_t [::] binary_kmer)
+    cdef double[:, :] c_ramify_windows(self, npc.uint8_t [:] seq, int gap=?)
+    cdef double[:, :] c_ramify_starts(self, npc.uint8_t [:] seq, npc.int64_t [:] starts)
+    cdef double[:, :] c_ramify_batch(self, npc.uint8_t [:, :] binary_kmers)
+    cdef _build_projection(self)
+    cdef void _fused_ramify(self, const npc.uint8_t [:] binary_kmer, double [:] out) nogil
 
 cdef class StatisticalRam:
     """Identify center, scale, and rotation on a set of k-mers.
@@ -38,3 +52,4 @@ cdef class StatisticalRam:
 
     cpdef add_kmer(self, str kmer)
     cdef c_add_kmer(self, npc.uint8_t [:] binary_kmer)
+    cdef c_add_kmers(self, npc.uint8_t [:, :] kmers)
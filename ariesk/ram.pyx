@@ -6,10 +6,12 @@
 import numpy as np
 cimport numpy as npc
 cimport cython
+from cython.parallel cimport prange
 from libc.stdio cimport *
 from posix.stdio cimport * # FILE, fopen, fclose
 from libc.stdlib cimport malloc, free, rand
 
+from numpy.lib.stride_tricks import sliding_window_view
 from ariesk.utils.ramft import build_rs_matrix
 
 from json import loads
@@ -17,8 +19,27 @@ from json import loads
 from ariesk.utils.kmers cimport (
     encode_kmer,
     encode_kmer_from_buffer,
+    count_leading_bases,
     decode_kmer,
 )
+from ariesk.utils.seq_reader cimport SeqReader
+
+WINDOW_BLOCK_SIZE = 1000  # windows projected per matrix product
+
+
+def pack_array(M):
+    """Return M as raw float64 bytes, for storage in a BLOB."""
+    return np.ascontiguousarray(M, dtype=float).tobytes()
+
+
+def unpack_array(val):
+    """Return a flat float array from `pack_array` bytes or comma-joined text.
+
+    Bytes are wrapped without a copy. Text is what older databases stored.
+    """
+    if isinstance(val, bytes):
+        return np.frombuffer(val, dtype=float)
+    return np.array(val.split(','), dtype=float)
 
 
 cdef class Ramifier:
@@ -49,32 +70,193 @@ cdef class Ramifier:
     def ramify(self, str kmer):
         return self.c_ramify(encode_kmer(kmer))
 
+    cdef double[:, :] c_ramify_windows(self, npc.uint8_t [:] seq, int gap=1):
+        """Return the RFT of every k-mer in seq starting at a multiple of gap."""
+        if seq.shape[0] < self.k:
+            return np.ndarray((0, 4 * self.k))
+        return self.c_ramify_starts(seq, np.arange(0, seq.shape[0] - self.k + 1, gap))
+
+    cdef double[:, :] c_ramify_starts(self, npc.uint8_t [:] seq, npc.int64_t [:] starts):
+        """Return the RFT of the k-mers of seq beginning at each start.
+
+        The sequence is one-hot encoded once and every k-mer is a window
+        onto that encoding, sliding one base at a time. The reverse
+        complement of the whole sequence is the same encoding reversed
+        along both axes (the base order is ACGT) so its windows come for
+        free as well. Windows are projected in blocks with one matrix
+        product per block instead of one product per k-mer.
+        """
+        cdef int n_seq = seq.shape[0]
+        cdef npc.ndarray encoded = np.asarray(seq)
+        cdef npc.ndarray np_starts = np.asarray(starts)
+        cdef npc.ndarray onehot = np.zeros((n_seq, 4), dtype=np.uint8)
+        cdef npc.ndarray is_base = encoded <= 3  # leave 'N' blank
+        onehot[np.nonzero(is_base)[0], encoded[is_base]] = 1
+        fwd_windows = sliding_window_view(onehot, (self.k, 4))[:, 0]
+        rc_windows = sliding_window_view(onehot[::-1, ::-1], (self.k, 4))[:, 0]
+
+        cdef npc.ndarray rfts = np.ndarray((np_starts.shape[0], 4 * self.k))
+        cdef npc.ndarray block_starts, kmer_matrices
+        cdef int block_start
+        for block_start in range(0, np_starts.shape[0], WINDOW_BLOCK_SIZE):
+            block_starts = np_starts[block_start:block_start + WINDOW_BLOCK_SIZE]
+            kmer_matrices = fwd_windows[block_starts]
+            if self.use_rc:
+                np.maximum(
+                    kmer_matrices, rc_windows[n_seq - self.k - block_starts],
+                    out=kmer_matrices
+                )
+            rfts[block_start:block_start + block_starts.shape[0]] = self._transform(kmer_matrices)
+        return rfts
+
+    cdef double[:, :] c_ramify_batch(self, npc.uint8_t [:, :] binary_kmers):
+        """Return the RFT of each row of binary_kmers.
+
+        One-hot matrices for the whole batch are built with array indexing
+        and projected in blocks, one matrix product per block.
+        """
+        cdef npc.ndarray kmers = np.asarray(binary_kmers)
+        cdef npc.ndarray rfts = np.ndarray((kmers.shape[0], 4 * self.k))
+        cdef npc.ndarray block, kmer_matrices, rows, cols
+        cdef int block_start
+        for block_start in range(0, kmers.shape[0], WINDOW_BLOCK_SIZE):
+            block = kmers[block_start:block_start + WINDOW_BLOCK_SIZE]
+            kmer_matrices = np.zeros((block.shape[0], self.k, 4), dtype=np.uint8)
+            rows, cols = np.nonzero(block <= 3)  # leave 'N' blank
+            kmer_matrices[rows, cols, block[rows, cols]] = 1
+            if self.use_rc:
+                kmer_matrices[rows, self.k - cols - 1, 3 - block[rows, cols]] = 1
+            rfts[block_start:block_start + block.shape[0]] = self._transform(kmer_matrices)
+        return rfts
+
+    cdef npc.ndarray _transform(self, npc.ndarray kmer_matrices):
+        """Multiply a stack of (k, 4) one-hot matrices by rs_matrix at once."""
+        cdef int n_kmers = kmer_matrices.shape[0]
+        cdef npc.ndarray rfts = np.dot(
+            self.rs_matrix,
+            kmer_matrices.transpose(1, 0, 2).reshape(self.k, 4 * n_kmers)
+        )
+        return rfts.reshape(self.k, n_kmers, 4).transpose(1, 0, 2).reshape(n_kmers, 4 * self.k)
+
+    def ramify_windows(self, str seq, int gap=1):
+        return np.array(self.c_ramify_windows(encode_kmer(seq), gap=gap))
+
+    def ramify_batch(self, npc.uint8_t [:, :] binary_kmers):
+        return np.array(self.c_ramify_batch(binary_kmers))
+
 
 cdef class RotatingRamifier:
     """Project k-mers into RFT space with PCA."""
 
-    def __cinit__(self, k, d, rotation, center, scale, use_scale=True, use_rc=True):
+    def __cinit__(self, k, d, rotation, center, scale, use_scale=True, use_rc=True, threads=1):
         self.k = k
         self.d = d
+        self.threads = threads
         self.rotation = rotation
         self.d_rotation = rotation[:self.d, :]
         self.center = center
         self.scale = scale
         self.ramifier = Ramifier(self.k, use_rc=use_rc)
+        self.use_rc = use_rc
         self.use_scale = use_scale
+        self._build_projection()
 
-    cdef npc.ndarray c_ramify(self, npc.uint8_t [::] binary_kmer):
-        cdef npc.ndarray rft = self.ramifier.c_ramify(binary_kmer)
-        cdef npc.ndarray centered = (rft - self.center)
+    cdef _build_projection(self):
+        """Fold the RFT, centering, scaling and rotation into one affine map.
+
+        rotate((rs_matrix . M - center) / scale) == fused . M + offset
+
+        M is the one-hot (k, 4) matrix of a k-mer so the product is just
+        a sum of at most 2k columns of `fused`, O(dk) instead of O(k^2).
+        `fused` is stored as (k, 5, d) with a zero row for 'N' so that
+        ambiguous bases need no special casing.
+        """
+        cdef npc.ndarray projection = np.array(self.d_rotation, dtype=float)
         if self.use_scale:
-            centered /= self.scale
-        return np.dot(self.d_rotation, centered)
+            projection /= np.asarray(self.scale)
+        self.projection = projection
+        self.offset = -np.dot(projection, np.asarray(self.center))
+        cdef npc.ndarray fused = np.zeros((self.k, 5, self.d))
+        fused[:, :4, :] = np.einsum(
+            'jqb,qi->ibj',
+            projection.reshape(self.d, self.k, 4),
+            np.asarray(self.ramifier.rs_matrix),
+            optimize=True
+        )
+        self.fused = fused
+
+    cdef void _fused_ramify(self, const npc.uint8_t [:] binary_kmer, double [:] out) nogil:
+        cdef int i, j
+        cdef npc.uint8_t base, rc_base
+        for j in range(self.d):
+            out[j] = self.offset[j]
+        for i in range(self.k):
+            base = binary_kmer[i]
+            if base > 3:
+                base = 4
+            for j in range(self.d):
+                out[j] += self.fused[i, base, j]
+            if self.use_rc:
+                rc_base = binary_kmer[self.k - i - 1]
+                rc_base = 3 - rc_base if rc_base <= 3 else 4
+                if rc_base != base:  # a base is only counted once per position
+                    for j in range(self.d):
+                        out[j] += self.fused[i, rc_base, j]
+
+    cdef npc.ndarray c_ramify(self, npc.uint8_t [::] binary_kmer):
+        cdef npc.ndarray rft = np.ndarray((self.d,))
+        self._fused_ramify(binary_kmer, rft)
+        return rft
 
     def ramify(self, str kmer):
         return self.c_ramify(encode_kmer(kmer))
 
+    cdef double[:, :] c_ramify_windows(self, npc.uint8_t [:] seq, int gap=1):
+        """Return the rotated RFT of every k-mer in seq starting at a multiple of gap."""
+        if seq.shape[0] < self.k:
+            return np.ndarray((0, self.d))
+        return self.c_ramify_starts(seq, np.arange(0, seq.shape[0] - self.k + 1, gap))
+
+    cdef double[:, :] c_ramify_starts(self, npc.uint8_t [:] seq, npc.int64_t [:] starts):
+        """Return the rotated RFT of the k-mers of seq beginning at each start.
+
+        Runs without the GIL on `threads` OpenMP threads. Each k-mer is
+        written to its own row so results do not depend on the thread count.
+        """
+        cdef double[:, :] rfts = np.ndarray((starts.shape[0], self.d))
+        cdef int i
+        for i in prange(starts.shape[0], nogil=True, num_threads=self.threads, schedule='static'):
+            self._fused_ramify(seq[starts[i]:starts[i] + self.k], rfts[i, :])
+        return rfts
+
+    cdef double[:, :] c_ramify_batch(self, npc.uint8_t [:, :] binary_kmers):
+        """Return the rotated RFT of each row of binary_kmers, see `c_ramify_starts`."""
+        cdef double[:, :] rfts = np.ndarray((binary_kmers.shape[0], self.d))
+        cdef int i
+        for i in prange(binary_kmers.shape[0], nogil=True, num_threads=self.threads, schedule='static'):
+            self._fused_ramify(binary_kmers[i, :], rfts[i, :])
+        return rfts
+
+    def ramify_windows(self, str seq, int gap=1):
+        return np.array(self.c_ramify_windows(encode_kmer(seq), gap=gap))
+
+    def ramify_batch(self, npc.uint8_t [:, :] binary_kmers):
+        return np.array(self.c_ramify_batch(binary_kmers))
+
+    def to_file(self, filepath):
+        """Save the rotation as one .npy array, see `from_file`."""
+        np.save(filepath, self.to_array())
+
     @classmethod
-    def from_file(cls, d, filepath):
+    def from_file(cls, d, filepath, **kwargs):
+        """Return a RotatingRamifier from a JSON or .npy rotation file.
+
+        A .npy file holds center, scale and the rotation stacked into one
+        (4k + 2, 4k) array. It is memory mapped so only the first d rows
+        of the rotation are ever read from disk.
+        """
+        if str(filepath).endswith('.npy'):
+            return cls.from_array(d, np.load(filepath, mmap_mode='r'), **kwargs)
         saved_rotation = loads(open(filepath).read())
         return cls(
             saved_rotation['k'],
@@ -82,16 +264,39 @@ cdef class RotatingRamifier:
             np.array(saved_rotation['rotation'], dtype=float),
             np.array(saved_rotation['center'], dtype=float),
             np.array(saved_rotation['scale'], dtype=float),
+            **kwargs
         )
 
     @classmethod
-    def from_dict(cls, saved_dict):
+    def from_array(cls, d, saved_rotation, **kwargs):
+        """Return a RotatingRamifier that reads from the stacked array of `to_file`.
+
+        The array is not copied so it may be a memory map or shared memory.
+        """
+        return cls(
+            saved_rotation.shape[1] // 4,
+            d,
+            saved_rotation[2:],
+            saved_rotation[0],
+            saved_rotation[1],
+            **kwargs
+        )
+
+    def to_array(self):
+        """Return center, scale and the rotation stacked as in `to_file`."""
+        return np.vstack([
+            np.asarray(self.center), np.asarray(self.scale), np.asarray(self.rotation)
+        ])
+
+    @classmethod
+    def from_dict(cls, saved_dict, **kwargs):
         return cls(
             saved_dict['k'],
             saved_dict['d'],
             np.array(saved_dict['rotation'], dtype=float),
             np.array(saved_dict['center'], dtype=float),
             np.array(saved_dict['scale'], dtype=float),
+            **kwargs
         )
 
 
@@ -125,6 +330,13 @@ cdef class StatisticalRam:
         self.rfts[self.num_kmers_added] = rft
         self.num_kmers_added += 1
 
+    cdef c_add_kmers(self, npc.uint8_t [:, :] kmers):
+        assert self.num_kmers_added + kmers.shape[0] <= self.max_size
+        self.rfts[self.num_kmers_added:self.num_kmers_added + kmers.shape[0]] = (
+            self.ramifier.c_ramify_batch(kmers)
+        )
+        self.num_kmers_added += kmers.shape[0]
+
     def get_centers(self):
         self.close()
         return np.mean(self.rfts, axis=0)
@@ -164,34 +376,26 @@ cdef class StatisticalRam:
     @cython.boundscheck(False)
     @cython.wraparound(False)
     def fast_add_kmers_from_fasta(self, str filename, int dropout=1000):
-        cdef FILE * cfile = fopen(filename.encode("UTF-8"), "rb")
-        if cfile == NULL:
-            raise FileNotFoundError(2, "No such file or directory: '%s'" % filename)
-
+        cdef SeqReader reader = SeqReader(filename)
         cdef int n_added = 0
-        cdef char * line = NULL
-        cdef size_t l = 0
-        cdef ssize_t read
-        cdef size_t n_kmers_in_line, i
-        cdef npc.uint8_t[:] kmer
-        while n_added < self.max_size:
-            getline(&line, &l, cfile)  # header
-            read = getdelim(&line, &l, b'>', cfile)  # read
-            if read == -1: break
-            while n_added < self.max_size:
-                if line[0] == b'\n':
-                    line += 1
-                kmer = encode_kmer_from_buffer(line, self.ramifier.k)
-                if n_added >= self.max_size:
-                    break
-                if kmer[self.ramifier.k - 1] > 3:
+        cdef int i, n_kmers
+        cdef npc.uint8_t[:] seq
+        cdef list starts
+        cdef double[:, :] rfts
+        while n_added < self.max_size and reader.next_record():
+            seq = reader.record()
+            n_kmers = count_leading_bases(seq) - self.k + 1  # stop at the first 'N'
+            starts = []
+            for i in range(n_kmers):
+                if n_added + len(starts) >= self.max_size:
                     break
                 if (dropout <= 0) or ((rand() % (1000 * 1000)) < dropout):
-                    self.c_add_kmer(kmer)
-                    n_added += 1
-                line += 1
-            line = NULL  # I don't understand why this line is necessary but
-                         # without it the program throws a strange error: 
-                         # `pointer being realloacted was not allocated`
-        fclose(cfile)
+                    starts.append(i)
+            if len(starts) == 0:
+                continue
+            rfts = self.ramifier.c_ramify_starts(seq, np.array(starts, dtype=np.int64))
+            self.rfts[n_added:n_added + len(starts)] = rfts
+            n_added += len(starts)
+            self.num_kmers_added += len(starts)
+        reader.close()
         return n_added
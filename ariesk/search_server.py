@@ -4,6 +4,7 @@ from json import dumps, loads
 from time import time
 
 from ariesk.grid_searcher import GridCoverSearcher
+from ariesk.utils.lru_cache import DEFAULT_CACHE_BYTES
 from ariesk.params import ParameterPicker
 
 '''
@@ -146,6 +147,6 @@ class SearchServer:
         return results
 
     @classmethod
-    def from_filepath(cls, port, filepath, **kwargs):
-        grid = GridCoverSearcher.from_filepath(filepath)
+    def from_filepath(cls, port, filepath, threads=1, cache_bytes=DEFAULT_CACHE_BYTES, **kwargs):
+        grid = GridCoverSearcher.from_filepath(filepath, threads=threads, cache_bytes=cache_bytes)
         return cls(port, grid, **kwargs)
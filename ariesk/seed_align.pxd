@@ -6,7 +6,7 @@ cimport numpy as npc
 
 cdef npc.uint64_t[:, :] seed_and_extend(
     npc.uint8_t[:] query, npc.uint8_t[:] target,
-    npc.uint64_t[:, :] q_kmers, npc.uint32_t[:, :] t_kmers,
+    npc.uint64_t[:, :] q_kmers, const npc.uint32_t[:] t_kmers,
     int word_size
     )
 cdef npc.uint64_t[:, :] extend_seeds(
@@ -15,7 +15,7 @@ cdef npc.uint64_t[:, :] extend_seeds(
     npc.uint64_t[:, :] matched_positions
     )
 
-cdef npc.uint64_t[:, :] find_matched_positions(npc.uint64_t[:, :] q_kmers, npc.uint32_t[:, :] t_kmers)
+cdef npc.uint64_t[:, :] find_matched_positions(npc.uint64_t[:, :] q_kmers, const npc.uint32_t[:] t_kmers)
 cdef npc.uint64_t[:, :] find_compact_intervals(
     int word_size, int max_gap, npc.uint64_t[:, :] matched_positions
     )
@@ -31,4 +31,4 @@ cdef extend_seeds_left_right(
 
 cdef npc.uint32_t fast_modulo(npc.uint32_t val, npc.uint64_t N)
 cdef npc.uint64_t[:, :] get_query_kmers(npc.uint8_t[:] query, int k, int gap)
-cdef npc.uint32_t[:, :] get_target_kmers(npc.uint8_t[:] target, int k)
+cdef npc.uint32_t[:] get_target_kmers(npc.uint8_t[:] target, int k)
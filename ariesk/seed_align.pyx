@@ -7,18 +7,20 @@ import numpy as np
 cimport numpy as npc
 
 from libc.math cimport log, floor, ceil, log2
-from ariesk.utils.kmers cimport encode_kmer, decode_kmer, bounded_needle, needle_dist
+from ariesk.utils.kmers cimport encode_kmer, decode_kmer, bounded_needle_fast, nw_workspace
 
 
 cdef npc.uint32_t GAP_PENALTY = 1
 cdef npc.uint32_t MIS_PENALTY = 1
 cdef npc.uint32_t MAX_KMER_HASH = 4096
-cdef npc.uint32_t TARGET_WIDTH = 100
 cdef npc.uint64_t MAX_INT_32 = 2 ** 32
 
 cdef npc.uint32_t MAX_INTRA_INTERVAL_GAP = 6
 cdef npc.uint32_t MAX_INTER_INTERVAL_GAP = 100
 
+SEED_WORD_SIZE = 7  # word size of the seed indices stored for each contig
+SEED_WORD_GAP = 3  # stride of query words looked up in a seed index
+
 
 def py_seed_extend(query, target, k=7, gap=3):
     return np.array(seed_and_extend(
@@ -31,10 +33,12 @@ def py_seed_extend(query, target, k=7, gap=3):
 
 cdef npc.uint64_t[:, :] seed_and_extend(
     npc.uint8_t[:] query, npc.uint8_t[:] target,
-    npc.uint64_t[:, :] q_kmers, npc.uint32_t[:, :] t_kmers,
+    npc.uint64_t[:, :] q_kmers, const npc.uint32_t[:] t_kmers,
     int word_size
     ):
     cdef npc.uint64_t[:, :] matched_positions = find_matched_positions(q_kmers, t_kmers)
+    if matched_positions.shape[0] == 0:
+        return np.ndarray((0, 4), dtype=np.uint64)
     return extend_seeds(
         query, target, word_size, MAX_INTRA_INTERVAL_GAP, MAX_INTER_INTERVAL_GAP, matched_positions
     )
@@ -66,36 +70,35 @@ cdef npc.uint64_t[:, :] extend_seeds(
     return matching_intervals
 
 
-cdef npc.uint64_t[:, :] find_matched_positions(npc.uint64_t[:, :] q_kmers, npc.uint32_t[:, :] t_kmers):
+cdef npc.uint64_t[:, :] find_matched_positions(npc.uint64_t[:, :] q_kmers, const npc.uint32_t[:] t_kmers):
     """Return a two column list of start positions for words in query
     also found in target. At most one hit per query position. Hit in
-    target shpould be lowest possible position. Target poss should be
-    montotonically not decreasing.
+    target should be the lowest possible position. Target positions are
+    monotonically not decreasing.
 
     q_kmers is a two column matrix of [kmer_hash, position]
-    t_kmers is a many column matrix with <MAX_KMER_HASH> rows.
-        each row contains positions where a single kmer_hash
-        occurs in the target. -1 markes the end of the list
+    t_kmers is a seed index from `get_target_kmers`.
     """
     cdef npc.uint64_t[:, :] matched_positions = np.ndarray((q_kmers.shape[0], 2), dtype=np.uint64)
     cdef int n_hits = 0
     cdef int q_index
-    cdef int t_index = 0
-    cdef int i
-    cdef npc.uint32_t target_pos
-    cdef npc.uint64_t q_kmer_hash
+    cdef npc.uint32_t t_index = 0
+    cdef npc.uint64_t q_kmer_hash, lo, hi, mid
     for q_index in range(q_kmers.shape[0]):
         q_kmer_hash = q_kmers[q_index, 0]
-        for i in range(TARGET_WIDTH):
-            target_pos = t_kmers[q_kmer_hash, i]
-            if target_pos <= 0:
-                break
-            elif target_pos >= t_index:
-                matched_positions[n_hits, 0] = q_kmers[q_index, 1]
-                matched_positions[n_hits, 1] = target_pos
-                t_index = target_pos
-                n_hits += 1
-                break
+        lo = MAX_KMER_HASH + 1 + t_kmers[q_kmer_hash]
+        hi = MAX_KMER_HASH + 1 + t_kmers[q_kmer_hash + 1]
+        while lo < hi:  # first position of this hash at or after t_index
+            mid = (lo + hi) // 2
+            if t_kmers[mid] < t_index:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < MAX_KMER_HASH + 1 + t_kmers[q_kmer_hash + 1]:
+            matched_positions[n_hits, 0] = q_kmers[q_index, 1]
+            matched_positions[n_hits, 1] = t_kmers[lo]
+            t_index = t_kmers[lo]
+            n_hits += 1
     return matched_positions[:n_hits, :]
 
 
@@ -154,6 +157,7 @@ cdef int extend_intervals(
     cdef npc.uint64_t min_len, len_dif, min_gap, max_gap
     cdef double gap_score
     cdef npc.uint64_t max_gap_btwn_intervals_score
+    cdef npc.int32_t[:] work = nw_workspace(0)
     while j < matching_intervals.shape[0]:
         q_s = matching_intervals[i, 0]
         q_e = matching_intervals[i, 1]
@@ -185,10 +189,10 @@ cdef int extend_intervals(
         if max_gap_btwn_intervals_score <= gap_score:  # automatically extend
             gap_score -= max_gap_btwn_intervals_score
         elif max_gap < max_inter_interval_gap:  # attempt extension
-            gap_score = needle_dist(
+            gap_score = bounded_needle_fast(  # only an exact match extends, stop at the first edit
                 query[q_e + 1: n_q_s],
                 target[t_e + 1: n_t_s],
-                False
+                0, False, work
             )
             gap_score *= -1  # our function returns distance not similarity
         else:
@@ -261,14 +265,27 @@ cdef npc.uint64_t[:, :] get_query_kmers(npc.uint8_t[:] query, int k, int gap):
     return q_kmers[:n_kmers, :]
 
 
-cdef npc.uint32_t[:, :] get_target_kmers(npc.uint8_t[:] target, int k):
-    cdef npc.uint32_t[:, :] t_kmers = np.zeros((MAX_KMER_HASH, TARGET_WIDTH), dtype=np.uint32)
-    cdef int i, j
-    cdef npc.uint32_t kmer_hash
-    for i in range(1, target.shape[0] - k + 1):
-        kmer_hash = fast_modulo(fnva(target[i:i + k]), MAX_KMER_HASH)
-        for j in range(TARGET_WIDTH):
-            if t_kmers[kmer_hash, j] <= 0:
-                t_kmers[kmer_hash, j] = i
-                break
+cdef npc.uint32_t[:] get_target_kmers(npc.uint8_t[:] target, int k):
+    """Return the seed index of target, the positions of each word by hash.
+
+    The first MAX_KMER_HASH + 1 values are offsets, the positions of words
+    with hash h are the values after them from offsets[h] to offsets[h + 1],
+    in increasing order. The index is flat so it can be stored as a blob.
+    """
+    cdef int n_words = max(target.shape[0] - k + 1, 0)
+    cdef npc.uint32_t[:] hashes = np.ndarray((n_words,), dtype=np.uint32)
+    cdef int i
+    for i in range(n_words):
+        hashes[i] = fast_modulo(fnva(target[i:i + k]), MAX_KMER_HASH)
+    cdef npc.ndarray t_kmers = np.zeros((MAX_KMER_HASH + 1 + n_words,), dtype=np.uint32)
+    t_kmers[1:MAX_KMER_HASH + 1] = np.cumsum(np.bincount(np.asarray(hashes), minlength=MAX_KMER_HASH))
+    t_kmers[MAX_KMER_HASH + 1:] = np.argsort(hashes, kind='stable')
     return t_kmers
+
+
+def seed_index_to_blob(const npc.uint32_t[:] t_kmers):
+    return np.asarray(t_kmers, dtype=np.uint32).tobytes()
+
+
+def seed_index_from_blob(const npc.uint8_t[:] blob):
+    return np.frombuffer(blob, dtype=np.uint32)
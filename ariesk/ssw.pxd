@@ -25,9 +25,9 @@ cdef class StripedSmithWaterman:
     cdef bool is_protein
     cdef bool suppress_sequences
     cdef cnp.uint8_t[:] query_sequence
-    cdef cnp.uint8_t[:] target_sequence
     cdef cnp.int8_t[:] matrix
 
-    cdef double align(self, cnp.uint8_t[:] target_sequence)
+    cdef double align(self, cnp.uint8_t[:] target_sequence) except -1
+    cdef double[:] align_many(self, list targets)
     cdef cnp.int8_t[:] _build_match_matrix(self, match_score, mismatch_score)
     cdef cnp.int8_t[:] _convert_dict2d_to_matrix(self, dict2d)
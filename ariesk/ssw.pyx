@@ -43,6 +43,8 @@ cdef extern from "_lib/ssw.c":
                             const cnp.int32_t filterd,
                             const cnp.int32_t maskLen)
 
+    cdef void align_destroy(s_align* a)
+
 
 cdef class StripedSmithWaterman:
 
@@ -81,19 +83,37 @@ cdef class StripedSmithWaterman:
         )
 
 
-    cdef double align(self, cnp.uint8_t[:] target_sequence):
-        self.target_sequence = target_sequence
-        cdef s_align *align
-        cdef const cnp.int8_t* target_pointer = <const cnp.int8_t *> &self.target_sequence[0]
-        align = ssw_align(self.profile, target_pointer,
-                          target_sequence.shape[0], self.gap_open_penalty,
-                          self.gap_extend_penalty, self.bit_flag,
-                          self.score_filter, self.distance_filter,
-                          self.mask_length)
-        return align.score1
+    cdef double align(self, cnp.uint8_t[:] target_sequence) except -1:
+        """Return the optimal alignment score of target against the query profile."""
+        cdef const cnp.int8_t* target_pointer = <const cnp.int8_t *> &target_sequence[0]
+        cdef s_align *align = ssw_align(
+            self.profile, target_pointer,
+            target_sequence.shape[0], self.gap_open_penalty,
+            self.gap_extend_penalty, self.bit_flag,
+            self.score_filter, self.distance_filter,
+            self.mask_length
+        )
+        if align is NULL:
+            raise ValueError('SSW alignment failed')
+        cdef double score = align.score1
+        align_destroy(align)
+        return score
+
+    cdef double[:] align_many(self, list targets):
+        """Return the score of each target, reusing one query profile."""
+        cdef double[:] scores = np.ndarray((len(targets),), dtype=float)
+        cdef int i
+        for i in range(len(targets)):
+            scores[i] = self.align(targets[i])
+        return scores
+
+    def py_align(self, target_sequence):
+        return self.align(target_sequence)
+
+    def py_align_many(self, targets):
+        return np.asarray(self.align_many(list(targets)))
 
     def __dealloc__(self):
-        pass
         if self.profile is not NULL:
             init_destroy(self.profile)
 
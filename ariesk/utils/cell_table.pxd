@@ -0,0 +1,18 @@
+# cython: language_level=3
+
+import numpy as np
+cimport numpy as npc
+
+
+cdef class CellTable:
+    cdef public int d, n_cells
+    cdef public npc.int32_t[:, :] cells
+    cdef npc.int32_t[:] slots
+    cdef npc.uint64_t mask
+
+    cdef int _stage(self, const double[:] centroid) except -1
+    cdef int add(self, const double[:] centroid) except -1
+    cdef npc.int32_t[:] add_many(self, const double[:, :] centroids)
+    cdef int lookup(self, const double[:] centroid) except -2
+    cdef npc.uint64_t _find_slot(self, const npc.int32_t[:] cell) nogil
+    cdef _grow_slots(self)
@@ -0,0 +1,135 @@
+# cython: profile=True
+# cython: linetrace=True
+# cython: language_level=3
+# cython: boundscheck=False, wraparound=False
+
+import numpy as np
+cimport numpy as npc
+
+cdef npc.int32_t EMPTY = -1
+cdef double MAX_COORD = 2 ** 31 - 1
+cdef npc.uint64_t FNV_OFFSET = 0xcbf29ce484222325
+cdef npc.uint64_t FNV_PRIME = 0x100000001b3
+
+
+cdef class CellTable:
+    """Map integer grid cells to sequential ids.
+
+    Cells are stored once, as int32 rows of `cells` indexed by id, and
+    found through an open addressing (linear probing) table of ids.
+    Ids are handed out in the order cells are added.
+    """
+
+    def __cinit__(self, int d, int capacity=1024):
+        self.d = d
+        self.n_cells = 0
+        self.cells = np.ndarray((max(capacity, 1), d), dtype=np.int32)
+        cdef npc.uint64_t n_slots = 16
+        while n_slots < 2 * capacity:
+            n_slots *= 2
+        self.slots = np.full((n_slots,), EMPTY, dtype=np.int32)
+        self.mask = n_slots - 1
+
+    @classmethod
+    def from_centroids(cls, centroids):
+        """Return a CellTable of the rows of centroids with id i for row i."""
+        cdef const double[:, :] rows = np.asarray(centroids, dtype=float)
+        cdef CellTable table = cls(rows.shape[1], capacity=rows.shape[0])
+        table.add_many(rows)
+        return table
+
+    cdef npc.uint64_t _find_slot(self, const npc.int32_t[:] cell) nogil:
+        """Return the slot holding cell, or the empty slot where it belongs."""
+        cdef npc.uint64_t h = FNV_OFFSET
+        cdef int j
+        for j in range(self.d):
+            h = (h ^ <npc.uint32_t> cell[j]) * FNV_PRIME
+        h ^= h >> 29
+        cdef npc.uint64_t slot = h & self.mask
+        cdef npc.int32_t cell_id
+        cdef bint match
+        while True:
+            cell_id = self.slots[slot]
+            if cell_id == EMPTY:
+                return slot
+            match = True
+            for j in range(self.d):
+                if self.cells[cell_id, j] != cell[j]:
+                    match = False
+                    break
+            if match:
+                return slot
+            slot = (slot + 1) & self.mask
+
+    cdef int _stage(self, const double[:] centroid) except -1:
+        """Write centroid as int32 into the spare row after the last cell."""
+        cdef int j
+        if self.n_cells == self.cells.shape[0]:
+            cells = np.ndarray((2 * self.cells.shape[0], self.d), dtype=np.int32)
+            cells[:self.n_cells] = self.cells
+            self.cells = cells
+        for j in range(self.d):
+            if not -MAX_COORD <= centroid[j] <= MAX_COORD or centroid[j] != <npc.int32_t> centroid[j]:
+                raise ValueError(f'Centroid is not an int32 grid cell: {np.asarray(centroid)}')
+            self.cells[self.n_cells, j] = <npc.int32_t> centroid[j]
+        return 0
+
+    cdef int add(self, const double[:] centroid) except -1:
+        """Return the id of centroid, adding it if it is new."""
+        self._stage(centroid)
+        cdef npc.uint64_t slot = self._find_slot(self.cells[self.n_cells, :])
+        if self.slots[slot] != EMPTY:
+            return self.slots[slot]
+        self.slots[slot] = self.n_cells
+        self.n_cells += 1
+        if 2 * self.n_cells > self.slots.shape[0]:
+            self._grow_slots()
+        return self.n_cells - 1
+
+    cdef npc.int32_t[:] add_many(self, const double[:, :] centroids):
+        """Return the id of each row of centroids, adding new ones in order."""
+        cdef npc.int32_t[:] ids = np.ndarray((centroids.shape[0],), dtype=np.int32)
+        cdef int i
+        for i in range(centroids.shape[0]):
+            ids[i] = self.add(centroids[i, :])
+        return ids
+
+    cdef int lookup(self, const double[:] centroid) except -2:
+        """Return the id of centroid or -1 if it is not in the table."""
+        self._stage(centroid)
+        return self.slots[self._find_slot(self.cells[self.n_cells, :])]
+
+    cdef _grow_slots(self):
+        self.slots = np.full((2 * self.slots.shape[0],), EMPTY, dtype=np.int32)
+        self.mask = self.slots.shape[0] - 1
+        cdef int i
+        for i in range(self.n_cells):
+            self.slots[self._find_slot(self.cells[i, :])] = i
+
+    def py_add(self, centroid):
+        return self.add(np.asarray(centroid, dtype=float))
+
+    def centroids(self):
+        """Return an (n_cells, d) float array of cells, row i has id i."""
+        return np.asarray(self.cells[:self.n_cells], dtype=float)
+
+    def __len__(self):
+        return self.n_cells
+
+    def __contains__(self, centroid):
+        return self.lookup(np.asarray(centroid, dtype=float)) >= 0
+
+    def __getitem__(self, centroid):
+        cdef int cell_id = self.lookup(np.asarray(centroid, dtype=float))
+        if cell_id < 0:
+            raise KeyError(centroid)
+        return cell_id
+
+    def keys(self):
+        return [tuple(row) for row in np.asarray(self.cells[:self.n_cells])]
+
+    def items(self):
+        return zip(self.keys(), range(self.n_cells))
+
+    def __iter__(self):
+        return iter(self.keys())
@@ -6,10 +6,31 @@ cimport numpy as npc
 cdef npc.uint8_t[::] encode_kmer(str kmer)
 cdef npc.uint8_t [::] encode_kmer_from_buffer(char * buf, int k)
 cdef str decode_kmer(const npc.uint8_t[:] binary_kmer)
-cdef npc.uint8_t[::] encode_seq_from_buffer(char * buf, int max_len)
+cdef int count_leading_bases(npc.uint8_t[:] seq)
+cdef npc.uint8_t[:, :] pack_kmers(const npc.uint8_t[:, :] kmers)
+cdef npc.uint8_t[:, :] unpack_kmers(const npc.uint8_t[:, :] packed, int k)
+cdef bytes pack_seq(const npc.uint8_t[:] seq)
+cdef npc.uint8_t[:] unpack_seq(const npc.uint8_t[:] blob, long n)
+cdef bytes pack_contig(const npc.uint8_t[:] seq)
+cdef npc.uint8_t[:] unpack_contig(const npc.uint8_t[:] blob)
+cdef bytes encode_kmer_blob(const npc.uint8_t[:] binary_kmer, bint packed)
+cdef npc.uint8_t[:] decode_kmer_blob(const npc.uint8_t[:] blob, int k, bint packed)
+cdef bytes encode_contig_blob(const npc.uint8_t[:] contig, bint packed)
+cdef npc.uint8_t[:] decode_contig_blob(const npc.uint8_t[:] blob, bint packed)
+cdef int hamming_packed(const npc.uint8_t[:] p1, const npc.uint8_t[:] p2, int n_bytes) noexcept nogil
+cdef npc.int64_t[:] minimizer_starts(const npc.uint8_t[:] seq, int k, int w)
 
 cdef double needle_dist(npc.uint8_t[::] k1, npc.uint8_t[::] k2, bint normalize)
-cdef double needle_fast(npc.uint8_t[::] k1, npc.uint8_t[::] k2, bint normalize, double[:, :] score)
+cdef npc.int32_t[:] nw_workspace(int band)
+cdef int banded_nw(const npc.uint8_t[:] k1, const npc.uint8_t[:] k2, int band, int bound,
+                   npc.int32_t[:] work) noexcept nogil
+cdef double needle_fast(npc.uint8_t[::] k1, npc.uint8_t[::] k2, bint normalize, npc.int32_t[:] work) noexcept nogil
 cdef double bounded_needle(npc.uint8_t[::] k1, npc.uint8_t[::] k2, npc.uint8_t bound)
-cdef double bounded_needle_fast(npc.uint8_t[::] k1, npc.uint8_t[::] k2, npc.uint8_t bound, bint normalize, double[:, :] score)
-cdef double hamming_dist(npc.uint8_t[::] k1, npc.uint8_t[::] k2, bint normalize)
+cdef double bounded_needle_fast(npc.uint8_t[::] k1, npc.uint8_t[::] k2, npc.uint8_t bound, bint normalize, npc.int32_t[:] work) noexcept nogil
+cdef npc.uint64_t[:] myers_workspace(int m)
+cdef void myers_prepare(const npc.uint8_t[:] query, npc.uint64_t[:] work) noexcept nogil
+cdef int myers_dist(npc.uint64_t[:] work, int m, const npc.uint8_t[:] target, int bound) noexcept nogil
+cdef int bounded_edit_dist(const npc.uint8_t[:] k1, const npc.uint8_t[:] k2, int bound, npc.uint64_t[:] work) noexcept nogil
+cdef void bounded_edit_dists(const npc.uint8_t[:] query, const npc.uint8_t[:, :] targets, int bound,
+                             npc.uint64_t[:] work, npc.int32_t[:] out) noexcept nogil
+cdef double hamming_dist(npc.uint8_t[::] k1, npc.uint8_t[::] k2, bint normalize) noexcept nogil
@@ -42,32 +42,13 @@ cdef npc.uint8_t [::] encode_kmer_from_buffer(char * buf, int k):
     return kmer
 
 
-cdef npc.uint8_t [::] encode_seq_from_buffer(char * buf, int max_len):
-    cdef npc.uint8_t[::] seq = np.ndarray((max_len,), dtype=np.uint8)
-    cdef int i = 0
-    cdef int j = 0
-    while j < max_len:
-        c = buf[0]
-        if c == 0:
-            break  # this means the buffer did not have enough to read
-        if c == b'A':
-            seq[i] = 0
-        elif c == b'C':
-            seq[i] = 1
-        elif c == b'G':
-            seq[i] = 2
-        elif c == b'T':
-            seq[i] = 3
-        elif c == b'N':
-            seq[i] = 4
-        elif c == b'\n':
-            i -= 1  # special case for line wrapping in fasta
-        else:
-            seq[i] = 4
-        i += 1
-        j += 1
-        buf += 1
-    return seq[:i - 1]
+cdef int count_leading_bases(npc.uint8_t [:] seq):
+    """Return the number of bases before the first non ACGT base."""
+    cdef int i
+    for i in range(seq.shape[0]):
+        if seq[i] > 3:
+            return i
+    return seq.shape[0]
 
 
 cdef str decode_kmer(const npc.uint8_t [:] binary_kmer):
@@ -87,7 +68,223 @@ def py_decode_kmer(npc.ndarray binary_kmer):
     return decode_kmer(binary_kmer)
 
 
-cdef double hamming_dist(npc.uint8_t [:] k1, npc.uint8_t [:] k2, bint normalize):
+cdef npc.uint8_t[:, :] pack_kmers(const npc.uint8_t[:, :] kmers):
+    """Pack each row of kmers four bases to a byte, first base in the low bits.
+
+    Only bases 0-3 (ACGT) can be packed, callers must check for N.
+    """
+    cdef int n_bytes = (kmers.shape[1] + 3) // 4
+    cdef npc.uint8_t[:, :] packed = np.zeros((kmers.shape[0], n_bytes), dtype=np.uint8)
+    cdef int i, j
+    for i in range(kmers.shape[0]):
+        for j in range(kmers.shape[1]):
+            packed[i, j >> 2] |= kmers[i, j] << (2 * (j & 3))
+    return packed
+
+
+cdef npc.uint8_t[:, :] unpack_kmers(const npc.uint8_t[:, :] packed, int k):
+    """Return the (n, k) k-mers packed by `pack_kmers`."""
+    cdef npc.uint8_t[:, :] kmers = np.ndarray((packed.shape[0], k), dtype=np.uint8)
+    cdef int i, j
+    for i in range(packed.shape[0]):
+        for j in range(k):
+            kmers[i, j] = (packed[i, j >> 2] >> (2 * (j & 3))) & 3
+    return kmers
+
+
+cdef extern from *:
+    int popcountll "__builtin_popcountll" (unsigned long long x) nogil
+
+cdef npc.uint64_t LOW_BITS = 0x5555555555555555  # low bit of every 2-bit base
+
+
+cdef bytes pack_seq(const npc.uint8_t[:] seq):
+    """Return seq packed as by `pack_kmers` followed by its N-mask.
+
+    N (any code above 3) is packed as A and listed in the mask as uint32
+    (start, end) runs, so a seq without N costs two bits per base.
+    """
+    cdef long n = seq.shape[0]
+    cdef npc.uint8_t[:] packed = np.zeros(((n + 3) // 4,), dtype=np.uint8)
+    cdef list runs = []
+    cdef long j
+    cdef long run_start = -1
+    for j in range(n):
+        if seq[j] > 3:
+            if run_start < 0:
+                run_start = j
+            continue
+        if run_start >= 0:
+            runs += [run_start, j]
+            run_start = -1
+        packed[j >> 2] |= seq[j] << (2 * (j & 3))
+    if run_start >= 0:
+        runs += [run_start, n]
+    return np.asarray(packed).tobytes() + np.array(runs, dtype=np.uint32).tobytes()
+
+
+cdef npc.uint8_t[:] unpack_seq(const npc.uint8_t[:] blob, long n):
+    """Return the n bases packed by `pack_seq`."""
+    cdef npc.uint8_t[:] seq = np.ndarray((n,), dtype=np.uint8)
+    cdef long j, r
+    for j in range(n):
+        seq[j] = (blob[j >> 2] >> (2 * (j & 3))) & 3
+    cdef long n_bytes = (n + 3) // 4
+    if blob.shape[0] == n_bytes:
+        return seq
+    cdef const npc.uint32_t[:] runs = np.frombuffer(
+        np.asarray(blob[n_bytes:]).tobytes(), dtype=np.uint32
+    )
+    for r in range(0, runs.shape[0], 2):
+        for j in range(runs[r], runs[r + 1]):
+            seq[j] = 4
+    return seq
+
+
+cdef bytes pack_contig(const npc.uint8_t[:] seq):
+    """Return seq packed by `pack_seq` after its length, for seqs of any length."""
+    return np.array([seq.shape[0]], dtype=np.uint64).tobytes() + pack_seq(seq)
+
+
+cdef npc.uint8_t[:] unpack_contig(const npc.uint8_t[:] blob):
+    """Return the seq packed by `pack_contig`."""
+    cdef long n = np.frombuffer(np.asarray(blob[:8]).tobytes(), dtype=np.uint64)[0]
+    return unpack_seq(blob[8:], n)
+
+
+cdef bytes encode_kmer_blob(const npc.uint8_t[:] binary_kmer, bint packed):
+    """Return the blob a k-mer is stored as, packed by `pack_seq` or one byte per base."""
+    if packed:
+        return pack_seq(binary_kmer)
+    return np.array(binary_kmer, dtype=np.uint8).tobytes()
+
+
+cdef npc.uint8_t[:] decode_kmer_blob(const npc.uint8_t[:] blob, int k, bint packed):
+    """Return the k-mer stored as blob by `encode_kmer_blob`."""
+    if packed:
+        return unpack_seq(blob, k)
+    return np.array(blob, dtype=np.uint8)
+
+
+cdef bytes encode_contig_blob(const npc.uint8_t[:] contig, bint packed):
+    """Return the blob a seq of any length is stored as."""
+    if packed:
+        return pack_contig(contig)
+    return np.array(contig, dtype=np.uint8).tobytes()
+
+
+cdef npc.uint8_t[:] decode_contig_blob(const npc.uint8_t[:] blob, bint packed):
+    """Return the seq stored as blob by `encode_contig_blob`."""
+    if packed:
+        return unpack_contig(blob)
+    return np.array(blob, dtype=np.uint8)
+
+
+cdef int hamming_packed(const npc.uint8_t[:] p1, const npc.uint8_t[:] p2, int n_bytes) noexcept nogil:
+    """Return the number of mismatched bases in the first n_bytes of two rows of `pack_kmers`.
+
+    Compares eight bytes (32 bases) at a time with a popcount. Rows hold
+    no N, so seqs with an N must be compared with `hamming_dist`.
+    """
+    cdef npc.uint64_t w1, w2, x
+    cdef int i, j
+    cdef int score = 0
+    for i in range(0, n_bytes, 8):
+        w1, w2 = 0, 0
+        for j in range(i, min(i + 8, n_bytes)):
+            w1 |= (<npc.uint64_t> p1[j]) << (8 * (j - i))
+            w2 |= (<npc.uint64_t> p2[j]) << (8 * (j - i))
+        x = w1 ^ w2
+        score += popcountll((x | (x >> 1)) & LOW_BITS)
+    return score
+
+
+def py_hamming_packed(str k1, str k2):
+    cdef npc.uint8_t[:, :] packed = pack_kmers(np.array([np.asarray(encode_kmer(k1)), np.asarray(encode_kmer(k2))]))
+    return hamming_packed(packed[0], packed[1], packed.shape[1])
+
+
+def py_pack_seq(str seq):
+    return pack_seq(encode_kmer(seq))
+
+
+def py_unpack_seq(bytes blob, long n):
+    return decode_kmer(unpack_seq(blob, n))
+
+
+def py_pack_kmers(kmers):
+    return np.asarray(pack_kmers(np.array([encode_kmer(kmer) for kmer in kmers], dtype=np.uint8)))
+
+
+def py_unpack_kmers(packed, int k):
+    cdef npc.uint8_t[:, :] kmers = unpack_kmers(packed, k)
+    return [decode_kmer(kmers[i, :]) for i in range(kmers.shape[0])]
+
+
+cdef npc.uint64_t MIX_1 = 0xbf58476d1ce4e5b9  # splitmix64 finalizer constants
+cdef npc.uint64_t MIX_2 = 0x94d049bb133111eb
+
+
+cdef inline npc.uint64_t mix_hash(npc.uint64_t x) noexcept nogil:
+    x = (x ^ (x >> 30)) * MIX_1
+    x = (x ^ (x >> 27)) * MIX_2
+    return x ^ (x >> 31)
+
+
+cdef npc.int64_t[:] minimizer_starts(const npc.uint8_t[:] seq, int k, int w):
+    """Return the start of the (w, k) minimizer of each window, in order, without repeats.
+
+    Every w consecutive k-mers of seq select the one with the smallest hash,
+    the leftmost on ties. A k-mer and its reverse complement hash the same
+    (the smaller of the last 32 bases and the reverse complement of the
+    first 32 bases, as 2-bit codes), so a seq and its reverse complement
+    select mirrored k-mers. K-mers with an N hash highest and are only
+    selected from windows of them. Seqs with fewer than w k-mers have one
+    window.
+    """
+    cdef long n_kmers = seq.shape[0] - k + 1
+    if n_kmers <= 0:
+        return np.ndarray((0,), dtype=np.int64)
+    w = max(1, min(w, n_kmers))
+    cdef npc.uint64_t[:] hashes = np.ndarray((n_kmers,), dtype=np.uint64)
+    cdef npc.uint64_t[:] rev_codes = np.ndarray((seq.shape[0],), dtype=np.uint64)
+    cdef npc.int64_t[:] window = np.ndarray((n_kmers,), dtype=np.int64)  # deque of kmer indices
+    cdef npc.int64_t[:] starts = np.ndarray((n_kmers,), dtype=np.int64)
+    cdef int span = min(k, 32)  # bases hashed on each strand
+    cdef npc.uint64_t mask = <npc.uint64_t> -1 if span == 32 else ((<npc.uint64_t> 1) << (2 * span)) - 1
+    cdef npc.uint64_t rolled = 0, rev_rolled = 0
+    cdef long i, head = 0, tail = 0, n_starts = 0, last_n = -1
+    with nogil:
+        for i in range(seq.shape[0]):
+            rolled = ((rolled << 2) | (seq[i] & 3)) & mask
+            rev_rolled = (rev_rolled >> 2) | ((<npc.uint64_t> (3 - (seq[i] & 3))) << (2 * span - 2))
+            rev_codes[i] = rev_rolled  # reverse complement of the span bases ending at i
+            if seq[i] > 3:
+                last_n = i
+            if i < k - 1:
+                continue
+            if last_n > i - k:
+                hashes[i - k + 1] = <npc.uint64_t> -1
+            else:
+                hashes[i - k + 1] = mix_hash(min(rolled, rev_codes[i - k + span]))
+        for i in range(n_kmers):
+            while tail > head and hashes[window[tail - 1]] > hashes[i]:
+                tail -= 1
+            window[tail] = i
+            tail += 1
+            if window[head] <= i - w:
+                head += 1
+            if i >= w - 1 and (n_starts == 0 or starts[n_starts - 1] != window[head]):
+                starts[n_starts] = window[head]
+                n_starts += 1
+    return starts[:n_starts]
+
+
+def py_minimizer_starts(str seq, int k, int w):
+    return np.asarray(minimizer_starts(encode_kmer(seq), k, w))
+
+
+cdef double hamming_dist(npc.uint8_t [:] k1, npc.uint8_t [:] k2, bint normalize) noexcept nogil:
     cdef double score = 0
     cdef int i
     for i in range(k1.shape[0]):
@@ -99,140 +296,227 @@ cdef double hamming_dist(npc.uint8_t [:] k1, npc.uint8_t [:] k2, bint normalize)
 
 def py_needle(kmers, normalize=False):
     out = []
+    cdef npc.int32_t[:] work = nw_workspace(max((len(kmer) for kmer in kmers), default=0))
     for i, k1 in enumerate(kmers):
         for j, k2 in enumerate(kmers):
             if i < j:
-                out.append((k1, k2, needle_dist(encode_kmer(k1), encode_kmer(k2), normalize)))
+                out.append((k1, k2, needle_fast(encode_kmer(k1), encode_kmer(k2), normalize, work)))
     return out
 
 
 def py_needle_2(kmers1, kmers2, normalize=False):
     out = []
+    kmers1, kmers2 = list(kmers1), list(kmers2)
+    cdef npc.int32_t[:] work = nw_workspace(max((len(kmer) for kmer in kmers1 + kmers2), default=0))
     for k1 in kmers1:
         for k2 in kmers2:
-            out.append((k1, k2, needle_dist(encode_kmer(k1), encode_kmer(k2), normalize)))
+            out.append((k1, k2, needle_fast(encode_kmer(k1), encode_kmer(k2), normalize, work)))
     return out
 
 
 def py_needle_3(kmers, normalize=False):
     out = []
     kmers = [encode_kmer(kmer) for kmer in kmers]
+    cdef npc.int32_t[:] work = nw_workspace(max((kmer.shape[0] for kmer in kmers), default=0))
     for i, k1 in enumerate(kmers):
         for j, k2 in enumerate(kmers):
             if i < j:
-                out.append((i, j, needle_dist(k1, k2, normalize)))
+                out.append((i, j, needle_fast(k1, k2, normalize, work)))
     return out
 
 
 def py_needle_fast(kmers, normalize=False):
     out = []
-    cdef double[:, :] score = np.zeros((len(kmers[0]) + 1, len(kmers[0]) + 1))
+    cdef npc.int32_t[:] work = nw_workspace(max(len(kmer) for kmer in kmers))
     for i, k1 in enumerate(kmers):
         for j, k2 in enumerate(kmers):
             if i < j:
                 out.append((k1, k2, needle_fast(
-                    encode_kmer(k1), encode_kmer(k2), normalize, score
+                    encode_kmer(k1), encode_kmer(k2), normalize, work
                 )))
     return out
 
 
+cdef int NW_INF = 1 << 28  # score of cells outside the band, far from overflowing
+
+
+cdef npc.int32_t[:] nw_workspace(int band):
+    """Return a workspace for `banded_nw` on diagonals up to band from the main one."""
+    return np.ndarray((2 * (2 * band + 2),), dtype=np.int32)
+
+
+cdef int banded_nw(const npc.uint8_t[:] k1, const npc.uint8_t[:] k2, int band, int bound,
+                   npc.int32_t[:] work) noexcept nogil:
+    """Return the unit cost NW distance of k1 and k2 on diagonals up to band from the main one.
+
+    Only two rows of the band are kept, as int32 in work. The distance is
+    exact if it is at most band. Returns early, with a value above bound,
+    once every cell of a row is above bound. Each row is filled in two
+    passes, matches and deletions then insertions, so the first pass has
+    no loop carried dependency and can be vectorized.
+    """
+    cdef int m = k1.shape[0]
+    cdef int n = k2.shape[0]
+    if abs(m - n) > band:
+        return abs(m - n)
+    cdef int width = 2 * band + 1  # cell o of row i is column j = i + o - band
+    cdef npc.int32_t* prev = &work[0]
+    cdef npc.int32_t* cur = &work[width + 1]
+    cdef npc.int32_t* swap
+    cdef int i, o, o_first, o_lo, o_hi, row_min
+    cdef npc.uint8_t base
+    for o in range(width + 1):  # row 0, and a guard cell past the end of each row
+        prev[o] = o - band if 0 <= o - band <= n else NW_INF
+        cur[o] = NW_INF
+    for i in range(1, m + 1):
+        o_first = max(0, band - i)
+        o_lo = o_first
+        o_hi = min(width - 1, n - i + band)
+        for o in range(width):
+            cur[o] = NW_INF
+        if o_lo == band - i:  # column 0
+            cur[o_lo] = i
+            o_lo += 1
+        base = k1[i - 1]
+        for o in range(o_lo, o_hi + 1):
+            cur[o] = min(prev[o] + (base != k2[i + o - band - 1]), prev[o + 1] + 1)
+        row_min = cur[o_first]
+        for o in range(o_first + 1, o_hi + 1):
+            cur[o] = min(cur[o], cur[o - 1] + 1)
+            row_min = min(row_min, cur[o])
+        if row_min > bound:
+            return row_min
+        swap = prev
+        prev = cur
+        cur = swap
+    return prev[n - m + band]
+
+
 cdef double needle_dist(npc.uint8_t[::] k1, npc.uint8_t[::] k2, bint normalize):
-    """Return the NW alignment distance."""
-    cdef double[:, :] score = np.zeros((k1.shape[0] + 1, k2.shape[0] + 1))
-    return needle_fast(k1, k2, normalize, score)
+    """Return the NW alignment distance, use `needle_fast` to reuse a workspace across calls."""
+    return needle_fast(k1, k2, normalize, nw_workspace(max(k1.shape[0], k2.shape[0])))
 
 
-cdef double needle_fast(npc.uint8_t[::] k1, npc.uint8_t[::] k2, bint normalize, double[:, :] score):
-    """Return NW alignment using pre-allocated RAM."""
-    cdef double match_score = 0
-    cdef double mismatch_penalty = 1
-    cdef double gap_penalty = 1
-    cdef int i, j
-    for i in range(k1.shape[0] + 1):
-        score[i][0] = gap_penalty * i
-    for j in range(k2.shape[0] + 1):
-        score[0][j] = gap_penalty * j
-
-    for i in range(1, k1.shape[0] + 1):
-        for j in range(1, k2.shape[0] + 1):
-            if k1[i - 1] == k2[j - 1]:
-                match = score[i - 1][j - 1]
-            else:
-                match = score[i - 1][j - 1] + mismatch_penalty
-            delete = score[i - 1][j] + gap_penalty
-            insert = score[i][j - 1] + gap_penalty
-            score[i][j] = min(match, delete, insert)
-    final_score = score[k1.shape[0]][k2.shape[0]]
+cdef double needle_fast(npc.uint8_t[::] k1, npc.uint8_t[::] k2, bint normalize, npc.int32_t[:] work) noexcept nogil:
+    """Return NW alignment using a workspace from `nw_workspace` for the longer seq."""
+    cdef int band = max(k1.shape[0], k2.shape[0])
+    cdef double final_score = banded_nw(k1, k2, band, band, work)
     if normalize:
         final_score /= k1.shape[0]
     return final_score
 
 
 def py_bounded_needle_fast(str seq1, str seq2, int bound, normalize=False):
-    cdef double[:, :] score =  1000 * np.ones((len(seq1) + 1, len(seq2) + 1))
-    return bounded_needle_fast(encode_kmer(seq1), encode_kmer(seq2), bound, normalize, score)
+    return bounded_needle_fast(encode_kmer(seq1), encode_kmer(seq2), bound, normalize, nw_workspace(bound))
 
 
 cdef double bounded_needle(npc.uint8_t[::] k1, npc.uint8_t[::] k2, npc.uint8_t bound):
-    cdef double[:, :] score =  1000 * np.ones((k1.shape[0] + 1, k2.shape[0] + 1))
-    return bounded_needle_fast(k1, k2, bound, False, score)
-
-
-cdef double bounded_needle_fast(npc.uint8_t[::] k1, npc.uint8_t[::] k2, npc.uint8_t bound, bint normalize, double[:, :] score):
-    """Return NW alignment using pre-allocated RAM."""
-    cdef double match_score = 0
-    cdef double mismatch_penalty = 1
-    cdef double gap_penalty = 1
-    cdef int i, j, o
-    for i in range(k1.shape[0] + 1):
-        for o in range(bound + 1):
-            j = i + o
-            if j < (k1.shape[0] + 1):
-                score[i][j] = gap_penalty * o
-                score[j][i] = gap_penalty * o
-
-    for i in range(1, k1.shape[0] + 1):
-        for o in range(-bound, bound + 1):
-            j = i + o
-            if j < (k1.shape[0] + 1):
-                if k1[i - 1] == k2[j - 1]:
-                    match = score[i - 1][j - 1]
-                else:
-                    match = score[i - 1][j - 1] + mismatch_penalty
-                delete = score[i - 1][j] + gap_penalty
-                insert = score[i][j - 1] + gap_penalty
-                score[i][j] = min(match, delete, insert)
-    final_score = score[k1.shape[0]][k2.shape[0]]
+    """Return `bounded_needle_fast` with a workspace of its own, for one-off calls."""
+    return bounded_needle_fast(k1, k2, bound, False, nw_workspace(bound))
+
+
+cdef double bounded_needle_fast(npc.uint8_t[::] k1, npc.uint8_t[::] k2, npc.uint8_t bound, bint normalize, npc.int32_t[:] work) noexcept nogil:
+    """Return NW alignment, or a value above bound if it is above bound.
+
+    work is from `nw_workspace(bound)`.
+    """
+    cdef double final_score = banded_nw(k1, k2, bound, bound, work)
     if normalize:
         final_score /= k1.shape[0]
     return final_score
 
-cdef double water(npc.uint8_t[::] target, npc.uint8_t[::] query, npc.uint8_t bound):
-    cdef double[:, :] score = np.zeros((target.shape[0], query.shape[0]))
-    cdef double match_score = -1
-    cdef double mismatch_penalty = 1
-    cdef double gap_penalty = 1
-    cdef int i, j, o
-    for i in range(target.shape[0] + 1):
-        for o in range(bound + 1):
-            j = i + o
-            if j < (target.shape[0] + 1):
-                score[i][j] = 0
-                score[j][i] = 0
-
-    min_score = 1000
-    for i in range(1, target.shape[0] + 1):
-        for o in range(-bound, bound + 1):
-            j = i + o
-            if j < (target.shape[0] + 1):
-                if target[i - 1] == query[j - 1]:
-                    match = score[i - 1][j - 1]
-                else:
-                    match = score[i - 1][j - 1] + mismatch_penalty
-                delete = score[i - 1][j] + gap_penalty
-                insert = score[i][j - 1] + gap_penalty
-                score[i][j] = min(match, delete, insert, 0)
-                if score[i][j] < min_score:
-                    min_score = score[i][j]
-
-    return min_score + query.shape[0]
+
+cdef int MYERS_ALPHABET = 5  # A, C, G, T and N
+cdef int MYERS_ROWS = MYERS_ALPHABET + 2  # match vectors, then the Pv and Mv columns
+
+
+cdef npc.uint64_t[:] myers_workspace(int m):
+    """Return a workspace for `myers_prepare` and `myers_dist` on queries of length m."""
+    return np.zeros((MYERS_ROWS * ((m + 63) // 64),), dtype=np.uint64)
+
+
+cdef void myers_prepare(const npc.uint8_t[:] query, npc.uint64_t[:] work) noexcept nogil:
+    """Write the match vectors of query, one bit per base and 64 bases per word, to work."""
+    cdef int n_words = (query.shape[0] + 63) // 64
+    cdef int i
+    for i in range(MYERS_ALPHABET * n_words):
+        work[i] = 0
+    for i in range(query.shape[0]):
+        work[min(query[i], 4) * n_words + (i >> 6)] |= (<npc.uint64_t> 1) << (i & 63)
+
+
+cdef int myers_dist(npc.uint64_t[:] work, int m, const npc.uint8_t[:] target, int bound) noexcept nogil:
+    """Return the edit distance between the length m query prepared in work and target.
+
+    Uses Myers' bit-vector algorithm, blocked as in Hyyrö for m > 64, so
+    each base of target costs one pass over ceil(m / 64) words. Stops early,
+    returning a value above bound, once the distance must be above bound.
+    """
+    cdef int n = target.shape[0]
+    if abs(m - n) > bound or m == 0:
+        return abs(m - n)
+    cdef int n_words = (m + 63) // 64
+    cdef npc.uint64_t* peq = &work[0]
+    cdef npc.uint64_t* pv = &work[MYERS_ALPHABET * n_words]
+    cdef npc.uint64_t* mv = &work[(MYERS_ALPHABET + 1) * n_words]
+    cdef npc.uint64_t last_bit = (<npc.uint64_t> 1) << ((m - 1) & 63)
+    cdef npc.uint64_t high, eq, xv, xh, ph, mh, hin_neg
+    cdef int b, j, c, hin, hout
+    cdef int score = m
+    for b in range(n_words):
+        pv[b] = ~(<npc.uint64_t> 0)
+        mv[b] = 0
+    for j in range(n):
+        c = min(target[j], 4)
+        hin = 1  # the first row of a global alignment grows by one per column
+        for b in range(n_words):
+            high = last_bit if b == n_words - 1 else (<npc.uint64_t> 1) << 63
+            eq = peq[c * n_words + b]
+            hin_neg = 1 if hin < 0 else 0
+            xv = eq | mv[b]
+            eq |= hin_neg
+            xh = (((eq & pv[b]) + pv[b]) ^ pv[b]) | eq
+            ph = mv[b] | ~(xh | pv[b])
+            mh = pv[b] & xh
+            hout = 0
+            if ph & high:
+                hout = 1
+            elif mh & high:
+                hout = -1
+            ph = (ph << 1) | (1 if hin > 0 else 0)
+            mh = (mh << 1) | hin_neg
+            pv[b] = mh | ~(xv | ph)
+            mv[b] = ph & xv
+            hin = hout
+        score += hin
+        if score - (n - j - 1) > bound:
+            return score - (n - j - 1)
+    return score
+
+
+cdef int bounded_edit_dist(const npc.uint8_t[:] k1, const npc.uint8_t[:] k2, int bound, npc.uint64_t[:] work) noexcept nogil:
+    """Return the edit distance of k1 and k2, or a value above bound if it is above bound."""
+    myers_prepare(k1, work)
+    return myers_dist(work, k1.shape[0], k2, bound)
+
+
+cdef void bounded_edit_dists(const npc.uint8_t[:] query, const npc.uint8_t[:, :] targets, int bound,
+                             npc.uint64_t[:] work, npc.int32_t[:] out) noexcept nogil:
+    """Set out[i] to `bounded_edit_dist` of query and row i of targets, preparing query once."""
+    myers_prepare(query, work)
+    cdef int i
+    for i in range(targets.shape[0]):
+        out[i] = myers_dist(work, query.shape[0], targets[i, :], bound)
+
+
+def py_bounded_edit_dist(str seq1, str seq2, int bound):
+    return bounded_edit_dist(encode_kmer(seq1), encode_kmer(seq2), bound, myers_workspace(len(seq1)))
+
+
+def py_bounded_edit_dists(str query, targets, int bound):
+    cdef npc.int32_t[:] out = np.ndarray((len(targets),), dtype=np.int32)
+    bounded_edit_dists(
+        encode_kmer(query), np.array([encode_kmer(target) for target in targets], dtype=np.uint8),
+        bound, myers_workspace(len(query)), out
+    )
+    return np.asarray(out)
@@ -0,0 +1,13 @@
+# cython: language_level=3
+
+
+cdef class LRUCache:
+    cdef public object entries
+    cdef public set pinned
+    cdef public long max_bytes, n_bytes
+    cdef public long hits, misses, evictions
+
+    cpdef get(self, key, default=?)
+    cpdef put(self, key, value, long nbytes)
+    cpdef discard(self, key)
+    cdef _evict(self)
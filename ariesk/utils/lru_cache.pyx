@@ -0,0 +1,88 @@
+# cython: language_level=3
+
+from collections import OrderedDict
+
+DEFAULT_CACHE_BYTES = 2 ** 30
+
+
+cdef class LRUCache:
+    """Map keys to values, holding at most max_bytes of values.
+
+    The size of each value is given when it is added. Once over budget
+    the least recently used entries are dropped, pinned entries are kept
+    until they are unpinned. A max_bytes of 0 or less means no limit.
+    """
+
+    def __cinit__(self, long max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.entries = OrderedDict()
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    cpdef get(self, key, default=None):
+        """Return the value for key and mark it recently used, or default."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    cpdef put(self, key, value, long nbytes):
+        """Add value, taking nbytes of the budget, and evict to stay in budget."""
+        self.discard(key)
+        if 0 < self.max_bytes < nbytes and key not in self.pinned:
+            return  # would evict everything else and then itself
+        self.entries[key] = (value, nbytes)
+        self.n_bytes += nbytes
+        self._evict()
+
+    cpdef discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.n_bytes -= entry[1]
+
+    cdef _evict(self):
+        if self.max_bytes <= 0:
+            return
+        cdef int n_pinned_seen = 0
+        while self.n_bytes > self.max_bytes and n_pinned_seen < len(self.entries):
+            key = next(iter(self.entries))
+            if key in self.pinned:
+                self.entries.move_to_end(key)
+                n_pinned_seen += 1
+            else:
+                self.discard(key)
+                self.evictions += 1
+
+    def pin(self, key):
+        """Keep key in the cache, once added, until it is unpinned."""
+        self.pinned.add(key)
+
+    def unpin(self, key):
+        self.pinned.discard(key)
+        self._evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.n_bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.n_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
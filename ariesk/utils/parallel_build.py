@@ -1,67 +1,177 @@
 # cython: profile=True
 # cython: language_level=3
 
-import subprocess as sp
-from os import remove, environ
-from os.path import basename
-from time import sleep
+import sqlite3
+import numpy as np
+from multiprocessing import Pool, RawArray
+from os import remove
+from os.path import dirname, abspath, getsize, isfile, join
+from shutil import copyfile
+from tempfile import TemporaryDirectory
+
+from ariesk.dbs.contig_db import ContigDB
+from ariesk.dbs.kmer_db import GridCoverDB
+from ariesk.grid_builder import GridCoverBuilder
+from ariesk.ram import RotatingRamifier
 
-ARIESK_EXC = environ.get('ARIESK_EXC', 'ariesk')
 HUNDREDK = 100 * 1000
 
+_worker_ramifier = None  # set in each grid build worker by `init_grid_worker`
+
+
+def share_ramifier(ramifier):
+    """Return the stacked rotation of ramifier copied into shared memory."""
+    stacked = ramifier.to_array()
+    shared_rotation = RawArray('d', stacked.size)
+    np.frombuffer(shared_rotation).reshape(stacked.shape)[:] = stacked
+    return shared_rotation, stacked.shape
+
+
+def init_grid_worker(shared_rotation, shape, dimension):
+    global _worker_ramifier
+    _worker_ramifier = RotatingRamifier.from_array(
+        dimension, np.frombuffer(shared_rotation).reshape(shape)
+    )
+
+
+def split_lines(filename, start, num_to_add, chunk_size):
+    """Return [start_byte, end_byte) ranges of roughly chunk_size lines each.
+
+    Ranges cover lines start to start + num_to_add (or the end of the
+    file if num_to_add is 0). They need not fall on line boundaries,
+    see `GridCoverBuilder.fast_add_kmers_from_file`.
+    """
+    with open(filename, 'rb') as f:
+        for _ in range(start):
+            f.readline()
+        lo = f.tell()
+        for _ in range(num_to_add):
+            f.readline()
+        hi = f.tell() if num_to_add > 0 else getsize(filename)
+        f.seek(lo)
+        chunk_bytes = chunk_size * max(len(f.readline()), 1)
+    return [(el, min(el + chunk_bytes, hi)) for el in range(lo, hi, chunk_bytes)]
+
 
-def run_command(args):
-    cmd, temp_filename = args
-    sp.run(cmd, shell=True, check=True)
-    return temp_filename
+def build_grid_shard(args):
+    """Build one GridCoverDB from a byte range of a k-mer table. Run in a worker process."""
+    shard_filename, kmer_table, start_byte, end_byte, radius = args
+    shard = GridCoverDB(
+        sqlite3.connect(shard_filename), ramifier=_worker_ramifier, box_side_len=radius
+    )
+    shard._drop_indices()  # shards are only read back in full
+    grid = GridCoverBuilder(shard)
+    n_added = grid.fast_add_kmers_from_file(
+        kmer_table, start_byte=start_byte, end_byte=end_byte
+    )
+    grid.close()
+    return shard_filename, n_added
 
 
 def coordinate_parallel_build(output_filename, kmer_table, rotation,
-    threads, start, num_to_add, radius, dimension,
-    chunk_size=HUNDREDK, logger=lambda x, y: None):
-    cmds = []
-    n_chunks = num_to_add // chunk_size
-    for chunk_num in range(n_chunks):
-        chunk_start = start + (chunk_num * chunk_size)
-        temp_filename = f'temp.ariesk_temp_chunk.{chunk_num}.{basename(kmer_table)}.sqlite'
-        cmd = (
-            f'{ARIESK_EXC} build-grid '
-            f'-r {radius} '
-            f'-d {dimension} '
-            f'-n {chunk_size} '
-            f'-s {chunk_start} '
-            f'-o {temp_filename} '
-            f'--preload '
-            f'{rotation} {kmer_table}'
+                              threads, start, num_to_add, radius, dimension,
+                              chunk_size=HUNDREDK, logger=lambda x, y: None):
+    """Build a GridCoverDB from a k-mer table on `threads` processes.
+
+    The table is split into byte ranges of about chunk_size lines that
+    workers build into shards. Shards are merged into the output in file
+    order, as soon as each is done, so merging overlaps with building and
+    centroid ids match a serial build. Returns the number of k-mers added.
+    """
+    ramifier = RotatingRamifier.from_file(dimension, rotation)
+    if isfile(output_filename):
+        main_db = GridCoverDB.load_from_filepath(output_filename)
+    else:
+        main_db = GridCoverDB(
+            sqlite3.connect(output_filename), ramifier=ramifier, box_side_len=radius
         )
-        cmds.append((temp_filename, cmd))
-
-    n_running = 0
-    processes = []
-    polled = set()
-    while len(cmds) > 0:
-        if n_running < threads:
-            temp_filename, cmd = cmds.pop()
-            process = sp.Popen(cmd, shell=True)
-            processes.append((temp_filename, process))
-            n_running += 1
-        else:
-            for i, (temp_filename, process) in enumerate(processes):
-                if (process.poll() is not None) and (temp_filename not in polled):
-                    polled.add(temp_filename)
-                    assert process.returncode == 0
-                    logger(i, n_chunks)
-                    n_running -= 1
-        sleep(5)
-
-    for _, process in processes:
-        process.wait()
-
-    temp_filenames = [el[0] for el in processes]
-    cmd = (
-        f'{ARIESK_EXC} merge-grid '
-        f'{output_filename} '
-    ) + ' '.join(temp_filenames)
-    run_command((cmd, None))
-    for temp_filename in temp_filenames:
-        remove(temp_filename)
+    main_db._drop_indices()
+    byte_ranges = split_lines(kmer_table, start, num_to_add, chunk_size)
+    n_added = 0
+    with TemporaryDirectory(dir=dirname(abspath(output_filename))) as shard_dir:
+        shard_args = [
+            (
+                join(shard_dir, f'ariesk_grid_shard.{i}.sqlite'),
+                kmer_table, start_byte, end_byte, radius,
+            )
+            for i, (start_byte, end_byte) in enumerate(byte_ranges)
+        ]
+        init_args = share_ramifier(ramifier) + (dimension,)
+        with Pool(threads, initializer=init_grid_worker, initargs=init_args) as pool:
+            shards = pool.imap(build_grid_shard, shard_args)
+            for i, (shard_filename, n) in enumerate(shards):
+                shard = GridCoverDB.load_from_filepath(shard_filename)
+                main_db.load_other(shard, rebuild_indices=False)
+                shard.conn.close()
+                remove(shard_filename)
+                n_added += n
+                logger(i, len(shard_args))
+    main_db._build_indices()
+    main_db.save_search_tree()
+    main_db.close()
+    return n_added
+
+
+def build_contig_shard(args):
+    """Build one ContigDB from a list of fastas. Run in a worker process."""
+    (
+        shard_filename, fasta_filenames, rotation, dimension, radius,
+        minimizer_window, store_seed_indices,
+    ) = args
+    ramifier = RotatingRamifier.from_file(dimension, rotation)
+    shard = ContigDB(
+        sqlite3.connect(shard_filename), ramifier=ramifier, box_side_len=radius,
+        minimizer_window=minimizer_window, store_seed_indices=store_seed_indices
+    )
+    shard.start_bulk_load()  # shards are only read back in full so need no indices
+    n_added = 0
+    for fasta_filename in fasta_filenames:
+        n_added += shard.fast_add_kmers_from_fasta(fasta_filename)
+    shard.close()
+    return shard_filename, n_added
+
+
+def merge_contig_shards(output_filename, shard_filenames, logger=lambda x, y: None):
+    """Merge ContigDBs into output_filename, which may already exist."""
+    if not isfile(output_filename):
+        copyfile(shard_filenames[0], output_filename)
+        shard_filenames = shard_filenames[1:]
+    main_db = ContigDB.load_from_filepath(output_filename)
+    main_db.start_bulk_load()
+    for i, shard_filename in enumerate(shard_filenames):
+        shard = ContigDB.load_from_filepath(shard_filename)
+        main_db.load_other(shard, rebuild_indices=False)
+        shard.conn.close()
+        logger(i, len(shard_filenames))
+    main_db.end_bulk_load()
+    main_db.save_search_tree()
+    main_db.close()
+
+
+def coordinate_parallel_contig_build(output_filename, fasta_filenames, rotation,
+                                     threads, radius, dimension, minimizer_window=0,
+                                     store_seed_indices=False, logger=lambda x, y: None):
+    """Build a ContigDB from fastas on `threads` processes, one shard each.
+
+    Fastas are dealt to shards largest first so shards finish together.
+    Returns the number of contigs added.
+    """
+    fasta_filenames = sorted(fasta_filenames, key=getsize, reverse=True)
+    n_shards = max(1, min(threads, len(fasta_filenames)))
+    with TemporaryDirectory(dir=dirname(abspath(output_filename))) as shard_dir:
+        shard_args = [
+            (
+                join(shard_dir, f'ariesk_contig_shard.{i}.sqlite'),
+                fasta_filenames[i::n_shards],
+                rotation, dimension, radius, minimizer_window, store_seed_indices,
+            )
+            for i in range(n_shards)
+        ]
+        shard_filenames, n_added = [], 0
+        with Pool(n_shards) as pool:
+            for i, (shard_filename, n) in enumerate(pool.imap(build_contig_shard, shard_args)):
+                shard_filenames.append(shard_filename)
+                n_added += n
+                logger(i, n_shards)
+        merge_contig_shards(output_filename, shard_filenames)
+    return n_added
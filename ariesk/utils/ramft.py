@@ -38,13 +38,40 @@ def ram_sum(n, q):
 
 
 RS_BLOB_FILENAME = join(dirname(__file__), 'rs_matrix.blob')
+RS_BLOB_SIZE = 1000
+
+
+def build_rs_blob_matrix(N=RS_BLOB_SIZE):
+    """Return the N x N ram sum matrix normalized by N, from exact ramanujan sums.
+
+    c_q(n) = mu(d) phi(q) / phi(d) with d = q / gcd(q, n), so each entry
+    is mu(d) / (phi(d) N) and no complex sums are needed.
+    """
+    mu, totient = np.ones(N + 1), np.arange(N + 1)
+    is_prime = np.ones(N + 1, dtype=bool)
+    for p in range(2, N + 1):
+        if is_prime[p]:
+            is_prime[2 * p::p] = False
+            mu[p::p] *= -1
+            mu[p * p::p * p] = 0
+            totient[p::p] -= totient[p::p] // p
+    q = np.arange(1, N + 1)[:, None]
+    d = q // np.gcd(q, np.arange(1, N + 1)[None, :])
+    return mu[d] / (totient[d] * N)
+
+
+def write_rs_blob(filename=RS_BLOB_FILENAME):
+    """Write the matrix read by `build_rs_matrix` for N <= RS_BLOB_SIZE."""
+    with open(filename, 'wb') as f:
+        f.write(build_rs_blob_matrix().tobytes())
+
 
 def build_rs_matrix(N):
     """Return the ram sum matrix with normalization."""
-    if N <= 1000:
+    if N <= RS_BLOB_SIZE:
         rs = np.reshape(
             np.frombuffer(open(RS_BLOB_FILENAME, 'rb').read()),
-            (1000, 1000)
+            (RS_BLOB_SIZE, RS_BLOB_SIZE)
         )
         return np.copy(rs[:N, :N])
 
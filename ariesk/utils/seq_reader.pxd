@@ -0,0 +1,30 @@
+# cython: language_level=3
+
+cimport cython
+cimport numpy as npc
+
+
+cdef extern from "zlib.h":
+    ctypedef void * gzFile
+
+
+@cython.final
+cdef class SeqReader:
+    cdef gzFile handle
+    cdef public str filename
+    cdef public str name
+    cdef public bint is_fastq
+    cdef npc.uint8_t[:] buf
+    cdef long buf_len, buf_pos
+    cdef npc.uint8_t[:] seq_buf
+    cdef long seq_len
+    cdef bytearray name_buf
+    cdef int pending
+
+    cdef int _fill(self) except -1
+    cdef inline int _getc(self) except -2
+    cdef int _skip_blank(self) except -2
+    cdef inline int _push_base(self, npc.uint8_t code) except -1
+    cdef int next_record(self) except -1
+    cdef npc.uint8_t[:] record(self)
+    cpdef close(self)
@@ -0,0 +1,161 @@
+# cython: profile=False
+# cython: linetrace=False
+# cython: language_level=3
+# cython: boundscheck=False, wraparound=False, nonecheck=False
+
+cimport cython
+import numpy as np
+cimport numpy as npc
+
+
+cdef extern from "zlib.h":
+    gzFile gzopen(const char * path, const char * mode)
+    int gzbuffer(gzFile file, unsigned int size)
+    int gzread(gzFile file, void * buf, unsigned int length)
+    int gzclose(gzFile file)
+
+
+READ_BUFFER_SIZE = 1024 * 1024  # bytes decompressed (or read) at once
+INITIAL_SEQ_SIZE = 64 * 1024  # grown by doubling to fit the longest record
+
+cdef npc.uint8_t SKIP = 255  # line breaks and other whitespace inside a seq
+cdef npc.uint8_t BASE_CODES[256]
+cdef int _c
+for _c in range(256):
+    BASE_CODES[_c] = 4
+for _c, _code in zip(b'ACGTacgt', [0, 1, 2, 3, 0, 1, 2, 3]):
+    BASE_CODES[_c] = _code
+for _c in b'\n\r \t':
+    BASE_CODES[_c] = SKIP
+
+
+@cython.final
+cdef class SeqReader:
+    """Read the records of a fasta or fastq file, gzipped or not.
+
+    Records may span several lines. Bases are encoded as by `encode_kmer`,
+    upper or lower case, with anything else read as N. Iterating yields
+    (name, seq) where seq is a uint8 view of a buffer reused for the next
+    record, copy it to keep it.
+    """
+
+    def __cinit__(self, str filename):
+        self.filename = filename
+        self.handle = gzopen(filename.encode('UTF-8'), b'rb')
+        if self.handle == NULL:
+            raise FileNotFoundError(2, "No such file or directory: '%s'" % filename)
+        gzbuffer(self.handle, READ_BUFFER_SIZE)
+        self.buf = np.ndarray((READ_BUFFER_SIZE,), dtype=np.uint8)
+        self.buf_len, self.buf_pos = 0, 0
+        self.seq_buf = np.ndarray((INITIAL_SEQ_SIZE,), dtype=np.uint8)
+        self.seq_len = 0
+        self.name_buf = bytearray()
+        self.name = None
+        self.is_fastq = False
+        self.pending = self._skip_blank()
+        if self.pending not in (-1, ord('>'), ord('@')):
+            self.close()
+            raise ValueError(f'{filename} is not a fasta or fastq file')
+        self.is_fastq = self.pending == ord('@')
+
+    cdef int _fill(self) except -1:
+        """Refill the read buffer, return the number of bytes read."""
+        if self.handle == NULL:
+            return 0
+        cdef int n_read = gzread(self.handle, &self.buf[0], self.buf.shape[0])
+        if n_read < 0:
+            raise IOError(f'Could not read {self.filename}')
+        self.buf_len, self.buf_pos = n_read, 0
+        return n_read
+
+    cdef inline int _getc(self) except -2:
+        """Return the next byte of the file or -1 at the end."""
+        if self.buf_pos == self.buf_len and self._fill() == 0:
+            return -1
+        self.buf_pos += 1
+        return self.buf[self.buf_pos - 1]
+
+    cdef int _skip_blank(self) except -2:
+        """Return the next byte that is not a line break or -1 at the end."""
+        cdef int c = self._getc()
+        while c == b'\n' or c == b'\r':
+            c = self._getc()
+        return c
+
+    cdef inline int _push_base(self, npc.uint8_t code) except -1:
+        """Append code to the seq, doubling its buffer when full."""
+        if self.seq_len == self.seq_buf.shape[0]:
+            seq_buf = np.ndarray((2 * self.seq_buf.shape[0],), dtype=np.uint8)
+            seq_buf[:self.seq_len] = self.seq_buf
+            self.seq_buf = seq_buf
+        self.seq_buf[self.seq_len] = code
+        self.seq_len += 1
+        return 0
+
+    cdef int next_record(self) except -1:
+        """Read the next record into `name` and `record`. Return 0 at the end of the file."""
+        if self.pending == -1:
+            return 0
+        cdef int c = self._getc()
+        del self.name_buf[:]
+        while c != -1 and c != b'\n':
+            self.name_buf.append(c)
+            c = self._getc()
+        self.name = self.name_buf.decode('UTF-8', 'replace').strip()
+
+        cdef int end_of_seq = ord('+') if self.is_fastq else ord('>')
+        cdef bint line_start = True
+        cdef npc.uint8_t code
+        self.seq_len = 0
+        while True:
+            c = self._getc()
+            if c == -1 or (line_start and c == end_of_seq):
+                break
+            code = BASE_CODES[c]
+            if code == SKIP:
+                line_start = c == b'\n'
+                continue
+            line_start = False
+            self._push_base(code)
+
+        cdef long n_qual = 0
+        if self.is_fastq and c != -1:  # skip the '+' line then as many quality chars as bases
+            while c != -1 and c != b'\n':
+                c = self._getc()
+            while c != -1 and n_qual < self.seq_len:
+                c = self._getc()
+                if c != -1 and BASE_CODES[c] != SKIP:
+                    n_qual += 1
+            while c != -1 and c != b'\n':
+                c = self._getc()
+            c = self._skip_blank()
+        self.pending = c
+        return 1
+
+    cdef npc.uint8_t[:] record(self):
+        """Return the encoded seq of the last record read."""
+        return self.seq_buf[:self.seq_len]
+
+    cpdef close(self):
+        if self.handle != NULL:
+            gzclose(self.handle)
+            self.handle = NULL
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.next_record():
+            self.close()
+            raise StopIteration
+        return self.name, np.asarray(self.record())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __dealloc__(self):
+        if self.handle != NULL:
+            gzclose(self.handle)
@@ -6,6 +6,8 @@ from Cython.Build import cythonize
 import numpy
 from distutils.extension import Extension
 from glob import glob
+from importlib.util import spec_from_file_location, module_from_spec
+from os.path import isfile
 
 extra_compile_args = ['-std=c++11', "-O3", "-ffast-math", "-march=native", "-fopenmp" ]
 extra_link_args = ['-fopenmp']
@@ -21,15 +23,30 @@ def make_ext(args):
         path,
         include_dirs=[numpy.get_include()],
         extra_compile_args=extra_compile_args,
+        extra_link_args=extra_link_args,
         language=lang,
     )
 
 
+def write_rs_blob():
+    """Write the ram sum matrix blob read by `ariesk.utils.ramft` if it is missing."""
+    spec = spec_from_file_location('ramft', 'ariesk/utils/ramft.py')  # the package is not built yet
+    ramft = module_from_spec(spec)
+    spec.loader.exec_module(ramft)
+    if not isfile(ramft.RS_BLOB_FILENAME):
+        ramft.write_rs_blob()
+
+
+write_rs_blob()
+
+
 extensions = [
     make_ext(el) for el in [
         ('ariesk/utils/bloom_filter.pyx', 'ariesk.utils.bloom_filter'),
         ('ariesk/utils/kmers.pyx', 'ariesk.utils.kmers'),
         ('ariesk/utils/dists.pyx', 'ariesk.utils.dists'),
+        ('ariesk/utils/cell_table.pyx', 'ariesk.utils.cell_table'),
+        ('ariesk/utils/lru_cache.pyx', 'ariesk.utils.lru_cache'),
 
         ('ariesk/grid_builder.pyx', 'ariesk.grid_builder'),
         ('ariesk/grid_searcher.pyx', 'ariesk.grid_searcher'),
@@ -47,6 +64,15 @@ extensions = [
         ('ariesk/seed_align.pyx', 'ariesk.seed_align'),
     ]
 ] + [
+    Extension(
+        'ariesk.utils.seq_reader',
+        ['ariesk/utils/seq_reader.pyx'],
+        include_dirs=[numpy.get_include()],
+        extra_compile_args=extra_compile_args,
+        extra_link_args=extra_link_args,
+        libraries=['z'],
+        language='c++',
+    ),
     Extension(
         'ariesk.ssw',
         ['ariesk/ssw.pyx'],
@@ -78,6 +104,9 @@ setuptools.setup(
     package_dir={
         'ariesk': 'ariesk',
     },
+    package_data={
+        'ariesk.utils': ['rs_matrix.blob'],
+    },
     install_requires=[
         'click',
         'pandas',
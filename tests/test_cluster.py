@@ -48,3 +48,21 @@ class TestCluster(TestCase):
         self.assertEqual(min(dists), 0)
         self.assertLessEqual(sum(sorted(dists)[:4]), 3)
         self.assertEqual(dists.shape[0], 104)
+
+    def test_cluster_sparse_subclusters(self):
+        sub_k, k = 7, 31
+        seqs = [random_kmer(k) for _ in range(100)]
+        sphere = [seqs[0][:-1] + 'A', seqs[0][:-1] + 'C', seqs[0][:-1] + 'G', seqs[0][:-1] + 'T']
+        clust = Cluster.build_from_seqs(0, seqs + sphere, sub_k)
+        clust.build_subclusters(1)
+        assignments = np.asarray(clust.inner_assignments)
+        offsets, members = np.asarray(clust.inner_offsets), np.asarray(clust.inner_members)
+        self.assertEqual(assignments.shape[0], 104)
+        self.assertEqual(offsets.shape[0], len(clust.inner_centers) + 1)
+        self.assertEqual(members.shape[0], (assignments >= 0).sum())
+        for c, center_i in enumerate(clust.inner_centers):
+            self.assertEqual(assignments[center_i], -1)
+            self.assertEqual(
+                sorted(members[offsets[c]:offsets[c + 1]]),
+                list(np.flatnonzero(assignments == c))
+            )
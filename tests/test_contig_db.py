@@ -1,4 +1,5 @@
 
+import gzip
 import random
 import sqlite3
 import numpy as np
@@ -6,12 +7,16 @@ import numpy as np
 from json import loads
 from os import remove
 from os.path import join, dirname
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 
 from ariesk.dbs.contig_db import ContigDB
 from ariesk.dbs.pre_contig_db import PreContigDB
 from ariesk.contig_searcher import ContigSearcher
 from ariesk.ram import RotatingRamifier
+from ariesk.ssw import StripedSmithWaterman
+from ariesk.utils.kmers import py_encode_kmer
+from ariesk.utils.parallel_build import coordinate_parallel_contig_build
 
 KMER_TABLE = join(dirname(__file__), 'small_31mer_table.csv')
 KMER_ROTATION = join(dirname(__file__), '../data/rotation_minikraken.json')
@@ -35,6 +40,37 @@ class TestContigDB(TestCase):
         stored = contig_db.get_all_contigs()
         self.assertGreaterEqual(len(stored), 2)
 
+    def test_bulk_build_contig_db(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        contigs = [random_kmer(2 * 1000) for _ in range(3)]
+        plain_db = ContigDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
+        bulk_db = ContigDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
+        bulk_db.start_bulk_load()
+        for i, contig in enumerate(contigs):
+            plain_db.py_add_contig(f'test_genome___test_contig_{i}', contig, gap=10)
+            bulk_db.py_add_contig(f'test_genome___test_contig_{i}', contig, gap=10)
+        bulk_db.end_bulk_load()
+        plain_db.commit()
+        self.assertEqual(bulk_db.get_all_contigs(), plain_db.get_all_contigs())
+        self.assertEqual(bulk_db.py_get_seq('test_genome___test_contig_1', 0, 2000), contigs[1])
+        indices = bulk_db.conn.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        self.assertIn('IX_contigs_centroid', [el[0] for el in indices])
+
+    def test_bulk_load_restores_pragmas(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        with TemporaryDirectory() as tmpdir:
+            conn = sqlite3.connect(join(tmpdir, 'contigs.sqlite'))
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            contig_db = ContigDB(conn, ramifier=ramifier, box_side_len=0.5)
+            contig_db.start_bulk_load()
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'memory')
+            contig_db.py_add_contig('test_genome___test_contig', random_kmer(2000), gap=10)
+            contig_db.end_bulk_load()
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+            contig_db.close()
+
     def test_build_merge_contig_db(self):
         conn_1 = sqlite3.connect(':memory:')
         ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
@@ -55,6 +91,36 @@ class TestContigDB(TestCase):
 
         self.assertEqual(len(contig_db_1.get_all_contigs()), n_stored)
 
+    def test_merge_contig_db_files(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        with TemporaryDirectory() as tmpdir:
+            dbs, contigs = [], []
+            for i in range(2):
+                contig_db = ContigDB(
+                    sqlite3.connect(join(tmpdir, f'contigs_{i}.sqlite')),
+                    ramifier=ramifier, box_side_len=0.5
+                )
+                contigs.append(random_kmer(2 * 10 * 1000))
+                contig_db.py_add_contig(f'test_genome___test_contig_{i}', contigs[i], gap=100)
+                contig_db.commit()
+                dbs.append(contig_db)
+            other_centroids = dbs[1].centroids()
+            expected = sorted(
+                (name, tuple(other_centroids[cid]), start, end)
+                for name, cid, start, end in dbs[1].get_all_contigs()
+            )
+            dbs[0].load_other(dbs[1])
+            centroids = dbs[0].centroids()
+            merged = sorted(
+                (name, tuple(centroids[cid]), start, end)
+                for name, cid, start, end in dbs[0].get_all_contigs()
+                if name == 'test_genome___test_contig_1'
+            )
+            self.assertEqual(merged, expected)
+            self.assertEqual(dbs[0].py_get_seq('test_genome___test_contig_1', 0, 2000), contigs[1][:2000])
+            for contig_db in dbs:
+                contig_db.close()
+
     def test_fileio_contig_db(self):
         fname = 'temp.test_contig_db.sqlite'
         try:
@@ -84,6 +150,43 @@ class TestContigDB(TestCase):
         stored = contig_db.get_all_contigs()
         self.assertGreaterEqual(len(stored), 3)
 
+    def test_build_contig_db_from_gzipped_fasta(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        plain_db = ContigDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
+        plain_db.fast_add_kmers_from_fasta(KMER_FASTA)
+        plain_db.commit()
+        with TemporaryDirectory() as tmpdir:
+            gz_filename = join(tmpdir, 'small_fasta.fa.gz')
+            with open(KMER_FASTA, 'rb') as f, gzip.open(gz_filename, 'wb') as gz:
+                gz.write(f.read())
+            gz_db = ContigDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
+            gz_db.fast_add_kmers_from_fasta(gz_filename)
+            gz_db.commit()
+        self.assertEqual(
+            [row[1:] for row in gz_db.get_all_contigs()],
+            [row[1:] for row in plain_db.get_all_contigs()]
+        )
+
+    def test_parallel_build_contig_db(self):
+        with TemporaryDirectory() as tmpdir:
+            fname = join(tmpdir, 'parallel.sqlite')
+            n_added = coordinate_parallel_contig_build(
+                fname, [KMER_FASTA, KMER_FASTA], KMER_ROTATION, 2, 0.5, 4
+            )
+            contig_db = ContigDB.load_from_filepath(fname)
+            serial_db = ContigDB(
+                sqlite3.connect(':memory:'),
+                ramifier=RotatingRamifier.from_file(4, KMER_ROTATION),
+                box_side_len=0.5
+            )
+            n_serial = serial_db.fast_add_kmers_from_fasta(KMER_FASTA)
+            n_serial += serial_db.fast_add_kmers_from_fasta(KMER_FASTA)
+            serial_db.commit()
+            self.assertEqual(n_added, n_serial)
+            self.assertEqual(len(contig_db.get_all_contigs()), len(serial_db.get_all_contigs()))
+            self.assertEqual(len(contig_db.centroid_cache), len(serial_db.centroid_cache))
+            contig_db.close()
+
 
     def test_search_contig_db(self):
         conn = sqlite3.connect(':memory:')
@@ -109,6 +212,62 @@ class TestContigDB(TestCase):
         hits = searcher.py_search(contig[500:1500], 0.000001, 1)
         self.assertGreaterEqual(len(hits), 1)
 
+    def test_search_contig_db_minimizers(self):
+        conn = sqlite3.connect(':memory:')
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        contig_db = ContigDB(conn, ramifier=ramifier, box_side_len=0.5, minimizer_window=10)
+        contig = random_kmer(2 * 10 * 1000)
+        contig_db.py_add_contig('test_genome___test_contig', contig)
+        contig_db.commit()
+        n_kmers = len(contig) - 31 + 1
+        self.assertLess(len(contig_db.py_kmer_starts(contig)), n_kmers / 4)
+        self.assertEqual(ContigDB(conn).minimizer_window, 10)
+        searcher = ContigSearcher(contig_db)
+        hits = searcher.py_search(contig[500:1500], 0.000001, 1)
+        self.assertGreaterEqual(len(hits), 1)
+
+    def test_search_stored_tree(self):
+        conn = sqlite3.connect(':memory:')
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        contig_db = ContigDB(conn, ramifier=ramifier, box_side_len=0.5)
+        contig = random_kmer(2 * 10 * 1000)
+        contig_db.py_add_contig('test_genome___test_contig', contig, gap=10)
+        contig_db.save_search_tree()
+        searcher = ContigSearcher(ContigDB(conn))
+        expected = np.asarray(contig_db.centroids()) * 0.5 + 0.25
+        self.assertTrue((np.asarray(searcher.centroid_rfts) == expected).all())
+        hits = searcher.py_search(contig[500:1500], 0.000001, 1)
+        self.assertGreaterEqual(len(hits), 1)
+
+    def test_parallel_search_contigs_from_fasta(self):
+        random.seed(0)
+        with TemporaryDirectory() as tmpdir:
+            contig_db = ContigDB(
+                sqlite3.connect(join(tmpdir, 'contigs.sqlite')),
+                ramifier=RotatingRamifier.from_file(4, KMER_ROTATION),
+                box_side_len=0.5
+            )
+            contig = random_kmer(2 * 10 * 1000)
+            contig_db.py_add_contig('test_genome___test_contig', contig, gap=10)
+            contig_db.save_search_tree()
+            query_filename = join(tmpdir, 'queries.fa')
+            with open(query_filename, 'w') as f:
+                for i in range(5):
+                    f.write(f'>query_{i}\n{contig[1000 * i:1000 * i + 500]}\n')
+            searcher = ContigSearcher(contig_db)
+            serial = searcher.search_contigs_from_fasta(query_filename, 0.000001, 1, 50)
+            parallel = searcher.search_contigs_from_fasta(query_filename, 0.000001, 1, 50, threads=2)
+            self.assertEqual(list(parallel), [f'query_{i}' for i in range(5)])
+            self.assertEqual(
+                {name: [hit[:6] for hit in hits] for name, hits in parallel.items()},
+                {name: [hit[:6] for hit in hits] for name, hits in serial.items()},
+            )
+            self.assertGreaterEqual(len(parallel['query_0']), 1)
+            for hits in (serial['query_0'], parallel['query_0']):
+                self.assertIsInstance(hits[0][6], np.ndarray)
+                self.assertIsInstance(hits[0][7], np.ndarray)
+            contig_db.close()
+
     def test_search_bigger_contig_db_exact(self):
         contig_db = ContigDB(
             sqlite3.connect(':memory:'),
@@ -125,3 +284,14 @@ class TestContigDB(TestCase):
         searcher = ContigSearcher(contig_db)
         hits = searcher.py_search(contigs[0][500:600], 0, 1)
         self.assertEqual(len(hits), 1)
+
+    def test_ssw_align_many(self):
+        query = random_kmer(100)
+        targets = [query[10:90], random_kmer(80), query[:50] + random_kmer(30)]
+        aligner = StripedSmithWaterman(py_encode_kmer(query))
+        scores = aligner.py_align_many([py_encode_kmer(el) for el in targets])
+        self.assertEqual(scores.shape, (3,))
+        self.assertEqual(scores[0], 2 * 80)
+        for target, score in zip(targets, scores):
+            fresh = StripedSmithWaterman(py_encode_kmer(query))
+            self.assertEqual(fresh.py_align(py_encode_kmer(target)), score)
@@ -2,6 +2,7 @@
 import sqlite3
 
 from os.path import join, dirname
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 
 from ariesk.ram import RotatingRamifier
@@ -68,15 +69,46 @@ class TestBuildGridCover(TestCase):
         self.assertLess(n_centers, 98)
         self.assertEqual(n_points, 98)
 
-    ''' Test is slow, not really that useful
     def test_build_parallel(self):
-        out_name = 'temp.test_parallel_build.sqlite'
-        coordinate_parallel_build(out_name, KMER_TABLE, KMER_ROTATION, 2, 0, 100, 0.5, 8, chunk_size=25)
-        db = GridCoverDB.load_from_filepath(out_name)
-        n_centers = db.centroids().shape[0]
-        n_points = len(db.get_kmers())
-        self.assertGreater(n_centers, 0)
-        self.assertLess(n_centers, 100)
-        self.assertEqual(n_points, 100)
-        os.remove(out_name)
-    '''
+        with TemporaryDirectory() as tmpdir:
+            out_name = join(tmpdir, 'parallel.sqlite')
+            n_added = coordinate_parallel_build(
+                out_name, KMER_TABLE, KMER_ROTATION, 2, 0, 0, 0.5, 8, chunk_size=25
+            )
+            db = GridCoverDB.load_from_filepath(out_name)
+            n_centers = db.centroids().shape[0]
+            n_points = len(db.get_kmers())
+            self.assertGreater(n_centers, 0)
+            self.assertLess(n_centers, 100)
+            self.assertEqual(n_points, 100)
+            self.assertEqual(n_added, 100)
+            self.assertEqual(sorted(kmer for _, kmer in db.get_kmers()), sorted(
+                line.strip() for line in open(KMER_TABLE)
+            ))
+
+    def test_build_parallel_matches_serial(self):
+        with TemporaryDirectory() as tmpdir:
+            out_name = join(tmpdir, 'parallel.sqlite')
+            coordinate_parallel_build(
+                out_name, KMER_TABLE, KMER_ROTATION, 2, 0, 0, 0.5, 8, chunk_size=25
+            )
+            parallel = GridCoverDB.load_from_filepath(out_name)
+            ramifier = RotatingRamifier.from_file(8, KMER_ROTATION)
+            serial = GridCoverDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
+            grid = GridCoverBuilder(serial)
+            grid.fast_add_kmers_from_file(KMER_TABLE)
+            grid.commit()
+            self.assertTrue((parallel.centroids() == serial.centroids()).all())
+            self.assertEqual(
+                sorted(parallel.get_kmers()), sorted(serial.get_kmers())
+            )
+
+    def test_build_parallel_offset(self):
+        with TemporaryDirectory() as tmpdir:
+            out_name = join(tmpdir, 'parallel.sqlite')
+            coordinate_parallel_build(
+                out_name, KMER_TABLE, KMER_ROTATION, 2, 10, 50, 0.5, 8, chunk_size=7
+            )
+            db = GridCoverDB.load_from_filepath(out_name)
+            expected = [line.strip() for line in open(KMER_TABLE)][10:60]
+            self.assertEqual(sorted(kmer for _, kmer in db.get_kmers()), sorted(expected))
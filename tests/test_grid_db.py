@@ -5,16 +5,20 @@ import numpy as np
 
 from json import loads
 from os import remove
+from shutil import copyfile
 from os.path import join, dirname
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 
 from ariesk.dbs.kmer_db import GridCoverDB
+from ariesk.grid_builder import GridCoverBuilder
 from ariesk.grid_searcher import GridCoverSearcher
 from ariesk.pre_db import PreDB
 from ariesk.ram import RotatingRamifier
 
 KMER_TABLE = join(dirname(__file__), 'small_31mer_table.csv')
 KMER_ROTATION = join(dirname(__file__), '../data/rotation_minikraken.json')
+GRID_COVER = join(dirname(__file__), 'small_grid_cover.sqlite')
 KMER_31 = 'ATCGATCGATCGATCGATCGATCGATCGATG'
 KMER_30 = 'TTCGATCGATCGATCGATCGATCGATCGAC'
 
@@ -37,6 +41,14 @@ class TestGridCoverDB(TestCase):
         self.assertEqual(len(members), 1)
         self.assertIn(KMER_31, [reverse_convert_kmer(member) for member in members])
 
+    def test_reload_ramifier(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        db = GridCoverDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
+        loaded = GridCoverDB(db.conn).ramifier
+        self.assertEqual(loaded.k, ramifier.k)
+        self.assertTrue((np.asarray(loaded.rotation) == np.asarray(ramifier.rotation)).all())
+        self.assertTrue((loaded.ramify(KMER_31) == ramifier.ramify(KMER_31)).all())
+
     def test_add_kmer_to_pre(self):
         ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
         db = PreDB(sqlite3.connect(':memory:'), ramifier=ramifier)
@@ -44,7 +56,9 @@ class TestGridCoverDB(TestCase):
         db.commit()
         members = list(db.conn.execute('SELECT * FROM kmers'))
         self.assertEqual(len(members), 1)
-        self.assertIn(KMER_31, [reverse_convert_kmer(member[1]) for member in members])
+        self.assertTrue(db.packed_seqs)
+        self.assertEqual(len(members[0][1]), 8)
+        self.assertIn(KMER_31, [reverse_convert_kmer(db.decode_kmer_blob(member[1])) for member in members])
 
     def test_merge_dbs(self):
         ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
@@ -64,6 +78,44 @@ class TestGridCoverDB(TestCase):
         for char in 'ATCG':
             self.assertIn(KMER_30 + char, kmers)
 
+    def test_merge_file_dbs(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        with TemporaryDirectory() as tmpdir:
+            db1 = GridCoverDB(sqlite3.connect(join(tmpdir, 'db1.sqlite')), ramifier=ramifier, box_side_len=0.5)
+            db1.py_add_point_to_cluster(np.array([0., 0., 0., 0.]), KMER_30 + 'A')
+            db1.py_add_point_to_cluster(np.array([1., 0., 0., 0.]), KMER_30 + 'T')
+            db1.commit()
+            db2 = GridCoverDB(sqlite3.connect(join(tmpdir, 'db2.sqlite')), ramifier=ramifier, box_side_len=0.5)
+            db2.py_add_point_to_cluster(np.array([1., 1., 0., 0.]), KMER_30 + 'G')
+            db2.py_add_point_to_cluster(np.array([0., 0., 0., 0.]), KMER_30 + 'C')
+            db2.commit()
+            db1.load_other(db2)
+            self.assertEqual(db1.centroids().shape, (3, 4))
+            self.assertEqual(
+                sorted(db1.get_kmers()),
+                sorted([(0, KMER_30 + 'A'), (1, KMER_30 + 'T'), (2, KMER_30 + 'G'), (0, KMER_30 + 'C')])
+            )
+            db1.close()
+            db2.close()
+
+    def test_merge_legacy_db(self):
+        with TemporaryDirectory() as tmpdir:
+            legacy_filename = join(tmpdir, 'legacy.sqlite')
+            copyfile(GRID_COVER, legacy_filename)
+            legacy = GridCoverDB.load_from_filepath(legacy_filename)
+            self.assertFalse(legacy.packed_seqs)
+            db = GridCoverDB(
+                sqlite3.connect(join(tmpdir, 'packed.sqlite')), ramifier=legacy.ramifier, box_side_len=0.5
+            )
+            self.assertTrue(db.packed_seqs)
+            db.load_other(legacy)
+            self.assertEqual(
+                sorted(kmer for _, kmer in db.get_kmers()),
+                sorted(kmer for _, kmer in legacy.get_kmers())
+            )
+            db.close()
+            legacy.close()
+
     def test_get_centroids(self):
         ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
         db = GridCoverDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
@@ -74,6 +126,33 @@ class TestGridCoverDB(TestCase):
         centroids = db.centroids()
         self.assertEqual(centroids.shape, (2, 4))
 
+    def test_centroid_blocks(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        db = GridCoverDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
+        expected = np.zeros((25 * 1000, 4))
+        expected[:, 0] = np.arange(expected.shape[0])
+        for i in range(expected.shape[0]):
+            db.py_add_point_to_cluster(expected[i], KMER_31)
+            if i == 15 * 1000:
+                db.commit()
+        db.commit()
+        self.assertTrue((db.centroids() == expected).all())
+        self.assertTrue((GridCoverDB(db.conn).centroids() == expected).all())
+
+    def test_add_to_legacy_centroids(self):
+        DB_SAVE_TEMP_FILE = join(dirname(__file__), 'temp.db_legacy_temp.sqlite')
+        copyfile(GRID_COVER, DB_SAVE_TEMP_FILE)
+        db = GridCoverDB.load_from_filepath(DB_SAVE_TEMP_FILE)
+        centroids = db.centroids()
+        new_centroid = np.full(centroids.shape[1], 1000.)
+        db.py_add_point_to_cluster(new_centroid, KMER_31[:db.ramifier.k])
+        db.close()
+        db = GridCoverDB.load_from_filepath(DB_SAVE_TEMP_FILE)
+        self.assertTrue((db.centroids()[:-1] == centroids).all())
+        self.assertTrue((db.centroids()[-1] == new_centroid).all())
+        self.assertEqual(db.centroid_cache[new_centroid], centroids.shape[0])
+        remove(DB_SAVE_TEMP_FILE)
+
     def test_pre_build_blooms(self):
         ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
         db = GridCoverDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
@@ -109,3 +188,106 @@ class TestGridCoverDB(TestCase):
         self.assertEqual(len(members), 1)
         self.assertIn(KMER_31, [reverse_convert_kmer(member) for member in members])
         remove(DB_SAVE_TEMP_FILE)
+
+    def test_search_batch(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        db = GridCoverDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
+        GridCoverBuilder(db).fast_add_kmers_from_file(KMER_TABLE)
+        db.commit()
+        searcher = GridCoverSearcher(db)
+        kmers = [kmer for _, kmer in db.get_kmers()][:20]
+        for inner_metric in ['needle', 'none']:
+            batch_results = searcher.py_search_batch(kmers, 1, inner_metric=inner_metric)
+            self.assertEqual(len(batch_results), len(kmers))
+            for kmer, results in zip(kmers, batch_results):
+                self.assertEqual(
+                    sorted(results),
+                    sorted(searcher.py_search(kmer, 1, inner_metric=inner_metric))
+                )
+
+    def test_threaded_search(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        db = GridCoverDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
+        GridCoverBuilder(db).fast_add_kmers_from_file(KMER_TABLE)
+        db.commit()
+        serial = GridCoverSearcher(db)
+        threaded = GridCoverSearcher(db, threads=4)
+        kmers = [kmer for _, kmer in db.get_kmers()][:20]
+        for kmer in kmers:
+            self.assertEqual(
+                sorted(threaded.py_search(kmer, 10, inner_radius=0.5)),
+                sorted(serial.py_search(kmer, 10, inner_radius=0.5))
+            )
+        self.assertEqual(
+            threaded.py_search_batch(kmers, 10, inner_radius=0.5),
+            serial.py_search_batch(kmers, 10, inner_radius=0.5)
+        )
+        threaded.close()
+
+    def test_cluster_cache_budget(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        db = GridCoverDB(
+            sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5, cache_bytes=1
+        )
+        GridCoverBuilder(db).fast_add_kmers_from_file(KMER_TABLE)
+        db.commit()
+        db.pin_cluster(0)
+        for centroid_id in range(db.centroids().shape[0]):
+            db.build_and_store_bloom_grid(centroid_id)
+        self.assertEqual(list(db.cache.entries), [('cluster', 0)])
+        self.assertEqual(db.py_get_cluster_members(0).shape[1], 31)
+
+    def test_load_dense_inner_clusters(self):
+        with TemporaryDirectory() as tmpdir:
+            db_filename = join(tmpdir, 'legacy.sqlite')
+            copyfile(GRID_COVER, db_filename)
+            db = GridCoverDB.load_from_filepath(db_filename)
+            centroid_id, _, dense = list(db.conn.execute('SELECT * FROM inner_clusters'))[0]
+            n_seqs = int(np.sqrt(len(dense) // 8))
+            dense = np.zeros((n_seqs, n_seqs), dtype=np.uint64)
+            dense[0, 1:] = 1  # everything in the subcluster of seq 0
+            db.conn.execute(
+                'UPDATE inner_clusters SET inner_centers=?, inner_cluster_members=? WHERE centroid_id=?',
+                ('0', dense.tobytes(), centroid_id)
+            )
+            db.pin_cluster(centroid_id)
+            cluster = db.cache.get(('cluster', centroid_id))
+            self.assertEqual(list(cluster.inner_assignments), [-1] + [0] * (n_seqs - 1))
+            self.assertEqual(list(cluster.inner_members), list(range(1, n_seqs)))
+            db.close()
+
+    def test_finalize(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        db = GridCoverDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
+        GridCoverBuilder(db).fast_add_kmers_from_file(KMER_TABLE)
+        db.commit()
+        kmers = [kmer for _, kmer in db.get_kmers()][:20]
+        expected = GridCoverSearcher(db).py_search_batch(kmers, 1, inner_radius=0.5)
+        db.finalize()
+        db.cache.clear()
+        self.assertTrue(db.finalized)
+        n_blooms = list(db.conn.execute('SELECT count(*) FROM blooms'))[0][0]
+        finalized = GridCoverSearcher(db).py_search_batch(kmers, 1, inner_radius=0.5)
+        self.assertEqual(finalized, expected)
+        self.assertEqual(list(db.conn.execute('SELECT count(*) FROM blooms'))[0][0], n_blooms)
+        db.py_add_point_to_cluster(np.array([0., 0., 0., 0.]), KMER_31)
+        db.commit()
+        self.assertFalse(db.finalized)
+
+    def test_finalized_hamming_search(self):
+        ramifier = RotatingRamifier.from_file(4, KMER_ROTATION)
+        db = GridCoverDB(sqlite3.connect(':memory:'), ramifier=ramifier, box_side_len=0.5)
+        GridCoverBuilder(db).fast_add_kmers_from_file(KMER_TABLE)
+        db.commit()
+        kmers = [kmer for _, kmer in db.get_kmers()][:20]
+        expected = GridCoverSearcher(db).py_search_batch(
+            kmers, 1, inner_radius=0.2, inner_metric='hamming'
+        )
+        db.finalize()
+        db.cache.clear()
+        searcher = GridCoverSearcher(db)
+        finalized = searcher.py_search_batch(kmers, 1, inner_radius=0.2, inner_metric='hamming')
+        self.assertEqual(finalized, expected)
+        centroid_id = list(db.conn.execute('SELECT centroid_id FROM cluster_bundles'))[0][0]
+        db.pin_cluster(centroid_id)
+        self.assertIsNotNone(db.cache.get(('cluster', centroid_id)).packed_seqs)
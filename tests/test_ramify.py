@@ -1,13 +1,18 @@
 
+import numpy as np
+
 from os.path import join, dirname
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from ariesk.ram import (
     Ramifier,
     StatisticalRam,
     RotatingRamifier,
 )
+from ariesk.utils.kmers import py_encode_kmer
 
 KMER_TABLE = join(dirname(__file__), 'small_annotated_31mer_table.csv')
+KMER_ROTATION = join(dirname(__file__), '../data/rotation_minikraken.json')
 
 
 class TestRamify(TestCase):
@@ -45,3 +50,69 @@ class TestRamify(TestCase):
         rotater = RotatingRamifier(31, 8, rotation, centers, scales)
         rft = rotater.ramify('ATCGATCGATCGATCGATCGATCGATCGATC')
         self.assertTrue(rft.shape == (8,))
+
+    def test_ramify_windows(self):
+        ramifier = Ramifier(31)
+        seq = 'ATCGATCGATCGATCGATCGATCGATCGATCGGTTACNAGCTAGGACTAC'
+        rfts = ramifier.ramify_windows(seq, gap=3)
+        self.assertEqual(rfts.shape, ((len(seq) - 31) // 3 + 1, 4 * 31))
+        for i, start in enumerate(range(0, len(seq) - 31 + 1, 3)):
+            self.assertTrue(np.allclose(rfts[i], ramifier.ramify(seq[start:start + 31])))
+
+    def test_rotating_ramify_windows(self):
+        stat_ram = StatisticalRam(31, 100)
+        stat_ram.add_kmers_from_file(KMER_TABLE)
+        rotater = RotatingRamifier(
+            31, 8, stat_ram.get_rotation(), stat_ram.get_centers(), stat_ram.get_scales()
+        )
+        seq = 'ATCGATCGATCGATCGATCGATCGATCGATCGGTTACGAGCTAGGACTAC'
+        rfts = rotater.ramify_windows(seq)
+        self.assertEqual(rfts.shape, (len(seq) - 31 + 1, 8))
+        for i in range(rfts.shape[0]):
+            self.assertTrue(np.allclose(rfts[i], rotater.ramify(seq[i:i + 31])))
+
+    def test_rotating_ramify_batch(self):
+        stat_ram = StatisticalRam(31, 100)
+        stat_ram.add_kmers_from_file(KMER_TABLE)
+        rotater = RotatingRamifier(
+            31, 8, stat_ram.get_rotation(), stat_ram.get_centers(), stat_ram.get_scales()
+        )
+        kmers = [line.split(',')[0] for line in open(KMER_TABLE)][:10]
+        kmers.append('ATCGATCGATCGANCGATCGATCGATCGATC')
+        rfts = rotater.ramify_batch(np.array([py_encode_kmer(kmer) for kmer in kmers]))
+        self.assertEqual(rfts.shape, (len(kmers), 8))
+        for i, kmer in enumerate(kmers):
+            self.assertTrue(np.allclose(rfts[i], rotater.ramify(kmer)))
+
+    def test_fused_projection(self):
+        stat_ram = StatisticalRam(31, 100)
+        stat_ram.add_kmers_from_file(KMER_TABLE)
+        centers, scales = stat_ram.get_centers(), stat_ram.get_scales()
+        rotation = stat_ram.get_rotation()
+        rotater = RotatingRamifier(31, 8, rotation, centers, scales)
+        for kmer in ['ATCGATCGATCGATCGATCGATCGATCGATC', 'ATCGATCGATCGANCGATCGATCGATCGATT']:
+            rft = stat_ram.ramifier.ramify(kmer)
+            expected = np.dot(rotation[:8, :], (rft - centers) / scales)
+            self.assertTrue(np.allclose(rotater.ramify(kmer), expected))
+
+    def test_threaded_ramify_batch(self):
+        stat_ram = StatisticalRam(31, 100)
+        stat_ram.add_kmers_from_file(KMER_TABLE)
+        args = (31, 8, stat_ram.get_rotation(), stat_ram.get_centers(), stat_ram.get_scales())
+        kmers = np.array([
+            py_encode_kmer(line.split(',')[0]) for line in open(KMER_TABLE)
+        ])
+        single = RotatingRamifier(*args).ramify_batch(kmers)
+        threaded = RotatingRamifier(*args, threads=4).ramify_batch(kmers)
+        self.assertTrue((single == threaded).all())
+
+    def test_rotation_npy_file(self):
+        ramifier = RotatingRamifier.from_file(8, KMER_ROTATION)
+        kmer = 'ATCGATCGATCGATCGATCGATCGATCGATC'
+        with TemporaryDirectory() as tmpdir:
+            filepath = join(tmpdir, 'rotation.npy')
+            ramifier.to_file(filepath)
+            mapped = RotatingRamifier.from_file(8, filepath)
+            self.assertEqual(mapped.k, ramifier.k)
+            self.assertTrue((mapped.ramify(kmer) == ramifier.ramify(kmer)).all())
+            del mapped
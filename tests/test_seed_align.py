@@ -1,10 +1,15 @@
 
 import random
+import sqlite3
 
 from os.path import join, dirname
 from unittest import TestCase, skip
 
 from ariesk.seed_align import py_seed_extend
+from ariesk.dbs.contig_db import ContigDB
+from ariesk.ram import RotatingRamifier
+
+KMER_ROTATION = join(dirname(__file__), '../data/rotation_minikraken.json')
 
 QUERY = 'ATCGATCGATCGATCGATCGATCGATCGATCGATCGATCGATCGATCG'
 seq2 = 'ATATATATATATATATATATATATATATATATATATATATATATATAT'
@@ -63,3 +68,37 @@ class TestSeedExtend(TestCase):
         self.assertEqual(matching_intervals.shape[0], 1)
         self.assertLessEqual(matching_intervals[0, 1] - matching_intervals[0, 0], 60)
         self.assertGreaterEqual(matching_intervals[0, 1] - matching_intervals[0, 0], 40)
+
+    def test_seed_extend_stored_index(self):
+        contig_db = ContigDB(
+            sqlite3.connect(':memory:'),
+            ramifier=RotatingRamifier.from_file(4, KMER_ROTATION),
+            box_side_len=0.5,
+            store_seed_indices=True
+        )
+        target = seq3 + seq2 + QUERY + seq2 + seq3
+        contig_db.py_add_contig('test_genome___test_contig', target, gap=100)
+        contig_db.commit()
+        stored = contig_db.conn.execute('SELECT seed_index FROM seed_indices').fetchall()
+        self.assertEqual(len(stored), 1)
+        self.assertTrue(ContigDB(contig_db.conn).store_seed_indices)
+        self.assertEqual(
+            contig_db.py_seed_extend(QUERY, 'test_genome___test_contig').tolist(),
+            py_seed_extend(QUERY, target).tolist()
+        )
+
+    def test_seed_extend_built_index(self):
+        contig_db = ContigDB(
+            sqlite3.connect(':memory:'),
+            ramifier=RotatingRamifier.from_file(4, KMER_ROTATION),
+            box_side_len=0.5
+        )
+        target = seq3 + seq2 + QUERY + seq2 + seq3
+        contig_db.py_add_contig('test_genome___test_contig', target, gap=100)
+        contig_db.commit()
+        stored = contig_db.conn.execute('SELECT seed_index FROM seed_indices').fetchall()
+        self.assertEqual(len(stored), 0)
+        self.assertEqual(
+            contig_db.py_seed_extend(QUERY, 'test_genome___test_contig').tolist(),
+            py_seed_extend(QUERY, target).tolist()
+        )
@@ -1,8 +1,11 @@
 
+import gzip
 import random
+import numpy as np
 
 
 from os.path import join, dirname
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from ariesk.utils.dists import DistanceFactory
 
@@ -12,8 +15,19 @@ from ariesk.utils.kmers import (
     py_needle,
     py_needle_fast,
     py_bounded_needle_fast,
+    py_pack_kmers,
+    py_unpack_kmers,
+    py_pack_seq,
+    py_unpack_seq,
+    py_hamming_packed,
+    py_minimizer_starts,
+    py_bounded_edit_dist,
+    py_bounded_edit_dists,
 )
 from ariesk.linear_searcher import LinearSearcher
+from ariesk.utils.cell_table import CellTable
+from ariesk.utils.lru_cache import LRUCache
+from ariesk.utils.seq_reader import SeqReader
 
 KMER_TABLE = join(dirname(__file__), 'small_31mer_table.csv')
 KMER_ROTATION = join(dirname(__file__), '../data/rotation_minikraken.json')
@@ -72,6 +86,16 @@ class TestUtils(TestCase):
         dist = py_bounded_needle_fast(KMER_31, KMER_31, 0, normalize=False)
         self.assertEqual(dist, 0)
 
+    def test_bounded_needle_over_bound(self):
+        self.assertEqual(py_bounded_needle_fast(KMER_31, GAP, 2), 2)
+        self.assertGreater(py_bounded_needle_fast(KMER_31, GAP, 1), 1)
+        self.assertGreater(py_bounded_needle_fast(KMER_31, KMER_31[:-3], 2), 2)
+
+    def test_needle_unequal_lengths(self):
+        kmer = 'GATTACAGGCTTAACCGTAGCATGCCATTGACGGTTCAGA'
+        needle = py_needle([kmer, kmer[:10] + kmer[12:] + 'TT', kmer[5:]], normalize=False)
+        self.assertEqual([dist for _, _, dist in needle][:2], [4, 5])
+
     def test_needle(self):
         kmers = [KMER_31, MIS, GAP]
         needle = py_needle(kmers, normalize=False)
@@ -81,6 +105,17 @@ class TestUtils(TestCase):
                 ex_dist = 2
             self.assertEqual(dist, ex_dist)
 
+    def test_bounded_edit_dist(self):
+        kmers = [KMER_31, MIS, GAP]
+        needle = py_needle(kmers, normalize=False)
+        for k1, k2, dist in needle:
+            self.assertEqual(py_bounded_edit_dist(k1, k2, 2), dist)
+        self.assertGreater(py_bounded_edit_dist(KMER_31, GAP, 1), 1)
+        long_kmer = random_kmer(150)
+        gapped = long_kmer[:70] + long_kmer[71:] + 'A'
+        self.assertEqual(py_bounded_edit_dist(long_kmer, gapped, 5), py_needle([long_kmer, gapped])[0][2])
+        self.assertEqual(list(py_bounded_edit_dists(KMER_31, kmers, 2)), [0, 1, 2])
+
     def test_needle_fast(self):
         kmers = [KMER_31, MIS, GAP]
         needle = py_needle_fast(kmers, normalize=False)
@@ -99,3 +134,91 @@ class TestUtils(TestCase):
         searcher = LinearSearcher.from_filepath(GRID_COVER)
         results = searcher.search(KMER_31, metric='hamming')
         self.assertEqual(len(results), 100)
+
+    def test_cell_table(self):
+        cells = np.random.randint(-1000, 1000, size=(5000, 8)).astype(float)
+        table = CellTable(8, capacity=4)
+        ids = [table.py_add(cell) for cell in cells]
+        _, first_seen, expected = np.unique(cells, axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(np.argsort(first_seen))  # ids follow order of first appearance
+        self.assertEqual(ids, [order[el] for el in expected.flatten()])
+        self.assertEqual(len(table), len(first_seen))
+        self.assertTrue((table.centroids() == cells[np.sort(first_seen)]).all())
+        self.assertNotIn(np.full(8, 5000.), table)
+        self.assertRaises(ValueError, lambda: table.py_add(np.full(8, 0.5)))
+
+    def test_lru_cache(self):
+        cache = LRUCache(100)
+        cache.put('a', 'A', 40)
+        cache.put('b', 'B', 40)
+        self.assertEqual(cache.get('a'), 'A')  # b is now least recently used
+        cache.pin('b')
+        cache.put('c', 'C', 40)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.get('b'), 'B')
+        self.assertIsNone(cache.get('a'))
+        cache.put('d', 'D', 200)  # too big to ever fit
+        self.assertNotIn('d', cache)
+        cache.unpin('b')
+        cache.put('e', 'E', 60)
+        self.assertEqual(sorted(cache.entries), ['b', 'e'])
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (2, 1, 2))
+        self.assertEqual(stats['bytes'], 100)
+
+    def test_pack_kmers(self):
+        kmers = [''.join(random.choice('ACGT') for _ in range(31)) for _ in range(10)]
+        packed = py_pack_kmers(kmers)
+        self.assertEqual(packed.shape, (10, 8))
+        self.assertEqual(py_unpack_kmers(packed, 31), kmers)
+
+    def test_pack_seq(self):
+        seq = 'NN' + ''.join(random.choice('ACGT') for _ in range(40)) + 'NNNAC' + 'N'
+        packed = py_pack_seq(seq)
+        self.assertEqual(len(packed), 12 + 3 * 8)  # 48 bases, 3 runs of N
+        self.assertEqual(py_unpack_seq(packed, len(seq)), seq)
+        self.assertEqual(len(py_pack_seq('ACGT' * 8)), 8)
+
+    def test_minimizer_starts(self):
+        seq = ''.join(random.choice('ACGT') for _ in range(1000))
+        starts = py_minimizer_starts(seq, 15, 10)
+        self.assertTrue((np.diff(starts) > 0).all())
+        self.assertTrue((np.diff(starts) <= 10).all())  # every window holds a minimizer
+        self.assertLess(len(starts), (1000 - 15 + 1) / 2)
+        shifted = set((py_minimizer_starts(seq[100:], 15, 10) + 100).tolist())
+        self.assertTrue(shifted <= set(starts.tolist()))
+
+    def test_minimizer_starts_reverse_complement(self):
+        random.seed(0)
+        for k in [15, 40]:
+            seq = ''.join(random.choice('ACGT') for _ in range(1000))
+            rev_comp = seq[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+            starts = py_minimizer_starts(seq, k, 10)
+            mirrored = len(seq) - k - py_minimizer_starts(rev_comp, k, 10)
+            self.assertEqual(sorted(mirrored.tolist()), starts.tolist())
+
+    def test_seq_reader(self):
+        records = [
+            (f'seq_{i} sample', ''.join(random.choice('ACGTN') for _ in range(random.randint(1, 300))))
+            for i in range(10)
+        ]
+        with TemporaryDirectory() as tmpdir:
+            fasta, fastq = join(tmpdir, 'seqs.fa'), join(tmpdir, 'seqs.fq.gz')
+            with open(fasta, 'w') as f:  # multi-line, lower case and no final line break
+                for name, seq in records:
+                    lines = [seq[i:i + 60] for i in range(0, len(seq), 60)]
+                    f.write(f'>{name}\n' + '\n'.join(lines).lower() + '\n')
+                f.write('>last\nACGT')
+            with gzip.open(fastq, 'wt') as f:
+                for name, seq in records:
+                    f.write(f'@{name}\n{seq}\n+\n' + '@' * len(seq) + '\n')
+            read_fasta = [(name, py_decode_kmer(seq)) for name, seq in SeqReader(fasta)]
+            read_fastq = [(name, py_decode_kmer(seq)) for name, seq in SeqReader(fastq)]
+        self.assertEqual(read_fasta, records + [('last', 'ACGT')])
+        self.assertEqual(read_fastq, records)
+
+    def test_hamming_packed(self):
+        k1 = ''.join(random.choice('ACGT') for _ in range(40))
+        k2 = 'T' + k1[1:20] + ('A' if k1[20] != 'A' else 'C') + k1[21:]
+        self.assertEqual(py_hamming_packed(k1, k1), 0)
+        self.assertEqual(py_hamming_packed(k1, k2), (k1[0] != 'T') + 1)